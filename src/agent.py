@@ -7,15 +7,24 @@ import os
 import time
 import asyncio
 import logging
+from collections import deque
+from datetime import date, datetime
 from typing import Dict, Optional
 from claude_agent_sdk import (
     ClaudeAgentOptions,
     ClaudeSDKClient,
+    HookMatcher,
     AssistantMessage,
     TextBlock,
     ToolUseBlock,
     ResultMessage,
 )
+from agent_tools import (
+    create_archive_server, create_access_hook, archive_tool_name, ARCHIVE_SERVER_NAME, FILE_TOOLS, ArchiveBinding,
+)
+from client_pool import ClientPool
+from answer_cache import AnswerCache, normalize_question, is_follow_up
+from sessions import SessionManager, SESSION_CLOSE_TIMEOUT
 
 logger = logging.getLogger(__name__)
 
@@ -25,14 +34,36 @@ SESSION_TIMEOUT = int(os.getenv('SESSION_TIMEOUT', 30 * 60))
 # Минимальное время показа статуса в секундах (задача 6.2)
 MIN_STATUS_DISPLAY_TIME = float(os.getenv('MIN_STATUS_DISPLAY_TIME', 2.0))
 
+# Сколько ответов из кэша передать сессии с ближайшим запросом и их длина
+MAX_CACHED_EXCHANGES = 3
+MAX_CACHED_ANSWER_CHARS = 1000
+
+# Пути архива в system prompt клиента из пула: чат ещё неизвестен, пути - от папки чата
+POOLED_PROMPT_PATHS = {
+    'chat_dir': 'папка чата',
+    'history_file': 'history.txt',
+    'recent_file': 'history_recent.txt',
+    'manifest_file': 'history/manifest.json',
+    'media_dir': 'media',
+    'agent_files_dir': 'agent_files',
+    'export_dir': 'exports',
+}
+
 
 class ClaudeAgent:
     """AI-агент на базе Claude Agent SDK с управлением сессиями"""
 
     def __init__(self):
         """Инициализация агента"""
-        self.active_clients: Dict[int, ClaudeSDKClient] = {}
-        self.last_activity: Dict[int, float] = {}
+        self.sessions = SessionManager(SESSION_TIMEOUT)
+        self.pool = ClientPool(self._start_pooled_client, self._stop_pooled_client)
+
+        # Привязка к чату для первого запроса сессий, взятых из пула
+        self._pending_bindings: Dict[int, str] = {}
+
+        # Кэш ответов и ответы из кэша, которых ещё не видела сессия чата
+        self.cache = AnswerCache()
+        self._cached_exchanges: Dict[int, deque] = {}
 
         # Проверка токена
         self.oauth_token = os.getenv('CLAUDE_CODE_OAUTH_TOKEN')
@@ -41,23 +72,61 @@ class ClaudeAgent:
 
         logger.info("[AGENT] ClaudeAgent initialized")
 
-    def get_system_prompt(self, chat_id: int, archive_paths: dict) -> str:
+    def get_pooled_system_prompt(self) -> str:
         """
-        Динамический system prompt с путями к архиву (задача 3.3)
+        System prompt клиента из пула: без путей конкретного чата
+
+        Файлы указаны относительно папки чата; доступ за её пределы закрывает
+        хук create_access_hook по привязке, назначенной при выдаче клиента чату.
+
+        Returns:
+            System prompt для агента
+        """
+        prompt = self.get_system_prompt(None, POOLED_PROMPT_PATHS)
+        return (
+            "Папка твоего чата придёт в первом сообщении беседы; пути ниже указаны "
+            "относительно неё. В Read/Grep/Glob передавай полные пути, команды Bash "
+            "начинай с cd в папку чата. Файлы вне папки чата недоступны: такие вызовы "
+            "инструментов отклоняются.\n\n" + prompt
+        )
+
+    def get_binding_preamble(self, chat_id: int, archive_paths: dict) -> str:
+        """
+        Папка чата для клиента из пула (перед первым запросом)
 
         Args:
             chat_id: ID чата
+            archive_paths: Пути к директориям архива
+
+        Returns:
+            Текст привязки к чату
+        """
+        return (
+            f"[Ты подключён к чату {chat_id}. Папка чата: {archive_paths['chat_dir']}. "
+            f"Сегодня: {datetime.now():%Y-%m-%d}.]"
+        )
+
+    def get_system_prompt(self, chat_id: Optional[int], archive_paths: dict) -> str:
+        """
+        Динамический system prompt с путями к архиву (задача 3.3)
+
+        Args:
+            chat_id: ID чата (None - клиент из пула, чат ещё неизвестен)
             archive_paths: Словарь с путями к директориям архива
 
         Returns:
             System prompt для агента
         """
+        chat_title = f"Telegram чата {chat_id}" if chat_id is not None else "Telegram чата"
         chat_dir = archive_paths['chat_dir']
         history_file = archive_paths['history_file']
+        recent_file = archive_paths['recent_file']
+        manifest_file = archive_paths['manifest_file']
         media_dir = archive_paths['media_dir']
         agent_files_dir = archive_paths['agent_files_dir']
+        export_dir = archive_paths['export_dir']
 
-        return f"""Привет! 👋 Ты AI-ассистент для Telegram чата {chat_id}.
+        return f"""Привет! 👋 Ты AI-ассистент для {chat_title}.
 
 Твоя задача — помогать пользователям работать с архивом переписки и данными.
 Ты можешь делать анализ данных, работать с Excel/CSV, строить графики, создавать отчёты, выполнять расчёты!
@@ -102,25 +171,43 @@ class ClaudeAgent:
 ═══════════════════════════════════════════════════════════════
 
 {chat_dir}/
-├── history.txt          ← вся история переписки
-├── media/               ← файлы от пользователей (фото, документы)
-│   ├── photo_*.jpg
-│   ├── document.xlsx
+├── history_recent.txt   ← последние сообщения (маленький файл, читай его первым!)
+├── history.txt          ← история переписки (большой файл!)
+├── history.txt.cold.gz  ← старые месяцы истории, сжатые (если есть; продолжение - history.txt)
+├── history/
+│   └── manifest.json    ← оглавление истории по месяцам: период, число строк, размер
+├── events.jsonl         ← та же история в JSON, по событию в строке (для скриптов)
+├── events.jsonl.cold.gz ← старые месяцы events.jsonl, сжатые (если есть)
+├── exports/             ← та же история в Parquet по месяцам (для pandas, быстро!)
+├── media/               ← файлы от пользователей (фото, документы), по месяцам
+│   ├── 2025/03/photo_*.jpg
+│   ├── 2025/03/document.xlsx
 │   └── ...
 └── agent_files/         ← ТВОИ файлы (графики, отчёты, результаты)
     ├── chart.png        ← сюда сохраняй графики
     ├── report.xlsx      ← сюда сохраняй отчёты
     └── ...
 
+Сегодня: {datetime.now():%Y-%m-%d} (в строках history.txt год не указан)
 Рабочая директория: {chat_dir}
+Последние сообщения: {recent_file}
 История: {history_file}
-Файлы пользователя: {media_dir}/
+Оглавление истории по месяцам: {manifest_file}
+Файлы пользователя: {media_dir}/YYYY/MM/ (путь к файлу - в строке истории;
+  если старого пути нет, файл перенесён в папку месяца: см. {chat_dir}/media_legacy.json)
 Твои файлы: {agent_files_dir}/
 
 ═══════════════════════════════════════════════════════════════
 ДОСТУПНЫЕ ИНСТРУМЕНТЫ 🛠️
 ═══════════════════════════════════════════════════════════════
 
+• search_history: быстрый полнотекстовый поиск по истории (ищи им в первую очередь!)
+• history_window: сообщения за период (start/end в ISO: 2025-03-12, 2025-03-12T10:00)
+• history_count, history_tail, history_lines: число строк истории, последние N строк,
+  строки по номерам (start/end) - мгновенно, без чтения файла целиком
+• chat_stats: готовая статистика активности (по участникам, дням, часам, дням недели)
+• list_media: файлы чата с датой, типом и размером (фильтры kind, name, month)
+• spreadsheet_summary: сводка Excel/CSV - листы, столбцы, итоги, первые строки
 • Read: читать файлы (history.txt, Excel, CSV, JSON, текст)
 • Grep: искать по паттернам в истории переписки и файлах
 • Glob: находить файлы по маске (*.xlsx, *.csv, photo_*)
@@ -135,6 +222,7 @@ class ClaudeAgent:
 
 📊 РАБОТА С ДАННЫМИ:
    • pandas 2.1.4        - DataFrame, Excel, CSV, группировки, статистика
+   • pyarrow 14.0.2      - чтение Parquet (pd.read_parquet)
    • numpy 1.26.3        - массивы, математические операции, линейная алгебра
    • openpyxl 3.1.5      - чтение/запись Excel (.xlsx) с форматированием
 
@@ -150,7 +238,7 @@ class ClaudeAgent:
 
 # Excel и pandas:
 import pandas as pd
-df = pd.read_excel('{media_dir}/data.xlsx')
+df = pd.read_excel('{media_dir}/2025/03/data.xlsx')
 result = df.groupby('category')['amount'].sum()
 result.to_excel('{agent_files_dir}/report.xlsx')
 
@@ -161,6 +249,15 @@ plt.plot(x, y)
 plt.savefig('{agent_files_dir}/chart.png')
 plt.close()
 
+# Статистика по переписке - через Parquet, НЕ парси history.txt построчно:
+df = pd.read_parquet('{export_dir}')
+# колонки: ts, date, hour, chat_id, kind (text/photo/document/voice/video_note/
+#          system/bot_response/bot_file), sender, sender_id, message_id,
+#          reply_to, text, media_path, event_type, month
+df[df.kind == 'text'].groupby('sender').size()          # кто больше пишет
+df.groupby('date').size()                                # сообщений по дням
+pd.read_parquet('{export_dir}', filters=[('month', '=', '2025-03')])  # один месяц
+
 # NumPy для расчётов:
 import numpy as np
 mean = np.mean(data)
@@ -182,12 +279,36 @@ std = np.std(data)
 
    💡 Большие данные и детали → выноси в файлы (.xlsx, .csv, .txt)
 
-2. АНАЛИЗ ДАННЫХ:
+2. ПОИСК ПО ИСТОРИИ:
+   • Вопрос про недавнее ("о чём сейчас говорили?", "что он ответил?") →
+     СНАЧАЛА прочитай {recent_file} (последние сообщения, формат как в history.txt);
+     только если там ответа нет - переходи к поиску ниже
+   • Найти сообщения по словам, имени или файлу → инструмент search_history
+     (результаты по релевантности, для продолжения передай page=2, 3, ...)
+   • Вопрос про конкретный день или период ("что обсуждали 12.03?") →
+     инструмент history_window (читает только нужный кусок истории)
+   • "Что было последним?", "сколько всего сообщений?" → history_tail / history_count;
+     продолжить чтение с нужного места → history_lines
+   • "Кто пишет больше всех?", "сколько сообщений по дням?", "сколько файлов
+     прислал Иван?" → chat_stats (не считай это в pandas по всей истории)
+   • "Какие файлы присылали?", "последний отчёт", "фото за март" → list_media
+     (вместо Glob/ls по media/)
+   • Если период большой (месяцы) → сначала прочитай {manifest_file}
+     (месяцы: период, число строк, размер), затем читай нужные месяцы через
+     history_window, а не history.txt целиком
+   • Сжатые документы media/YYYY/MM/*.csv.gz pandas читает напрямую: pd.read_csv(path)
+   • history.txt целиком читай, только если нужна вся история; старые месяцы
+     сжаты в history.txt.cold.gz - инструменты истории читают их сами, в Bash:
+     zcat history.txt.cold.gz; cat history.txt
+
+3. АНАЛИЗ ДАННЫХ:
+   • Сначала посмотри таблицу через spreadsheet_summary: листы, столбцы и итоги
+     часто уже отвечают на вопрос; pandas - только для расчётов сверх сводки
    • Используй pandas для Excel/CSV: pd.read_excel(), pd.read_csv()
    • Используй matplotlib для графиков: plt.plot(), plt.bar(), plt.savefig()
    • Сохраняй ВСЕ результаты в {agent_files_dir}/
 
-3. АВТООТПРАВКА ФАЙЛОВ 📤 (ВАЖНО!):
+4. АВТООТПРАВКА ФАЙЛОВ 📤 (ВАЖНО!):
 
    🎯 Когда ты упоминаешь ПОЛНЫЙ ПУТЬ к файлу в своём ответе -
       файл АВТОМАТИЧЕСКИ отправляется пользователю в Telegram!
@@ -205,15 +326,15 @@ std = np.std(data)
    💡 Можешь также использовать просто имя файла в backticks: `chart.png`
       Бот найдёт его в agent_files/ и отправит!
 
-4. СОЗДАНИЕ ФАЙЛОВ:
+5. СОЗДАНИЕ ФАЙЛОВ:
    • ВСЕГДА указывай ПОЛНЫЙ ПУТЬ при создании:
      plt.savefig('{agent_files_dir}/chart.png')
      df.to_excel('{agent_files_dir}/report.xlsx')
 
-   • После создания упомяни файл в ответе (см. пункт 3)
+   • После создания упомяни файл в ответе (см. пункт 4)
 
-5. БЕЗОПАСНОСТЬ:
-   • Работай ТОЛЬКО в директории {chat_dir}
+6. БЕЗОПАСНОСТЬ:
+   • Работай ТОЛЬКО в директории {chat_dir} (вызовы за её пределами отклоняются)
    • НЕ обращайся к другим чатам
    • НЕ читай системные файлы
 
@@ -276,9 +397,119 @@ std = np.std(data)
             pattern = tool_input.get('pattern', '')
             return f"📁 Ищу файлы: {pattern}"
 
+        elif tool_name == archive_tool_name("search_history"):
+            query = tool_input.get('query', '')
+            return f"🔎 Ищу в архиве: «{query}»"
+
+        elif tool_name == archive_tool_name("history_window"):
+            start = tool_input.get('start', '')
+            end = tool_input.get('end', '')
+            period = f"{start} — {end}" if end else start
+            return f"🗓️ Смотрю переписку за {period}"
+
+        elif tool_name == archive_tool_name("history_count"):
+            return "🔢 Считаю сообщения в архиве"
+
+        elif tool_name == archive_tool_name("history_tail"):
+            return f"📜 Читаю последние {tool_input.get('n', 50)} строк истории"
+
+        elif tool_name == archive_tool_name("history_lines"):
+            start = tool_input.get('start', '')
+            end = tool_input.get('end', '')
+            return f"📜 Читаю строки истории {start}–{end}" if end else f"📜 Читаю историю со строки {start}"
+
+        elif tool_name == archive_tool_name("chat_stats"):
+            return "📊 Смотрю статистику чата"
+
+        elif tool_name == archive_tool_name("list_media"):
+            return "🗂️ Смотрю файлы чата"
+
+        elif tool_name == archive_tool_name("spreadsheet_summary"):
+            file_path = tool_input.get('path', '')
+            filename = file_path.split('/')[-1] if file_path else 'таблицу'
+            return f"📑 Изучаю таблицу: {filename}"
+
         else:
             return f"🔧 {tool_name}"
 
+    def start(self):
+        """Запуск фоновых задач: закрытие простаивающих сессий и пополнение пула клиентов"""
+        self.sessions.start()
+        self.pool.start()
+
+    def _client_options(
+        self, system_prompt: str, binding: ArchiveBinding, cwd: Optional[str] = None
+    ) -> ClaudeAgentOptions:
+        """
+        Параметры клиента: system prompt, инструменты архива чата и проверка путей
+
+        Args:
+            system_prompt: System prompt
+            binding: Привязка к архиву чата (у клиента из пула - пустая до выдачи чату)
+            cwd: Рабочая директория (папка чата; у клиента из пула - директория процесса)
+        """
+        return ClaudeAgentOptions(
+            system_prompt=system_prompt,
+            cwd=cwd,
+            mcp_servers={ARCHIVE_SERVER_NAME: create_archive_server(binding)},
+            hooks={'PreToolUse': [HookMatcher(matcher='|'.join(FILE_TOOLS), hooks=[create_access_hook(binding, cwd)])]},
+            allowed_tools=[
+                "Read", "Bash", "Grep", "Glob",
+                archive_tool_name("search_history"),
+                archive_tool_name("history_window"),
+                archive_tool_name("history_count"),
+                archive_tool_name("history_tail"),
+                archive_tool_name("history_lines"),
+                archive_tool_name("chat_stats"),
+                archive_tool_name("list_media"),
+                archive_tool_name("spreadsheet_summary"),
+            ],
+            model="sonnet",
+            include_partial_messages=True,
+        )
+
+    async def _start_pooled_client(self):
+        """Запуск клиента для пула (ещё не привязан к чату)"""
+        binding = ArchiveBinding()
+        client = ClaudeSDKClient(options=self._client_options(self.get_pooled_system_prompt(), binding))
+        await client.__aenter__()
+        return client, binding
+
+    async def _stop_pooled_client(self, pooled):
+        """Остановка клиента из пула"""
+        client, _ = pooled
+        await asyncio.wait_for(client.__aexit__(None, None, None), SESSION_CLOSE_TIMEOUT)
+
+    async def _create_client(self, chat_id: int, archive_paths: dict) -> ClaudeSDKClient:
+        """
+        Клиент для новой сессии чата: из пула или запуск по запросу
+
+        Args:
+            chat_id: ID чата
+            archive_paths: Пути к директориям архива
+
+        Returns:
+            Запущенный клиент Claude SDK
+        """
+        pooled = self.pool.take()
+        if pooled is not None:
+            client, binding = pooled
+            binding.bind(chat_id, archive_paths)
+            self._pending_bindings[chat_id] = self.get_binding_preamble(chat_id, archive_paths)
+            logger.info(f"[SESSION] Took pre-started client for chat_id={chat_id}")
+            return client
+
+        self._pending_bindings.pop(chat_id, None)
+        started_at = time.monotonic()
+        options = self._client_options(
+            self.get_system_prompt(chat_id, archive_paths), ArchiveBinding(chat_id, archive_paths),
+            cwd=archive_paths['chat_dir'],
+        )
+        client = ClaudeSDKClient(options=options)
+        await client.__aenter__()
+        self.pool.observe_cold_start(time.monotonic() - started_at)
+        return client
+
     async def get_or_create_client(
         self,
         chat_id: int,
@@ -287,6 +518,9 @@ std = np.std(data)
         """
         Получение или создание клиента с проверкой таймаута (задача 4.1, 4.3)
 
+        Сессия считается занятой до release_client(): её не вытесняют
+        и не закрывают по простою.
+
         Args:
             chat_id: ID чата
             archive_paths: Пути к директориям архива
@@ -294,47 +528,22 @@ std = np.std(data)
         Returns:
             Клиент Claude SDK
         """
-        current_time = time.time()
-
-        # Проверка таймаута существующей сессии
-        if chat_id in self.active_clients:
-            last_time = self.last_activity.get(chat_id, 0)
-
-            if current_time - last_time > SESSION_TIMEOUT:
-                # Сессия устарела - закрываем
-                logger.info(f"[SESSION] Session expired for chat_id={chat_id}, creating new")
-                old_client = self.active_clients[chat_id]
-                await old_client.__aexit__(None, None, None)
-                del self.active_clients[chat_id]
-
-        # Создание нового клиента если нет
-        if chat_id not in self.active_clients:
-            logger.info(f"[SESSION] New session for chat_id={chat_id}")
-
-            options = ClaudeAgentOptions(
-                system_prompt=self.get_system_prompt(chat_id, archive_paths),
-                allowed_tools=["Read", "Bash", "Grep", "Glob"],
-                model="sonnet",
-                include_partial_messages=True,
-            )
-
-            client = ClaudeSDKClient(options=options)
-            await client.__aenter__()
-            self.active_clients[chat_id] = client
-        else:
-            logger.info(f"[SESSION] Continue session for chat_id={chat_id}")
+        return await self.sessions.acquire(
+            chat_id, lambda: self._create_client(chat_id, archive_paths)
+        )
 
-        # Обновление времени активности
-        self.last_activity[chat_id] = current_time
-
-        return self.active_clients[chat_id]
+    def release_client(self, chat_id: int):
+        """Запрос чата обработан - сессия снова может закрыться по простою"""
+        self.sessions.release(chat_id)
 
     async def query(
         self,
         chat_id: int,
         message: str,
         archive_paths: dict,
-        on_status_update=None
+        on_status_update=None,
+        archive_version: Optional[int] = None,
+        follow_up: bool = False
     ) -> str:
         """
         Отправка запроса агенту с обработкой стриминга (задача 3.2, 3.4, 6.2)
@@ -344,21 +553,78 @@ std = np.std(data)
             message: Текст запроса
             archive_paths: Пути к архиву
             on_status_update: Колбэк для обновления статуса (опционально)
+            archive_version: Версия архива чата (ChatArchiver.version); None - без кэша ответов
+            follow_up: Вопрос продолжает беседу (например, ответ на сообщение бота) - без кэша
 
         Returns:
             Финальный ответ агента
         """
         logger.info(f"[QUERY] chat_id={chat_id}: {message[:100]}")
 
+        question = normalize_question(message)
+        # Дата вопроса: ответы про "вчера" и "эту неделю" после полуночи не переиспользуются
+        today = date.today()
+        cacheable = archive_version is not None and self.cache.enabled
+        if cacheable and (follow_up or is_follow_up(question)):
+            # Ответ зависит от беседы в сессии
+            self.cache.bypass()
+            cacheable = False
+
+        if cacheable:
+            cached = self.cache.get(chat_id, question, archive_version, today)
+            if cached is not None:
+                # Сессия не видела этот ответ - он уйдёт ей вместе со следующим запросом
+                exchanges = self._cached_exchanges.setdefault(chat_id, deque(maxlen=MAX_CACHED_EXCHANGES))
+                exchanges.append((message, cached))
+                return cached
+
         # Получение или создание клиента
         client = await self.get_or_create_client(chat_id, archive_paths)
+        try:
+            response, cost_usd = await self._run_query(client, chat_id, message, on_status_update)
+        finally:
+            self.release_client(chat_id)
+
+        if cacheable and cost_usd is not None:
+            self.cache.put(chat_id, question, archive_version, response, cost_usd, today)
+        return response
+
+    def _cached_context(self, chat_id: int) -> Optional[str]:
+        """Ответы из кэша, которых не видела сессия чата (для уточняющих вопросов)"""
+        exchanges = self._cached_exchanges.get(chat_id)
+        if not exchanges:
+            return None
+        lines = ["[Ранее в этом чате ты уже ответил (ответы выданы из кэша, без тебя):"]
+        for question, answer in exchanges:
+            lines.append(f"Вопрос: {question}")
+            lines.append(f"Ответ: {answer[:MAX_CACHED_ANSWER_CHARS]}")
+        lines.append("]")
+        return '\n'.join(lines)
+
+    async def _run_query(self, client: ClaudeSDKClient, chat_id: int, message: str, on_status_update):
+        """
+        Отправка запроса в сессию и разбор стриминга ответа
+
+        Returns:
+            (ответ, стоимость в USD или None, если итог не получен)
+        """
+        # Первый запрос сессии из пула сообщает агенту, к какому чату он подключён
+        preamble = self._pending_bindings.get(chat_id)
+        context = self._cached_context(chat_id)
+        if context is not None:
+            message = f"{context}\n\n{message}"
+        if preamble is not None:
+            message = f"{preamble}\n\n{message}"
 
         # Отправка запроса
         await client.query(message)
+        self._pending_bindings.pop(chat_id, None)
+        self._cached_exchanges.pop(chat_id, None)
 
         # Обработка стриминга ответа
         all_text_blocks = []
         tools_used = []
+        cost_usd = None
 
         # Throttling для статусов (задача 6.2)
         last_status_time = 0.0
@@ -417,23 +683,35 @@ std = np.std(data)
                     f"cost=${msg.total_cost_usd:.4f}, "
                     f"tools={','.join(tools_used) if tools_used else 'none'}"
                 )
+                cost_usd = msg.total_cost_usd or 0.0
                 break
 
         # Финальный ответ = последний TextBlock
-        final_response = all_text_blocks[-1] if all_text_blocks else "Извини, не смог сформулировать ответ."
+        if not all_text_blocks:
+            # Запасной ответ не кэшируется
+            return "Извини, не смог сформулировать ответ.", None
+
+        final_response = all_text_blocks[-1]
 
-        return final_response
+        return final_response, cost_usd
 
-    async def cleanup(self):
-        """Закрытие всех активных сессий"""
-        logger.info(f"[AGENT] Closing {len(self.active_clients)} active sessions")
+    def get_session_stats(self) -> dict:
+        """Метрики сессий (см. SessionManager.get_stats)"""
+        return self.sessions.get_stats()
 
-        for chat_id, client in self.active_clients.items():
-            try:
-                await client.__aexit__(None, None, None)
-                logger.info(f"[SESSION] Closed session for chat_id={chat_id}")
-            except Exception as e:
-                logger.error(f"[SESSION] Error closing session for chat_id={chat_id}: {e}")
+    def get_cache_stats(self) -> dict:
+        """Метрики кэша ответов (см. AnswerCache.get_stats)"""
+        return self.cache.get_stats()
 
-        self.active_clients.clear()
-        self.last_activity.clear()
+    def get_pool_stats(self) -> dict:
+        """Метрики пула клиентов (см. ClientPool.get_stats)"""
+        return self.pool.get_stats()
+
+    async def cleanup(self, deadline: float = 30.0):
+        """
+        Параллельное закрытие всех активных сессий
+
+        Args:
+            deadline: Общее время на закрытие в секундах
+        """
+        await asyncio.gather(self.sessions.close_all(deadline), self.pool.close(deadline))
@@ -0,0 +1,260 @@
+"""
+Модуль очереди запросов к агенту
+Запросы одного чата выполняются строго по очереди (одна сессия - один
+поток ответа), общее число одновременных запросов ограничено, а свободные
+места раздаются чатам по кругу, чтобы один активный чат не занимал всех
+
+Ждущему запросу сообщается его место в очереди; при переполнении очереди
+чата или общей очереди запрос отклоняется сразу
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Сколько запросов к агенту выполняется одновременно (по всем чатам)
+AGENT_MAX_CONCURRENT = int(os.getenv('AGENT_MAX_CONCURRENT', 4))
+
+# Сколько запросов может ждать в очереди одного чата
+AGENT_CHAT_QUEUE_LIMIT = int(os.getenv('AGENT_CHAT_QUEUE_LIMIT', 3))
+
+# Сколько запросов может ждать во всех очередях
+AGENT_QUEUE_LIMIT = int(os.getenv('AGENT_QUEUE_LIMIT', 50))
+
+# Сколько последних замеров ожидания хранить для перцентилей
+WAIT_WINDOW = 1000
+
+T = TypeVar('T')
+
+
+class AgentQueueFull(Exception):
+    """Очередь чата или общая очередь переполнена - запрос отклонён"""
+
+
+class _Job:
+    """Запрос в очереди"""
+
+    __slots__ = ('chat_id', 'started', 'on_position', 'position', 'reported', 'notifying', 'enqueued_at')
+
+    def __init__(self, chat_id: int, on_position: Optional[Callable[[int], Awaitable]]):
+        self.chat_id = chat_id
+        self.started = asyncio.get_running_loop().create_future()
+        self.on_position = on_position
+        self.position = 0
+        self.reported = 0
+        self.notifying = False
+        self.enqueued_at = time.monotonic()
+
+
+class AgentScheduler:
+    """Очередь запросов к агенту: по одному на чат, общий лимит, чаты по кругу"""
+
+    def __init__(
+        self,
+        max_concurrent: int = AGENT_MAX_CONCURRENT,
+        chat_queue_limit: int = AGENT_CHAT_QUEUE_LIMIT,
+        queue_limit: int = AGENT_QUEUE_LIMIT,
+    ):
+        """
+        Args:
+            max_concurrent: Одновременных запросов по всем чатам
+            chat_queue_limit: Ждущих запросов в одном чате
+            queue_limit: Ждущих запросов всего
+        """
+        self.max_concurrent = max(1, max_concurrent)
+        self.chat_queue_limit = chat_queue_limit
+        self.queue_limit = queue_limit
+
+        self._queues: Dict[int, deque] = {}
+        self._ring: deque = deque()
+        self._running = set()
+        self._waiting = 0
+        self._notify_tasks = set()
+
+        # Метрики
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_waiting = 0
+        self._wait_times: deque = deque(maxlen=WAIT_WINDOW)
+
+    async def run(
+        self,
+        chat_id: int,
+        fn: Callable[[], Awaitable[T]],
+        on_position: Optional[Callable[[int], Awaitable]] = None,
+    ) -> T:
+        """
+        Выполнение запроса в свою очередь
+
+        Args:
+            chat_id: ID чата
+            fn: Запрос (например, вызов ClaudeAgent.query)
+            on_position: Колбэк места в очереди: 1, 2, ... пока запрос ждёт,
+                0 - запрос начал выполняться после ожидания
+
+        Returns:
+            Результат fn
+
+        Raises:
+            AgentQueueFull: Очередь чата или общая очередь переполнена
+        """
+        queue = self._queues.get(chat_id)
+        if queue is not None and len(queue) >= self.chat_queue_limit:
+            self.rejected += 1
+            logger.warning(f"[SCHEDULER] Chat queue full for chat_id={chat_id} ({len(queue)} waiting)")
+            raise AgentQueueFull(f"в очереди чата уже {len(queue)} запросов")
+        if self._waiting >= self.queue_limit:
+            self.rejected += 1
+            logger.warning(f"[SCHEDULER] Queue full ({self._waiting} waiting), rejecting chat_id={chat_id}")
+            raise AgentQueueFull(f"в общей очереди уже {self._waiting} запросов")
+
+        job = _Job(chat_id, on_position)
+        self.submitted += 1
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            if chat_id not in self._running:
+                self._ring.append(chat_id)
+        queue.append(job)
+        self._waiting += 1
+        self.max_waiting = max(self.max_waiting, self._waiting)
+        self._dispatch()
+
+        try:
+            await job.started
+        except asyncio.CancelledError:
+            if not job.started.done() or job.started.cancelled():
+                self._remove(job)
+            else:
+                # Запрос уже получил место - освобождаем его
+                self._finish(chat_id)
+            raise
+
+        self._wait_times.append(time.monotonic() - job.enqueued_at)
+        if job.reported or job.notifying:
+            job.position = 0
+            self._notify(job)
+
+        try:
+            result = await fn()
+        except BaseException:
+            self.failed += 1
+            raise
+        finally:
+            self._finish(chat_id)
+        self.completed += 1
+        return result
+
+    def _remove(self, job: _Job):
+        """Снятие отменённого запроса из очереди"""
+        queue = self._queues.get(job.chat_id)
+        if queue is None or job not in queue:
+            return
+        queue.remove(job)
+        self._waiting -= 1
+        if not queue:
+            del self._queues[job.chat_id]
+            if job.chat_id in self._ring:
+                self._ring.remove(job.chat_id)
+        self._update_positions()
+
+    def _finish(self, chat_id: int):
+        """Запрос чата завершён - место отдаётся следующему, чат встаёт в конец круга"""
+        self._running.discard(chat_id)
+        if chat_id in self._queues:
+            self._ring.append(chat_id)
+        self._dispatch()
+
+    def _dispatch(self):
+        """
+        Запуск ждущих запросов на свободные места, по одному чату за раз по кругу
+
+        В круге только чаты без выполняющегося запроса: чат возвращается
+        в конец круга, когда его запрос завершится.
+        """
+        while self._ring and len(self._running) < self.max_concurrent:
+            chat_id = self._ring.popleft()
+            queue = self._queues[chat_id]
+            job = queue.popleft()
+            self._waiting -= 1
+            if not queue:
+                del self._queues[chat_id]
+            if job.started.cancelled():
+                # Ожидание уже отменено - запрос снимается из очереди
+                if chat_id in self._queues:
+                    self._ring.append(chat_id)
+                continue
+            self._running.add(chat_id)
+            job.started.set_result(None)
+
+        self._update_positions()
+
+    def _update_positions(self):
+        """Пересчёт мест в очереди: порядок, в котором чаты получат места по кругу"""
+        # Чаты с выполняющимся запросом встанут в круг после тех, кто уже ждёт
+        chats = list(self._ring) + [chat_id for chat_id in self._queues if chat_id in self._running]
+        queues = [(chat_id, list(self._queues[chat_id])) for chat_id in chats]
+        position = 0
+        depth = 0
+        while queues:
+            remaining = []
+            for chat_id, jobs in queues:
+                if depth < len(jobs):
+                    position += 1
+                    job = jobs[depth]
+                    if job.position != position:
+                        job.position = position
+                        self._notify(job)
+                    remaining.append((chat_id, jobs))
+            queues = remaining
+            depth += 1
+
+    def _notify(self, job: _Job):
+        """Сообщение места в очереди (последнее значение, по одному вызову за раз)"""
+        if job.on_position is None or job.notifying:
+            return
+        job.notifying = True
+        task = asyncio.create_task(self._report(job))
+        self._notify_tasks.add(task)
+        task.add_done_callback(self._notify_tasks.discard)
+
+    async def _report(self, job: _Job):
+        try:
+            while job.reported != job.position:
+                position = job.position
+                try:
+                    await job.on_position(position)
+                except Exception as e:
+                    logger.debug(f"[SCHEDULER] Position callback failed for chat_id={job.chat_id}: {e}")
+                job.reported = position
+        finally:
+            job.notifying = False
+
+    def get_stats(self) -> dict:
+        """
+        Метрики очереди
+
+        Returns:
+            Словарь: running, waiting, chats_waiting, max_concurrent, max_waiting,
+            submitted, completed, failed, rejected, wait_ms_avg, wait_ms_p95
+        """
+        wait_times: List[float] = sorted(self._wait_times)
+        return {
+            'running': len(self._running),
+            'waiting': self._waiting,
+            'chats_waiting': len(self._queues),
+            'max_concurrent': self.max_concurrent,
+            'max_waiting': self.max_waiting,
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'wait_ms_avg': round(sum(wait_times) / len(wait_times) * 1000, 1) if wait_times else 0.0,
+            'wait_ms_p95': round(wait_times[int(0.95 * (len(wait_times) - 1))] * 1000, 1) if wait_times else 0.0,
+        }
@@ -0,0 +1,681 @@
+"""
+Модуль встроенных инструментов агента для работы с архивом
+Инструменты выполняются в процессе бота (in-process MCP-сервер Claude Agent SDK),
+без запуска подпроцессов Bash/Grep
+"""
+
+import os
+import re
+import time
+import asyncio
+import logging
+import functools
+from collections import deque
+from datetime import datetime, time as dt_time
+from pathlib import Path
+from typing import Dict, Optional
+from claude_agent_sdk import tool, create_sdk_mcp_server
+from search_index import search, SEARCH_PAGE_SIZE
+from history_reader import read_window, HistoryLines
+from chat_stats import load_stats, MEDIA_KINDS
+from media_layout import resolve_media_path
+from media_catalog import list_media, resolve_chat_file, summarize_spreadsheet
+
+logger = logging.getLogger(__name__)
+
+# Имя MCP-сервера: инструменты доступны агенту как mcp__archive__<имя>
+ARCHIVE_SERVER_NAME = "archive"
+
+# Максимальная длина текста одного результата в ответе инструмента
+MAX_HIT_TEXT = 300
+
+# Ограничения ответа history_window
+MAX_WINDOW_LINES = 200
+MAX_WINDOW_CHARS = 30000
+
+# Максимум строк в ответе history_tail / history_lines
+MAX_LINES_RANGE = 200
+
+# Ограничения ответа chat_stats: участников и дней
+MAX_STATS_USERS = 30
+MAX_STATS_DAYS = 62
+
+# Максимум файлов в ответе list_media
+MAX_MEDIA_FILES = 50
+
+# Общий предел длины ответа любого инструмента
+MAX_TOOL_RESULT_CHARS = 30000
+
+# Сколько последних замеров времени хранить на инструмент
+TOOL_LATENCY_WINDOW = 500
+
+WEEKDAY_NAMES = ('пн', 'вт', 'ср', 'чт', 'пт', 'сб', 'вс')
+
+# Встроенные инструменты Claude, которым нужна проверка путей (файлы вне папки чата запрещены)
+FILE_TOOLS = ("Read", "Grep", "Glob", "Bash")
+
+# Пути вне папки чата, которые можно упоминать в Bash (интерпретаторы, /dev/null)
+SYSTEM_PATH_PREFIXES = ('/usr/', '/bin/', '/dev/null')
+
+# Bash: ведущий "cd <папка> &&", абсолютные и домашние пути, выход вверх по "..";
+# в кавычках, после = и после перенаправлений путь тоже находится (одиночный / - деление)
+BASH_CD_PATTERN = re.compile(r"""\s*cd\s+(['"]?)([^'"\s;&|]+)\1\s*(?:&&|;|$)""")
+BASH_PATH_PATTERN = re.compile(r"""(?:^|[\s'"=(<>|;&])([/~][^\s'"();|&<>:]+|~)""")
+BASH_PARENT_PATTERN = re.compile(r"""(?:^|[\s'"=(<>|;&/])\.\.(?:[/\s'"();|&<>]|$)""")
+
+# Счётчики инструментов по всем чатам: имя → вызовы, ошибки, символы, времена
+_tool_stats: Dict[str, dict] = {}
+
+
+def archive_tool_name(name: str) -> str:
+    """Полное имя инструмента для allowed_tools"""
+    return f"mcp__{ARCHIVE_SERVER_NAME}__{name}"
+
+
+def _text_result(text: str) -> dict:
+    """Ответ инструмента в формате MCP"""
+    return {"content": [{"type": "text", "text": text}]}
+
+
+def _error_result(text: str) -> dict:
+    """Ответ инструмента об ошибке (агент видит, что вызов не удался)"""
+    return {"content": [{"type": "text", "text": text}], "is_error": True}
+
+
+def _measured(name: str):
+    """
+    Учёт времени, ошибок и размера ответов инструмента; ответ обрезается
+    до MAX_TOOL_RESULT_CHARS
+    """
+    def decorate(handler):
+        stats = _tool_stats.setdefault(name, {
+            'calls': 0, 'errors': 0, 'chars': 0, 'times': deque(maxlen=TOOL_LATENCY_WINDOW),
+        })
+
+        @functools.wraps(handler)
+        async def wrapper(args: dict) -> dict:
+            started_at = time.monotonic()
+            try:
+                result = await handler(args)
+            except Exception:
+                stats['errors'] += 1
+                raise
+            finally:
+                stats['calls'] += 1
+                stats['times'].append(time.monotonic() - started_at)
+
+            if result.get('is_error'):
+                stats['errors'] += 1
+            for item in result.get('content', []):
+                text = item.get('text', '')
+                if len(text) > MAX_TOOL_RESULT_CHARS:
+                    item['text'] = text[:MAX_TOOL_RESULT_CHARS] + "\n… ответ обрезан, сузи запрос"
+                stats['chars'] += len(item['text'])
+            return result
+
+        return wrapper
+    return decorate
+
+
+def get_tool_stats() -> Dict[str, dict]:
+    """
+    Счётчики инструментов архива по всем чатам
+
+    Returns:
+        Словарь: имя → calls, errors, avg_ms, p95_ms, max_ms, avg_chars
+    """
+    result = {}
+    for name, stats in _tool_stats.items():
+        times = sorted(stats['times'])
+        calls = stats['calls']
+        result[name] = {
+            'calls': calls,
+            'errors': stats['errors'],
+            'avg_ms': round(sum(times) / len(times) * 1000, 1) if times else 0.0,
+            'p95_ms': round(times[int(0.95 * (len(times) - 1))] * 1000, 1) if times else 0.0,
+            'max_ms': round(times[-1] * 1000, 1) if times else 0.0,
+            'avg_chars': stats['chars'] // calls if calls else 0,
+        }
+    return result
+
+
+def format_search_result(query: str, result: dict) -> str:
+    """
+    Компактное текстовое представление результатов поиска
+
+    Args:
+        query: Исходный запрос
+        result: Результат search_index.search
+
+    Returns:
+        Текст для агента
+    """
+    if not result['total']:
+        return f"По запросу «{query}» ничего не найдено."
+
+    lines = [f"Найдено: {result['total']} (страница {result['page']} из {result['pages']})"]
+    for hit in result['hits']:
+        text = hit['text']
+        if len(text) > MAX_HIT_TEXT:
+            text = text[:MAX_HIT_TEXT] + '…'
+        sender = hit['sender'] or '—'
+        line = f"[{hit['ts'].replace('T', ' ')}] {sender} ({hit['kind']}): {text}"
+        if hit['media_path']:
+            line += f" → {resolve_media_path(hit['media_path'])}"
+        lines.append(line)
+
+    if result['page'] < result['pages']:
+        lines.append(f"Следующая страница: page={result['page'] + 1}")
+
+    return '\n'.join(lines)
+
+
+def parse_time_arg(value: str, end_of_day: bool = False) -> datetime:
+    """
+    Разбор даты/времени из аргумента инструмента
+
+    Поддерживает ISO-формат (2025-03-12, 2025-03-12T10:00, 2025-03-12 10:00).
+    Для даты без времени берётся начало или конец дня.
+
+    Args:
+        value: Строка с датой
+        end_of_day: Для даты без времени вернуть 23:59:59
+
+    Returns:
+        Время
+    """
+    value = value.strip()
+    parsed = datetime.fromisoformat(value)
+    if len(value) <= 10:
+        return datetime.combine(parsed.date(), dt_time.max if end_of_day else dt_time.min)
+    return parsed
+
+
+def format_window_result(result: dict) -> str:
+    """Компактное представление строк за период с ограничением размера"""
+    if not result['total']:
+        return "За этот период сообщений нет."
+
+    lines = []
+    size = 0
+    for line in result['lines']:
+        size += len(line) + 1
+        if size > MAX_WINDOW_CHARS:
+            break
+        lines.append(line)
+
+    text = '\n'.join(lines)
+    if len(lines) < result['total']:
+        text += (
+            f"\n\nПоказано {len(lines)} из {result['total']} строк. "
+            f"Сузь период, чтобы увидеть остальные."
+        )
+    return text
+
+
+def format_lines_result(lines: list, first: int, total: int) -> str:
+    """
+    Пронумерованные строки истории с ограничением размера
+
+    Args:
+        lines: Строки истории
+        first: Номер первой строки (с 1)
+        total: Всего строк в истории
+
+    Returns:
+        Текст для агента
+    """
+    if not lines:
+        return f"Нет строк в этом диапазоне (всего строк в истории: {total})."
+
+    shown = []
+    size = 0
+    for number, line in enumerate(lines, first):
+        text = f"{number}: {line}"
+        size += len(text) + 1
+        if size > MAX_WINDOW_CHARS:
+            break
+        shown.append(text)
+
+    text = '\n'.join(shown)
+    last = first + len(shown) - 1
+    text += f"\n\nСтроки {first}–{last} из {total}."
+    if len(shown) < len(lines):
+        text += f" Ответ обрезан по размеру, продолжение: history_lines start={last + 1}."
+    return text
+
+
+def format_stats_result(stats: dict, sender: str = '', start: str = '', end: str = '') -> str:
+    """
+    Компактное представление сводок активности чата
+
+    Args:
+        stats: Сводки (chat_stats.load_stats)
+        sender: Фильтр участников по части имени (без учёта регистра)
+        start: Начало периода для гистограммы по дням (YYYY-MM-DD)
+        end: Конец периода (YYYY-MM-DD, включительно)
+
+    Returns:
+        Текст для агента
+    """
+    if not stats['first']:
+        return "В архиве пока нет событий."
+
+    kinds = stats['kinds']
+    messages = kinds.get('text', 0)
+    media = sum(kinds.get(kind, 0) for kind in MEDIA_KINDS)
+    files = ', '.join(f"{kind} {kinds[kind]}" for kind in MEDIA_KINDS if kinds.get(kind))
+    lines = [
+        f"Период архива: {stats['first'].replace('T', ' ')} — {stats['last'].replace('T', ' ')}",
+        f"Всего: сообщений {messages}, файлов {media}" + (f" ({files})" if files else ""),
+    ]
+
+    users = stats['users'].items()
+    if sender:
+        users = [(name, user) for name, user in users if sender.lower() in name.lower()]
+    users = sorted(users, key=lambda item: item[1]['messages'] + item[1]['media'], reverse=True)
+    lines.append("")
+    lines.append(f"Участники ({len(users)}), по активности:")
+    for name, user in users[:MAX_STATS_USERS]:
+        files = ', '.join(f"{kind} {user[kind]}" for kind in MEDIA_KINDS if user.get(kind))
+        lines.append(
+            f"• {name}: сообщений {user['messages']}, файлов {user['media']}"
+            + (f" ({files})" if files else "")
+            + f", с {user['first'][:10]} по {user['last'][:10]}"
+        )
+    if len(users) > MAX_STATS_USERS:
+        lines.append(f"… и ещё {len(users) - MAX_STATS_USERS}. Уточни sender, чтобы найти нужного.")
+
+    days = sorted(stats['days'].items())
+    if start or end:
+        days = [(day, n) for day, n in days if (not start or day >= start) and (not end or day <= end)]
+        title = f"По дням ({start or 'начало'} — {end or 'конец'})"
+    else:
+        title = "По дням (последние активные дни)"
+    lines.append("")
+    lines.append(f"{title}: всего {sum(n for _, n in days)} за {len(days)} дн.")
+    if len(days) > MAX_STATS_DAYS:
+        lines.append(f"Показаны последние {MAX_STATS_DAYS} дней, сузь период start/end.")
+    lines.extend(f"{day}: {n}" for day, n in days[-MAX_STATS_DAYS:])
+
+    lines.append("")
+    lines.append("По часам: " + ', '.join(f"{hour}ч {n}" for hour, n in enumerate(stats['hours']) if n))
+    lines.append("По дням недели: " + ', '.join(
+        f"{name} {n}" for name, n in zip(WEEKDAY_NAMES, stats['weekdays'])
+    ))
+    return '\n'.join(lines)
+
+
+def format_media_result(result: dict, limit: int) -> str:
+    """
+    Компактный список файлов media/
+
+    Args:
+        result: Результат media_catalog.list_media
+        limit: Сколько файлов запрашивалось
+
+    Returns:
+        Текст для агента
+    """
+    if not result['total']:
+        return "Файлов не найдено."
+
+    mb = 1024 * 1024
+    lines = [f"Файлов: {result['total']}, {result['total_bytes'] / mb:.1f} МБ. Сначала новые:"]
+    for item in result['files']:
+        size = f"{item['size'] / mb:.1f} МБ" if item['size'] >= mb else f"{max(item['size'] // 1024, 1)} КБ"
+        note = ", сжат" if item['compressed'] else ""
+        lines.append(f"{item['time']:%Y-%m-%d %H:%M} {item['kind']} {size}{note} {item['path']}")
+    if result['total'] > len(result['files']):
+        lines.append(
+            f"Показаны {len(result['files'])} из {result['total']}: "
+            f"сузи фильтры kind/name/month (limit до {limit})."
+        )
+    return '\n'.join(lines)
+
+
+class ArchiveBinding:
+    """
+    Чат, с архивом которого работают инструменты сервера
+
+    Заранее запущенный клиент (client_pool) получает сервер с пустой привязкой,
+    а чат задаётся при выдаче клиента чату, до первого запроса.
+    """
+
+    def __init__(self, chat_id: Optional[int] = None, archive_paths: Optional[dict] = None):
+        """
+        Args:
+            chat_id: ID чата (None - привязка позже, через bind)
+            archive_paths: Пути к архиву (ChatArchiver.get_archive_paths)
+        """
+        self.chat_id: Optional[int] = None
+        self.paths: dict = {}
+        self.history_lines: Optional[HistoryLines] = None
+        if chat_id is not None:
+            self.bind(chat_id, archive_paths)
+
+    def bind(self, chat_id: int, archive_paths: dict):
+        """Привязка к архиву чата"""
+        self.chat_id = chat_id
+        self.paths = archive_paths
+        self.history_lines = HistoryLines(archive_paths['history_file'], archive_paths['line_index_file'])
+
+    def contains(self, path: str, cwd: str) -> bool:
+        """Лежит ли путь (относительный - от cwd) в папке привязанного чата"""
+        if self.chat_id is None:
+            return False
+        chat_dir = Path(self.paths['chat_dir']).resolve()
+        resolved = (Path(cwd) / path).resolve()
+        return resolved == chat_dir or chat_dir in resolved.parents
+
+    def check_tool_call(self, tool_name: str, tool_input: dict, cwd: str) -> Optional[str]:
+        """
+        Проверка вызова встроенного инструмента Claude: только файлы папки чата
+
+        Args:
+            tool_name: Имя инструмента (Read, Grep, Glob, Bash)
+            tool_input: Аргументы вызова
+            cwd: Рабочая директория клиента (от неё считаются относительные пути)
+
+        Returns:
+            Причина отказа для агента или None, если вызов разрешён
+        """
+        if tool_name not in FILE_TOOLS:
+            return None
+        if self.chat_id is None:
+            return "Клиент ещё не привязан к чату - файлы недоступны."
+        chat_dir = self.paths['chat_dir']
+
+        if tool_name != "Bash":
+            paths = [tool_input.get('file_path') or tool_input.get('path') or '.']
+            if tool_name == "Glob" and str(tool_input.get('pattern', '')).startswith(('/', '~')):
+                paths.append(tool_input['pattern'])
+            for path in paths:
+                if path.startswith('~') or not self.contains(path, cwd):
+                    return f"{path} вне папки чата: работай только в {chat_dir}"
+            return None
+
+        command = tool_input.get('command', '')
+        cd = BASH_CD_PATTERN.match(command)
+        if cd:
+            cwd = str(Path(cwd) / cd.group(2))
+        if not self.contains('.', cwd):
+            return f"Рабочая директория вне папки чата: начни команду с cd {chat_dir} &&"
+        if BASH_PARENT_PATTERN.search(command):
+            return f"Переход выше папки чата (..) запрещён: работай только в {chat_dir}"
+        for path in BASH_PATH_PATTERN.findall(command):
+            if path.startswith('~') or not (path.startswith(SYSTEM_PATH_PREFIXES) or self.contains(path, cwd)):
+                return f"{path} вне папки чата: работай только в {chat_dir}"
+        return None
+
+
+def create_access_hook(binding: ArchiveBinding, cwd: Optional[str] = None):
+    """
+    Хук PreToolUse: встроенные инструменты Claude не выходят за папку привязанного чата
+
+    Проверка идёт по привязке на момент вызова, поэтому работает и для
+    клиентов из пула, которым чат назначен уже после запуска.
+
+    Args:
+        binding: Привязка к архиву чата
+        cwd: Рабочая директория клиента (None - директория процесса бота)
+
+    Returns:
+        Функция хука для ClaudeAgentOptions.hooks
+    """
+    async def check_access(input_data: dict, tool_use_id: Optional[str], context) -> dict:
+        tool_name = input_data.get('tool_name', '')
+        reason = binding.check_tool_call(tool_name, input_data.get('tool_input') or {}, cwd or os.getcwd())
+        if reason is None:
+            return {}
+        logger.warning(f"[TOOLS] Denied {tool_name} in chat_id={binding.chat_id}: {reason}")
+        return {
+            'hookSpecificOutput': {
+                'hookEventName': 'PreToolUse',
+                'permissionDecision': 'deny',
+                'permissionDecisionReason': reason,
+            }
+        }
+
+    return check_access
+
+
+def create_archive_server(binding: ArchiveBinding):
+    """
+    Создание in-process MCP-сервера с инструментами архива чата
+
+    Args:
+        binding: Привязка к архиву чата
+
+    Returns:
+        Конфигурация сервера для ClaudeAgentOptions.mcp_servers
+    """
+    @tool(
+        "search_history",
+        "Полнотекстовый поиск по истории чата (сообщения, имена, файлы). "
+        "Возвращает результаты по релевантности, постранично.",
+        {
+            "type": "object",
+            "properties": {
+                "query": {"type": "string", "description": "Слова для поиска"},
+                "page": {"type": "integer", "description": "Номер страницы, с 1"},
+            },
+            "required": ["query"],
+        },
+    )
+    @_measured("search_history")
+    async def search_history(args: dict) -> dict:
+        query = args.get('query', '')
+        page = int(args.get('page') or 1)
+        try:
+            result = await asyncio.to_thread(search, binding.paths['index_file'], query, page, SEARCH_PAGE_SIZE)
+        except Exception as e:
+            logger.error(f"[TOOLS] search_history failed in chat_id={binding.chat_id}: {e}")
+            return _error_result(f"Ошибка поиска: {e}")
+
+        logger.info(f"[TOOLS] search_history chat_id={binding.chat_id} query={query!r} total={result['total']}")
+        return _text_result(format_search_result(query, result))
+
+    @tool(
+        "history_window",
+        "Сообщения истории за период времени. Читает только нужный кусок истории "
+        "по индексу времени, без просмотра файла целиком.",
+        {
+            "type": "object",
+            "properties": {
+                "start": {"type": "string", "description": "Начало периода, ISO: 2025-03-12 или 2025-03-12T10:00"},
+                "end": {"type": "string", "description": "Конец периода, ISO (по умолчанию конец дня start)"},
+            },
+            "required": ["start"],
+        },
+    )
+    @_measured("history_window")
+    async def history_window(args: dict) -> dict:
+        try:
+            start = parse_time_arg(args['start'])
+            end = parse_time_arg(args.get('end') or args['start'][:10], end_of_day=True)
+        except (KeyError, ValueError) as e:
+            return _error_result(f"Неверный формат даты ({e}). Используй ISO: 2025-03-12 или 2025-03-12T10:00")
+
+        try:
+            result = await asyncio.to_thread(
+                read_window, binding.paths['history_file'], binding.paths['time_index_file'], start, end, MAX_WINDOW_LINES
+            )
+        except Exception as e:
+            logger.error(f"[TOOLS] history_window failed in chat_id={binding.chat_id}: {e}")
+            return _error_result(f"Ошибка чтения истории: {e}")
+
+        logger.info(
+            f"[TOOLS] history_window chat_id={binding.chat_id} {start}..{end} "
+            f"lines={result['total']} bytes_read={result['bytes_read']}"
+        )
+        return _text_result(format_window_result(result))
+
+    @tool(
+        "history_count",
+        "Количество строк (сообщений и событий) в истории чата. Мгновенно, по индексу строк.",
+        {"type": "object", "properties": {}},
+    )
+    @_measured("history_count")
+    async def history_count(args: dict) -> dict:
+        try:
+            total = await asyncio.to_thread(binding.history_lines.count)
+        except Exception as e:
+            logger.error(f"[TOOLS] history_count failed in chat_id={binding.chat_id}: {e}")
+            return _error_result(f"Ошибка чтения истории: {e}")
+
+        logger.info(f"[TOOLS] history_count chat_id={binding.chat_id} total={total}")
+        return _text_result(f"Строк в истории: {total}")
+
+    @tool(
+        "history_tail",
+        f"Последние N строк истории чата (не больше {MAX_LINES_RANGE}), с номерами строк.",
+        {
+            "type": "object",
+            "properties": {
+                "n": {"type": "integer", "description": f"Количество строк, по умолчанию 50, максимум {MAX_LINES_RANGE}"},
+            },
+        },
+    )
+    @_measured("history_tail")
+    async def history_tail(args: dict) -> dict:
+        try:
+            n = min(max(int(args.get('n') or 50), 1), MAX_LINES_RANGE)
+        except (TypeError, ValueError) as e:
+            return _error_result(f"Неверное количество строк ({e}). Нужно целое число n.")
+
+        try:
+            total = await asyncio.to_thread(binding.history_lines.count)
+            lines = await asyncio.to_thread(binding.history_lines.tail, n)
+        except Exception as e:
+            logger.error(f"[TOOLS] history_tail failed in chat_id={binding.chat_id}: {e}")
+            return _error_result(f"Ошибка чтения истории: {e}")
+
+        logger.info(f"[TOOLS] history_tail chat_id={binding.chat_id} n={n} lines={len(lines)}")
+        return _text_result(format_lines_result(lines, max(total - len(lines) + 1, 1), total))
+
+    @tool(
+        "history_lines",
+        f"Строки истории по номерам, от start до end включительно (нумерация с 1, "
+        f"не больше {MAX_LINES_RANGE} строк за раз).",
+        {
+            "type": "object",
+            "properties": {
+                "start": {"type": "integer", "description": "Номер первой строки, с 1"},
+                "end": {"type": "integer", "description": "Номер последней строки (включительно)"},
+            },
+            "required": ["start"],
+        },
+    )
+    @_measured("history_lines")
+    async def history_lines_tool(args: dict) -> dict:
+        try:
+            start = max(int(args['start']), 1)
+            end = int(args.get('end') or start + MAX_LINES_RANGE - 1)
+        except (KeyError, ValueError) as e:
+            return _error_result(f"Неверные номера строк ({e}). Нужны целые числа start и end.")
+        end = min(end, start + MAX_LINES_RANGE - 1)
+
+        try:
+            total = await asyncio.to_thread(binding.history_lines.count)
+            lines = await asyncio.to_thread(binding.history_lines.lines, start, end)
+        except Exception as e:
+            logger.error(f"[TOOLS] history_lines failed in chat_id={binding.chat_id}: {e}")
+            return _error_result(f"Ошибка чтения истории: {e}")
+
+        logger.info(f"[TOOLS] history_lines chat_id={binding.chat_id} {start}..{end} lines={len(lines)}")
+        return _text_result(format_lines_result(lines, start, total))
+
+    @tool(
+        "chat_stats",
+        "Готовая статистика активности чата: сообщения и файлы по участникам, "
+        "по дням, часам и дням недели. Мгновенно, без чтения истории.",
+        {
+            "type": "object",
+            "properties": {
+                "sender": {"type": "string", "description": "Часть имени участника (фильтр)"},
+                "start": {"type": "string", "description": "Начало периода для статистики по дням, YYYY-MM-DD"},
+                "end": {"type": "string", "description": "Конец периода, YYYY-MM-DD (включительно)"},
+            },
+        },
+    )
+    @_measured("chat_stats")
+    async def chat_stats(args: dict) -> dict:
+        try:
+            stats = await asyncio.to_thread(load_stats, binding.paths['stats_file'])
+        except Exception as e:
+            logger.error(f"[TOOLS] chat_stats failed in chat_id={binding.chat_id}: {e}")
+            return _error_result(f"Ошибка чтения статистики: {e}")
+
+        logger.info(f"[TOOLS] chat_stats chat_id={binding.chat_id} users={len(stats['users'])}")
+        return _text_result(format_stats_result(
+            stats, args.get('sender') or '', (args.get('start') or '')[:10], (args.get('end') or '')[:10],
+        ))
+
+    @tool(
+        "list_media",
+        "Файлы, присланные в чат (фото, документы, голосовые, видео): дата, тип, размер, путь. "
+        f"Сначала новые, не больше {MAX_MEDIA_FILES} за раз. Вместо Glob/ls по media/.",
+        {
+            "type": "object",
+            "properties": {
+                "kind": {"type": "string", "description": "Тип: photo, document, voice, video_note"},
+                "name": {"type": "string", "description": "Часть имени файла (например .xlsx или отчёт)"},
+                "month": {"type": "string", "description": "Месяц YYYY-MM"},
+                "limit": {"type": "integer", "description": f"Сколько файлов, по умолчанию 20, максимум {MAX_MEDIA_FILES}"},
+            },
+        },
+    )
+    @_measured("list_media")
+    async def list_media_tool(args: dict) -> dict:
+        limit = min(max(int(args.get('limit') or 20), 1), MAX_MEDIA_FILES)
+        try:
+            result = await asyncio.to_thread(
+                list_media, binding.paths['media_dir'], args.get('kind') or '',
+                args.get('name') or '', (args.get('month') or '')[:7], limit,
+            )
+        except Exception as e:
+            logger.error(f"[TOOLS] list_media failed in chat_id={binding.chat_id}: {e}")
+            return _error_result(f"Ошибка чтения списка файлов: {e}")
+
+        logger.info(f"[TOOLS] list_media chat_id={binding.chat_id} total={result['total']}")
+        return _text_result(format_media_result(result, MAX_MEDIA_FILES))
+
+    @tool(
+        "spreadsheet_summary",
+        "Краткая сводка таблицы Excel/CSV из чата: листы, число строк, столбцы с типами, "
+        "числовые итоги (min/max/сумма/среднее) и первые строки. Используй перед pandas-скриптом.",
+        {
+            "type": "object",
+            "properties": {
+                "path": {"type": "string", "description": "Путь к файлу (из истории или list_media) или имя файла"},
+                "sheet": {"type": "string", "description": "Имя листа (по умолчанию все листы)"},
+                "rows": {"type": "integer", "description": "Сколько первых строк показать, по умолчанию 5"},
+            },
+            "required": ["path"],
+        },
+    )
+    @_measured("spreadsheet_summary")
+    async def spreadsheet_summary(args: dict) -> dict:
+        try:
+            path = resolve_chat_file(binding.paths['chat_dir'], args['path'])
+        except (KeyError, ValueError) as e:
+            return _error_result(f"Неверный путь ({e}). Укажи файл из папки чата.")
+
+        try:
+            text = await asyncio.to_thread(summarize_spreadsheet, path, args.get('sheet') or '', int(args.get('rows') or 5))
+        except Exception as e:
+            logger.error(f"[TOOLS] spreadsheet_summary failed in chat_id={binding.chat_id}: {e}")
+            return _error_result(f"Ошибка чтения таблицы: {e}")
+
+        logger.info(f"[TOOLS] spreadsheet_summary chat_id={binding.chat_id} file={path.name}")
+        return _text_result(text)
+
+    return create_sdk_mcp_server(
+        name=ARCHIVE_SERVER_NAME,
+        version="1.0.0",
+        tools=[
+            search_history, history_window, history_count, history_tail, history_lines_tool, chat_stats,
+            list_media_tool, spreadsheet_summary,
+        ],
+    )
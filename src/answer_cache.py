@@ -0,0 +1,180 @@
+"""
+Модуль кэша ответов агента
+Одни и те же вопросы ("сколько сообщений?", "итоги за неделю") задаются
+снова и снова; пока архив чата не изменился, ответ не пересчитывается
+
+Ключ - (chat_id, нормализованный текст вопроса, версия архива чата, дата):
+любое новое сообщение или файл в чате меняет версию, и старые ответы
+больше не находятся; с датой в ключе "что было вчера?" и "итоги недели"
+после полуночи считаются заново. Записи живут ANSWER_CACHE_TTL секунд,
+всего их не больше ANSWER_CACHE_SIZE (вытесняются давно не использованные)
+
+Уточняющие вопросы ("а за прошлую неделю?", ответ на сообщение бота)
+зависят от беседы и в кэш не попадают
+"""
+
+import os
+import re
+import time
+import logging
+from collections import OrderedDict
+from datetime import date
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько ответов хранить и сколько секунд (0 - кэш выключен)
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 500))
+ANSWER_CACHE_TTL = float(os.getenv('ANSWER_CACHE_TTL', 3600))
+
+MENTION_PATTERN = re.compile(r'@\w+')
+WORD_PATTERN = re.compile(r'\w+')
+
+# Слова, с которых начинается продолжение разговора
+FOLLOW_UP_STARTS = {'а', 'и', 'но', 'еще', 'тогда', 'так', 'ну', 'ок', 'да', 'нет'}
+
+# Слова, отсылающие к предыдущему ответу
+FOLLOW_UP_WORDS = {
+    'это', 'этот', 'эта', 'эти', 'этого', 'этой', 'этих', 'тот', 'та', 'те', 'того', 'тех',
+    'он', 'она', 'оно', 'они', 'его', 'ее', 'их', 'него', 'нее', 'них', 'ему', 'ей', 'им',
+    'там', 'тут', 'выше', 'тоже', 'также', 'подробнее', 'предыдущий', 'предыдущего',
+}
+
+
+def normalize_question(text: str) -> str:
+    """
+    Текст вопроса для ключа кэша: без упоминаний бота, регистра, ё и пунктуации
+
+    Args:
+        text: Исходный текст
+
+    Returns:
+        Слова через пробел
+    """
+    text = MENTION_PATTERN.sub(' ', text.lower().replace('ё', 'е'))
+    return ' '.join(WORD_PATTERN.findall(text))
+
+
+def is_follow_up(question: str) -> bool:
+    """
+    Похож ли вопрос на продолжение разговора
+
+    Args:
+        question: Нормализованный текст вопроса
+
+    Returns:
+        True, если вопрос ссылается на предыдущие реплики
+    """
+    words = question.split()
+    if not words:
+        return True
+    return words[0] in FOLLOW_UP_STARTS or any(word in FOLLOW_UP_WORDS for word in words)
+
+
+class _Entry:
+    """Закэшированный ответ"""
+
+    __slots__ = ('response', 'cost_usd', 'created_at')
+
+    def __init__(self, response: str, cost_usd: float):
+        self.response = response
+        self.cost_usd = cost_usd
+        self.created_at = time.monotonic()
+
+
+class AnswerCache:
+    """Ответы агента по (чат, вопрос, версия архива, дата) с TTL и вытеснением LRU"""
+
+    def __init__(self, max_size: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL):
+        """
+        Args:
+            max_size: Сколько ответов хранить
+            ttl: Время жизни ответа в секундах (0 - кэш выключен)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[int, str, int, date], _Entry]" = OrderedDict()
+
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+        self.saved_cost_usd = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0 and self.ttl > 0
+
+    def get(self, chat_id: int, question: str, version: int, today: Optional[date] = None) -> Optional[str]:
+        """
+        Закэшированный ответ
+
+        Args:
+            chat_id: ID чата
+            question: Нормализованный текст вопроса
+            version: Версия архива чата
+            today: Текущая дата (по умолчанию сегодня)
+
+        Returns:
+            Ответ или None
+        """
+        key = (chat_id, question, version, today or date.today())
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry.created_at > self.ttl:
+            del self._entries[key]
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        self.saved_cost_usd += entry.cost_usd
+        logger.info(f"[CACHE] Answer hit for chat_id={chat_id}: {question[:60]!r} (saved ${entry.cost_usd:.4f})")
+        return entry.response
+
+    def put(
+        self, chat_id: int, question: str, version: int, response: str, cost_usd: float,
+        today: Optional[date] = None
+    ):
+        """
+        Сохранение ответа
+
+        Args:
+            chat_id: ID чата
+            question: Нормализованный текст вопроса
+            version: Версия архива, по которой получен ответ
+            response: Ответ агента
+            cost_usd: Стоимость ответа (для учёта экономии)
+            today: Дата, на которую получен ответ (по умолчанию сегодня)
+        """
+        key = (chat_id, question, version, today or date.today())
+        self._entries[key] = _Entry(response, cost_usd)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def bypass(self):
+        """Учёт вопроса, для которого кэш не используется (уточнение по беседе)"""
+        self.bypassed += 1
+
+    def get_stats(self) -> dict:
+        """
+        Метрики кэша
+
+        Returns:
+            Словарь: entries, max_size, hits, misses, bypassed, evictions, hit_rate, saved_cost_usd
+        """
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'bypassed': self.bypassed,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'saved_cost_usd': round(self.saved_cost_usd, 4),
+        }
@@ -0,0 +1,239 @@
+"""
+Модуль фоновой записи архива
+Выносит все файловые операции ChatArchiver из event loop в пул потоков
+"""
+
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Количество потоков записи (каждый чат всегда обслуживает один и тот же поток)
+ARCHIVE_IO_WORKERS = int(os.getenv('ARCHIVE_IO_WORKERS', 4))
+
+# Глубина очереди, при которой логируется предупреждение о backpressure
+ARCHIVE_IO_QUEUE_WARNING = int(os.getenv('ARCHIVE_IO_QUEUE_WARNING', 1000))
+
+# Сколько последних замеров хранить для перцентилей
+LATENCY_WINDOW = 1000
+
+
+def in_event_loop() -> bool:
+    """Проверка, вызван ли код из работающего event loop"""
+    try:
+        asyncio.get_running_loop()
+        return True
+    except RuntimeError:
+        return False
+
+
+def wait_outside_loop(future: Future):
+    """
+    Ожидание результата задачи, если вызов идёт не из event loop
+
+    Скрипты и тесты работают синхронно и должны видеть результат записи сразу,
+    а внутри event loop задача выполняется в фоне.
+
+    Args:
+        future: Задача, возвращённая ArchiveWriter.submit
+    """
+    if not in_event_loop():
+        future.result()
+
+
+class ArchiveWriter:
+    """Пул потоков записи с сохранением порядка задач внутри одного чата"""
+
+    def __init__(self, workers: int = ARCHIVE_IO_WORKERS):
+        """
+        Запуск потоков записи
+
+        Args:
+            workers: Количество потоков
+        """
+        self.workers = max(1, workers)
+        self._queues = [queue.Queue() for _ in range(self.workers)]
+        self._threads = []
+
+        # Метрики
+        self._stats_lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+        self._wait_times = deque(maxlen=LATENCY_WINDOW)
+        self._exec_times = deque(maxlen=LATENCY_WINDOW)
+
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker,
+                args=(self._queues[i],),
+                name=f"archive-writer-{i}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+        logger.info(f"[ARCHIVE_IO] Writer started with {self.workers} threads")
+
+    def _queue_for(self, chat_id: int) -> queue.Queue:
+        """Очередь, закреплённая за чатом (сохраняет порядок записей чата)"""
+        return self._queues[hash(chat_id) % self.workers]
+
+    def submit(self, chat_id: int, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Постановка файловой операции в очередь чата
+
+        Args:
+            chat_id: ID чата (определяет поток записи)
+            fn: Синхронная функция с файловыми операциями
+            *args, **kwargs: Аргументы функции
+
+        Returns:
+            Future с результатом функции
+        """
+        future = Future()
+        q = self._queue_for(chat_id)
+        q.put((future, fn, args, kwargs, time.monotonic()))
+
+        depth = self.queue_depth()
+        with self._stats_lock:
+            self.submitted += 1
+            if depth > self.max_queue_depth:
+                self.max_queue_depth = depth
+
+        if depth >= ARCHIVE_IO_QUEUE_WARNING and depth % ARCHIVE_IO_QUEUE_WARNING == 0:
+            logger.warning(f"[ARCHIVE_IO] Backpressure: {depth} writes queued")
+
+        return future
+
+    async def run(self, chat_id: int, fn: Callable, *args, **kwargs):
+        """
+        Выполнение файловой операции в потоке записи с ожиданием результата
+
+        Args:
+            chat_id: ID чата
+            fn: Синхронная функция с файловыми операциями
+
+        Returns:
+            Результат функции
+        """
+        return await asyncio.wrap_future(self.submit(chat_id, fn, *args, **kwargs))
+
+    def _worker(self, q: queue.Queue):
+        """Цикл потока записи"""
+        while True:
+            item = q.get()
+            if item is None:
+                break
+
+            future, fn, args, kwargs, enqueued_at = item
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            started_at = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+                with self._stats_lock:
+                    self.failed += 1
+                logger.error(f"[ARCHIVE_IO] Write task {getattr(fn, '__name__', fn)} failed: {e}")
+            else:
+                future.set_result(result)
+            finally:
+                finished_at = time.monotonic()
+                with self._stats_lock:
+                    self.completed += 1
+                    self._wait_times.append(started_at - enqueued_at)
+                    self._exec_times.append(finished_at - started_at)
+
+    def queue_depth(self) -> int:
+        """Текущее количество задач в очередях"""
+        return sum(q.qsize() for q in self._queues)
+
+    def get_stats(self) -> dict:
+        """
+        Метрики очередей и задержек записи
+
+        Returns:
+            Словарь с глубиной очередей и задержками в миллисекундах
+        """
+        with self._stats_lock:
+            wait_times = sorted(self._wait_times)
+            exec_times = sorted(self._exec_times)
+            stats = {
+                'workers': self.workers,
+                'queue_depth': self.queue_depth(),
+                'queue_depth_per_worker': [q.qsize() for q in self._queues],
+                'max_queue_depth': self.max_queue_depth,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+
+        stats['wait_ms_avg'] = _avg_ms(wait_times)
+        stats['wait_ms_p95'] = _percentile_ms(wait_times, 0.95)
+        stats['write_ms_avg'] = _avg_ms(exec_times)
+        stats['write_ms_p95'] = _percentile_ms(exec_times, 0.95)
+        stats['write_ms_max'] = round(exec_times[-1] * 1000, 2) if exec_times else 0.0
+        return stats
+
+    def shutdown(self, wait: bool = True):
+        """
+        Остановка потоков после выполнения уже поставленных задач
+
+        Args:
+            wait: Дождаться завершения потоков
+        """
+        for q in self._queues:
+            q.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        logger.info("[ARCHIVE_IO] Writer stopped")
+
+
+def _avg_ms(values) -> float:
+    """Среднее значение в миллисекундах"""
+    if not values:
+        return 0.0
+    return round(sum(values) / len(values) * 1000, 2)
+
+
+def _percentile_ms(sorted_values, q: float) -> float:
+    """Перцентиль по отсортированному списку в миллисекундах"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * q))
+    return round(sorted_values[index] * 1000, 2)
+
+
+# Общий пул записи для всех архиваторов процесса
+_writer: Optional[ArchiveWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> ArchiveWriter:
+    """Получение (или запуск) общего пула записи"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ArchiveWriter()
+        return _writer
+
+
+def shutdown_writer():
+    """Остановка общего пула записи с выполнением всех задач"""
+    global _writer
+    with _writer_lock:
+        if _writer is not None:
+            _writer.shutdown(wait=True)
+            _writer = None
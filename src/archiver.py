@@ -4,16 +4,76 @@
 """
 
 import os
+import asyncio
+import itertools
 import logging
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 from aiogram.types import Message, User
+from archive_io import get_writer, wait_outside_loop
+from journal import HistoryJournal
+from segments import SegmentStore
+from search_index import SearchIndex, INDEX_NAME
+from history_reader import SparseTimeIndex, LineIndex, RecentWindow, TIME_INDEX_NAME, LINE_INDEX_NAME, RECENT_NAME
+from event_log import EventLog, EVENT_LOG_NAME
+from chat_stats import ChatStats, STATS_NAME
+from dedup import SeenMessages, SeenIdsLog, SEEN_IDS_NAME
+from media_layout import PHOTO_PREFIX, VOICE_PREFIX, VIDEO_NOTE_PREFIX, shard_subdir
+from media_groups import AlbumPart
+from columnar_export import ParquetExporter, EXPORT_DIR_NAME
+from media_store import get_media_store
+from cold_storage import compact_chat
+from storage_quota import AGENT_FILES, MEDIA, EvictionCandidate, get_storage_quota
 
 logger = logging.getLogger(__name__)
 
 ARCHIVE_BASE = "/app/chat_archive"
 
+# Максимальное количество архиваторов в памяти (остальные закрываются по LRU)
+ARCHIVER_CACHE_SIZE = int(os.getenv('ARCHIVER_CACHE_SIZE', 1000))
+
+# Чаты, структура директорий которых уже создана (проверять диск повторно не нужно).
+# Хранятся только ID, поэтому набор не ограничивается даже для десятков тысяч чатов
+_known_chat_dirs: Set[int] = set()
+
+# Версии архивов чатов: общий счётчик процесса, поэтому пересозданный после
+# вытеснения архиватор не повторит версию, для которой уже есть ответы в кэше
+_archive_versions = itertools.count(1)
+
+# Ответы и файлы бота не меняют версию архива (вопросы боту - см. archive_text_message)
+VERSION_NEUTRAL_KINDS = ('bot_response', 'bot_file')
+
+
+def preload_known_chats(base: Optional[str] = None) -> int:
+    """
+    Заполнение кэша созданных директорий одним чтением каталога архива
+
+    Вызывается при старте (в потоке), чтобы горячие чаты не проверяли диск.
+
+    Args:
+        base: Базовая директория архива (по умолчанию ARCHIVE_BASE)
+
+    Returns:
+        Количество найденных чатов
+    """
+    base_dir = Path(base or ARCHIVE_BASE)
+    if not base_dir.exists():
+        return 0
+
+    count = 0
+    with os.scandir(base_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith('chat_') and entry.is_dir():
+                try:
+                    _known_chat_dirs.add(int(entry.name[len('chat_'):]))
+                    count += 1
+                except ValueError:
+                    continue
+    return count
+
 
 class ChatArchiver:
     """Класс для архивации сообщений и событий чата"""
@@ -30,9 +90,64 @@ class ChatArchiver:
         self.media_dir = self.chat_dir / "media"
         self.agent_files_dir = self.chat_dir / "agent_files"
         self.history_file = self.chat_dir / "history.txt"
-
-        # Создание структуры директорий при первом обращении
-        self._ensure_directories()
+        self.segments_dir = self.chat_dir / "history"
+        self.manifest_file = self.segments_dir / "manifest.json"
+        self.index_file = self.chat_dir / INDEX_NAME
+        self.time_index_file = self.chat_dir / TIME_INDEX_NAME
+        self.line_index_file = self.chat_dir / LINE_INDEX_NAME
+        self.recent_file = self.chat_dir / RECENT_NAME
+        self.events_file = self.chat_dir / EVENT_LOG_NAME
+        self.stats_file = self.chat_dir / STATS_NAME
+        self.export_dir = self.chat_dir / EXPORT_DIR_NAME
+        self.seen_file = self.chat_dir / SEEN_IDS_NAME
+
+        # Все файловые операции идут через поток записи этого чата
+        self.writer = get_writer()
+
+        # Общее хранилище медиа с дедупликацией (в media/ - ссылки на него)
+        self.media_store = get_media_store(ARCHIVE_BASE)
+
+        # Учёт занятого места media/ и agent_files/ для квот
+        self.quota = get_storage_quota(ARCHIVE_BASE)
+
+        # Создание структуры директорий при первом обращении (в потоке записи,
+        # поэтому гарантированно раньше первой записи истории)
+        if self.chat_id not in _known_chat_dirs:
+            wait_outside_loop(self.writer.submit(self.chat_id, self._ensure_directories))
+
+        self.segments = SegmentStore(self.segments_dir, self.history_file)
+
+        # Последние message_id чата для отсева повторно доставленных апдейтов
+        self.seen = SeenMessages(self.seen_file)
+
+        # Запасной счётчик для имён файлов сообщений без message_id
+        self._file_counter = itertools.count(1)
+
+        # Версия содержимого архива (меняется с каждым новым сообщением или файлом)
+        self.version = next(_archive_versions)
+
+        # Буферизованная запись в history.txt (полная история), в помесячное
+        # оглавление history/manifest.json (диапазоны history.txt), в FTS-индекс,
+        # в разреженный индекс время → смещение, в индекс начал строк,
+        # в короткую копию последних строк history_recent.txt
+        # и в структурированный events.jsonl (со сводками активности в stats.json
+        # и фоновой выгрузкой в Parquet)
+        self.journal = HistoryJournal(
+            self.history_file,
+            self.chat_id,
+            writer=self.writer,
+            sinks=[
+                self.segments,
+                SearchIndex(self.index_file),
+                SparseTimeIndex(self.time_index_file, self.history_file),
+                LineIndex(self.line_index_file, self.history_file),
+                RecentWindow(self.recent_file, self.history_file, self.line_index_file),
+                EventLog(self.events_file, self.chat_id),
+                ChatStats(self.stats_file, self.events_file),
+                ParquetExporter(self.events_file, self.export_dir),
+                SeenIdsLog(self.seen_file),
+            ],
+        )
 
     def _ensure_directories(self):
         """
@@ -42,6 +157,7 @@ class ChatArchiver:
         - /app/chat_archive/chat_{id}/
         - /app/chat_archive/chat_{id}/media/
         - /app/chat_archive/chat_{id}/agent_files/
+        - /app/chat_archive/chat_{id}/history/ (помесячное оглавление)
         - /app/chat_archive/chat_{id}/history.txt
         """
         if not self.chat_dir.exists():
@@ -49,11 +165,93 @@ class ChatArchiver:
             self.chat_dir.mkdir(parents=True, exist_ok=True)
             self.media_dir.mkdir(exist_ok=True)
             self.agent_files_dir.mkdir(exist_ok=True)
+            self.segments_dir.mkdir(exist_ok=True)
 
             # Создание пустого history.txt
             self.history_file.touch()
             logger.info(f"[ARCHIVE] Directory structure created: {self.chat_dir}")
 
+        _known_chat_dirs.add(self.chat_id)
+
+    def _append_line(self, line: str, event: dict, changes_content: bool = True):
+        """
+        Дописывание строки в history.txt через журнал
+
+        Args:
+            line: Готовая строка истории с переводом строки
+            event: Структура события для индексов и events.jsonl
+            changes_content: Новое содержимое архива (меняет версию); False - вопрос боту
+        """
+        self.journal.append(line, event=event)
+        # Повтор сообщения отсеивается только после его записи (не после неудачного скачивания)
+        self.seen.mark(event.get('message_id'))
+        if changes_content and event.get('kind') not in VERSION_NEUTRAL_KINDS:
+            self.version = next(_archive_versions)
+
+    async def is_duplicate(self, message: Message) -> bool:
+        """
+        Проверка повторной доставки сообщения (до записи и скачивания)
+
+        Args:
+            message: Объект сообщения из aiogram
+
+        Returns:
+            True, если сообщение с таким message_id уже обрабатывалось
+        """
+        if not self.seen.loaded:
+            await self.writer.run(self.chat_id, self.seen.load)
+
+        message_id = getattr(message, 'message_id', None)
+        if self.seen.check(message_id):
+            logger.info(f"[ARCHIVE] Dropped re-delivered message_id={message_id} in chat_id={self.chat_id}")
+            return True
+        return False
+
+    async def flush(self):
+        """Сброс буфера истории на диск с ожиданием записи (перед чтением архива агентом)"""
+        await self.journal.aflush()
+
+    async def compact(self) -> dict:
+        """Сжатие холодной истории и документов чата (в потоке записи чата)"""
+        return await self.writer.run(
+            self.chat_id, compact_chat, self.chat_dir, self.segments, self.media_store, quota=self.quota,
+        )
+
+    async def _save_media(self, bot, file, filepath: Path):
+        """Сохранение файла Telegram в media/ с учётом занятого места"""
+        await self.media_store.save(bot, file, filepath, self.writer, self.chat_id)
+        await self.writer.run(self.chat_id, self.quota.record, self.chat_id, MEDIA, filepath)
+
+    async def track_agent_files(self) -> int:
+        """Учёт файлов, созданных или удалённых агентом в agent_files/ (после запроса)"""
+        return await self.writer.run(self.chat_id, self.quota.sync_dir, self.chat_id, AGENT_FILES, self.agent_files_dir)
+
+    async def evict_file(self, candidate: EvictionCandidate) -> int:
+        """
+        Удаление файла чата по квоте хранилища с отметкой в истории
+
+        Args:
+            candidate: Файл, выбранный StorageQuota.plan_eviction
+
+        Returns:
+            Освобождённый в учёте размер в байтах
+        """
+        size = await self.writer.run(self.chat_id, self.quota.evict, candidate, self.media_store)
+        path = Path(candidate.path)
+        self.archive_system_event(
+            'file_evicted',
+            f"Файл {candidate.category}/{path.name} удалён по квоте хранилища ({size / 1024:.0f} КБ)",
+        )
+        return size
+
+    def release(self):
+        """Сброс буфера и освобождение ресурсов архиватора без ожидания (при вытеснении из кэша)"""
+        return self.journal.release()
+
+    def close(self):
+        """Сброс буфера и освобождение ресурсов архиватора (с ожиданием записи)"""
+        self.journal.close()
+
     def _format_timestamp(self) -> str:
         """Форматирование текущего времени в формат [DD.MM HH:MM]"""
         return datetime.now().strftime("[%d.%m %H:%M]")
@@ -62,6 +260,43 @@ class ChatArchiver:
         """Генерация таймштампа для имени файла в формате YYYYMMDD_HHMMSS"""
         return datetime.now().strftime("%Y%m%d_%H%M%S")
 
+    def _file_tag(self, message: Message, file) -> str:
+        """
+        Уникальная часть имени файла без проверок на диске
+
+        message_id уникален в чате; без него - file_unique_id (совпадение
+        означает тот же файл), в крайнем случае - счётчик архиватора.
+        """
+        message_id = getattr(message, 'message_id', None)
+        if message_id is not None:
+            return str(message_id)
+        file_unique_id = getattr(file, 'file_unique_id', None)
+        if file_unique_id:
+            return file_unique_id
+        return f"n{next(self._file_counter)}"
+
+    def _photo_filename(self, message: Message, photo) -> str:
+        """Имя фото: photo_{timestamp}_{message_id}.jpg"""
+        return f"{PHOTO_PREFIX}{self._generate_filename_timestamp()}_{self._file_tag(message, photo)}.jpg"
+
+    def _document_filename(self, message: Message, document) -> str:
+        """Имя документа: оригинальное имя с ID сообщения (report_{message_id}.xlsx)"""
+        tag = self._file_tag(message, document)
+        original_filename = document.file_name or f"document_{self._generate_filename_timestamp()}"
+        stem, dot, suffix = original_filename.rpartition('.')
+        return f"{stem}_{tag}.{suffix}" if dot and stem else f"{original_filename}_{tag}"
+
+    def _media_file(self, filename: str) -> Tuple[Path, str]:
+        """
+        Путь нового файла в media/YYYY/MM/ (раскладка по месяцам)
+
+        Returns:
+            (путь на диске, полный путь для истории)
+        """
+        subdir = shard_subdir(datetime.now())
+        full_path = f"/app/chat_archive/chat_{self.chat_id}/media/{subdir}/{filename}"
+        return self.media_dir / subdir / filename, full_path
+
     def _get_user_name(self, user: Optional[User]) -> str:
         """
         Получение имени пользователя
@@ -83,7 +318,28 @@ class ChatArchiver:
         else:
             return f"User_{user.id}"
 
-    def archive_text_message(self, message: Message):
+    def _message_meta(self, message: Optional[Message]) -> dict:
+        """
+        Идентификаторы сообщения для структурированного журнала
+
+        Args:
+            message: Объект сообщения из aiogram
+
+        Returns:
+            Словарь с message_id, reply_to и sender_id (отсутствующие - None)
+        """
+        if message is None:
+            return {}
+
+        reply = getattr(message, 'reply_to_message', None)
+        user = getattr(message, 'from_user', None)
+        return {
+            'message_id': getattr(message, 'message_id', None),
+            'reply_to': reply.message_id if reply else None,
+            'sender_id': user.id if user else None,
+        }
+
+    def archive_text_message(self, message: Message, is_query: bool = False):
         """
         Сохранение текстового сообщения в history.txt (задача 1.2)
 
@@ -91,6 +347,7 @@ class ChatArchiver:
 
         Args:
             message: Объект сообщения из aiogram
+            is_query: Вопрос боту (не меняет версию архива для кэша ответов)
         """
         if not message.text:
             return
@@ -101,13 +358,15 @@ class ChatArchiver:
 
         line = f"{timestamp} {user_name}: {text}\n"
 
-        # Дописывание в конец файла
-        with open(self.history_file, 'a', encoding='utf-8') as f:
-            f.write(line)
+        # Дописывание в конец файла (через буфер журнала)
+        self._append_line(line, {
+            'kind': 'text', 'sender': user_name, 'text': message.text,
+            **self._message_meta(message),
+        }, changes_content=not is_query)
 
         logger.info(f"[ARCHIVE] Saved text message from {user_name} in chat_id={self.chat_id}")
 
-    def archive_system_event(self, event_type: str, details: str):
+    def archive_system_event(self, event_type: str, details: str, message: Optional[Message] = None):
         """
         Логирование системных событий в history.txt (задача 1.3)
 
@@ -116,6 +375,7 @@ class ChatArchiver:
         Args:
             event_type: Тип события (user_joined, user_left, title_changed, etc.)
             details: Детали события
+            message: Сервисное сообщение с событием (для events.jsonl)
         """
         timestamp = self._format_timestamp()
 
@@ -125,13 +385,16 @@ class ChatArchiver:
             'user_left': '👋',
             'title_changed': '✏️',
             'photo_changed': '🖼️',
+            'file_evicted': '🗑️',
         }
 
         icon = event_icons.get(event_type, '📌')
         line = f"{timestamp} {icon} {details}\n"
 
-        with open(self.history_file, 'a', encoding='utf-8') as f:
-            f.write(line)
+        self._append_line(line, {
+            'kind': 'system', 'event_type': event_type, 'text': details,
+            **self._message_meta(message),
+        })
 
         logger.info(f"[ARCHIVE] Logged system event '{event_type}' in chat_id={self.chat_id}")
 
@@ -147,7 +410,7 @@ class ChatArchiver:
 
         for user in message.new_chat_members:
             user_name = self._get_user_name(user)
-            self.archive_system_event('user_joined', f"{user_name} присоединился")
+            self.archive_system_event('user_joined', f"{user_name} присоединился", message)
 
     def handle_left_chat_member(self, message: Message):
         """
@@ -160,7 +423,7 @@ class ChatArchiver:
             return
 
         user_name = self._get_user_name(message.left_chat_member)
-        self.archive_system_event('user_left', f"{user_name} покинул чат")
+        self.archive_system_event('user_left', f"{user_name} покинул чат", message)
 
     def handle_new_chat_title(self, message: Message):
         """
@@ -172,7 +435,7 @@ class ChatArchiver:
         if not message.new_chat_title:
             return
 
-        self.archive_system_event('title_changed', f"Название изменено: {message.new_chat_title}")
+        self.archive_system_event('title_changed', f"Название изменено: {message.new_chat_title}", message)
 
     def handle_new_chat_photo(self, message: Message):
         """
@@ -184,7 +447,7 @@ class ChatArchiver:
         if not message.new_chat_photo:
             return
 
-        self.archive_system_event('photo_changed', "Фото чата изменено")
+        self.archive_system_event('photo_changed', "Фото чата изменено", message)
 
     def get_archive_paths(self) -> dict:
         """
@@ -198,14 +461,23 @@ class ChatArchiver:
             'media_dir': str(self.media_dir),
             'agent_files_dir': str(self.agent_files_dir),
             'history_file': str(self.history_file),
+            'recent_file': str(self.recent_file),
+            'segments_dir': str(self.segments_dir),
+            'manifest_file': str(self.manifest_file),
+            'index_file': str(self.index_file),
+            'time_index_file': str(self.time_index_file),
+            'line_index_file': str(self.line_index_file),
+            'events_file': str(self.events_file),
+            'stats_file': str(self.stats_file),
+            'export_dir': str(self.export_dir),
         }
 
     async def archive_photo(self, message: Message, bot):
         """
         Сохранение фото в media/ (задача 2.1)
 
-        Формат имени: photo_{timestamp}.jpg
-        В history.txt добавляется: 📷 photo_{timestamp}.jpg → media/photo_{timestamp}.jpg
+        Формат имени: photo_{timestamp}_{message_id}.jpg
+        В history.txt добавляется: 📷 photo_{timestamp}_{message_id}.jpg → media/YYYY/MM/photo_...jpg
 
         Args:
             message: Сообщение с фото
@@ -216,21 +488,21 @@ class ChatArchiver:
 
         # Берем фото максимального качества (последнее в списке)
         photo = message.photo[-1]
-        timestamp = self._generate_filename_timestamp()
-        filename = f"photo_{timestamp}.jpg"
-        filepath = self.media_dir / filename
+        filename = self._photo_filename(message, photo)
+        filepath, full_path = self._media_file(filename)
 
-        # Скачивание файла
-        await bot.download(photo, destination=filepath)
+        # Скачивание файла (или ссылка на уже сохранённую копию)
+        await self._save_media(bot, photo, filepath)
 
         # Запись в history.txt
         timestamp_display = self._format_timestamp()
         user_name = self._get_user_name(message.from_user)
-        full_path = f"/app/chat_archive/chat_{self.chat_id}/media/{filename}"
         line = f"{timestamp_display} {user_name} отправил файл 📷 {filename} - полный путь {full_path}\n"
 
-        with open(self.history_file, 'a', encoding='utf-8') as f:
-            f.write(line)
+        self._append_line(line, {
+            'kind': 'photo', 'sender': user_name, 'text': filename, 'media_path': full_path,
+            **self._message_meta(message),
+        })
 
         logger.info(f"[ARCHIVE] Saved photo {filename} from {user_name} in chat_id={self.chat_id}")
 
@@ -238,8 +510,8 @@ class ChatArchiver:
         """
         Сохранение документа в media/ (задача 2.2)
 
-        Документ сохраняется с оригинальным именем.
-        Если файл существует, добавляется таймштамп: filename_{timestamp}.ext
+        Документ сохраняется с оригинальным именем и ID сообщения: report_{message_id}.xlsx
+        (одинаковые имена от разных сообщений не перезаписывают друг друга)
 
         Args:
             message: Сообщение с документом
@@ -249,34 +521,21 @@ class ChatArchiver:
             return
 
         document = message.document
-        original_filename = document.file_name or f"document_{self._generate_filename_timestamp()}"
-
-        # Проверка существования файла
-        filepath = self.media_dir / original_filename
-
-        if filepath.exists():
-            # Добавляем таймштамп к имени файла
-            timestamp = self._generate_filename_timestamp()
-            name_parts = original_filename.rsplit('.', 1)
-            if len(name_parts) == 2:
-                filename = f"{name_parts[0]}_{timestamp}.{name_parts[1]}"
-            else:
-                filename = f"{original_filename}_{timestamp}"
-            filepath = self.media_dir / filename
-        else:
-            filename = original_filename
+        filename = self._document_filename(message, document)
+        filepath, full_path = self._media_file(filename)
 
-        # Скачивание файла
-        await bot.download(document, destination=filepath)
+        # Скачивание файла (или ссылка на уже сохранённую копию)
+        await self._save_media(bot, document, filepath)
 
         # Запись в history.txt
         timestamp_display = self._format_timestamp()
         user_name = self._get_user_name(message.from_user)
-        full_path = f"/app/chat_archive/chat_{self.chat_id}/media/{filename}"
         line = f"{timestamp_display} {user_name} отправил файл 📄 {filename} - полный путь {full_path}\n"
 
-        with open(self.history_file, 'a', encoding='utf-8') as f:
-            f.write(line)
+        self._append_line(line, {
+            'kind': 'document', 'sender': user_name, 'text': filename, 'media_path': full_path,
+            **self._message_meta(message),
+        })
 
         logger.info(f"[ARCHIVE] Saved document {filename} from {user_name} in chat_id={self.chat_id}")
 
@@ -284,7 +543,7 @@ class ChatArchiver:
         """
         Сохранение голосового сообщения в media/ (задача 2.3)
 
-        Формат имени: voice_{timestamp}.ogg
+        Формат имени: voice_{timestamp}_{message_id}.ogg
 
         Args:
             message: Сообщение с голосовым сообщением
@@ -295,20 +554,21 @@ class ChatArchiver:
 
         voice = message.voice
         timestamp = self._generate_filename_timestamp()
-        filename = f"voice_{timestamp}.ogg"
-        filepath = self.media_dir / filename
+        filename = f"{VOICE_PREFIX}{timestamp}_{self._file_tag(message, voice)}.ogg"
+        filepath, full_path = self._media_file(filename)
 
-        # Скачивание файла
-        await bot.download(voice, destination=filepath)
+        # Скачивание файла (или ссылка на уже сохранённую копию)
+        await self._save_media(bot, voice, filepath)
 
         # Запись в history.txt
         timestamp_display = self._format_timestamp()
         user_name = self._get_user_name(message.from_user)
-        full_path = f"/app/chat_archive/chat_{self.chat_id}/media/{filename}"
         line = f"{timestamp_display} {user_name} отправил файл 🎤 {filename} - полный путь {full_path}\n"
 
-        with open(self.history_file, 'a', encoding='utf-8') as f:
-            f.write(line)
+        self._append_line(line, {
+            'kind': 'voice', 'sender': user_name, 'text': filename, 'media_path': full_path,
+            **self._message_meta(message),
+        })
 
         logger.info(f"[ARCHIVE] Saved voice message {filename} from {user_name} in chat_id={self.chat_id}")
 
@@ -316,7 +576,7 @@ class ChatArchiver:
         """
         Сохранение видео-кружка в media/ (задача 2.3)
 
-        Формат имени: videonote_{timestamp}.mp4
+        Формат имени: videonote_{timestamp}_{message_id}.mp4
 
         Args:
             message: Сообщение с видео-кружком
@@ -327,23 +587,96 @@ class ChatArchiver:
 
         video_note = message.video_note
         timestamp = self._generate_filename_timestamp()
-        filename = f"videonote_{timestamp}.mp4"
-        filepath = self.media_dir / filename
+        filename = f"{VIDEO_NOTE_PREFIX}{timestamp}_{self._file_tag(message, video_note)}.mp4"
+        filepath, full_path = self._media_file(filename)
 
-        # Скачивание файла
-        await bot.download(video_note, destination=filepath)
+        # Скачивание файла (или ссылка на уже сохранённую копию)
+        await self._save_media(bot, video_note, filepath)
 
         # Запись в history.txt
         timestamp_display = self._format_timestamp()
         user_name = self._get_user_name(message.from_user)
-        full_path = f"/app/chat_archive/chat_{self.chat_id}/media/{filename}"
         line = f"{timestamp_display} {user_name} отправил файл 🎥 {filename} - полный путь {full_path}\n"
 
-        with open(self.history_file, 'a', encoding='utf-8') as f:
-            f.write(line)
+        self._append_line(line, {
+            'kind': 'video_note', 'sender': user_name, 'text': filename, 'media_path': full_path,
+            **self._message_meta(message),
+        })
 
         logger.info(f"[ARCHIVE] Saved video note {filename} from {user_name} in chat_id={self.chat_id}")
 
+    def prepare_album(self, messages: List[Message]) -> List[AlbumPart]:
+        """
+        Файлы альбома с именами и путями (фото и документы, как у одиночных сообщений)
+
+        Args:
+            messages: Части альбома по порядку
+
+        Returns:
+            Список частей для archive_album
+        """
+        parts = []
+        for message in messages:
+            if message.photo:
+                file = message.photo[-1]
+                kind, icon, filename = 'photo', '📷', self._photo_filename(message, file)
+            elif message.document:
+                file = message.document
+                kind, icon, filename = 'document', '📄', self._document_filename(message, file)
+            else:
+                continue
+            filepath, full_path = self._media_file(filename)
+            parts.append(AlbumPart(message, kind, icon, file, filename, filepath, full_path))
+        return parts
+
+    async def _save_album_part(self, bot, part: AlbumPart):
+        await self._save_media(bot, part.file, part.filepath)
+        part.saved = True
+
+    async def archive_album(self, parts: List[AlbumPart], bot):
+        """
+        Сохранение альбома: файлы скачиваются параллельно, строки истории
+        (по строке на файл и подпись) пишутся одной группой после скачивания всех
+
+        При ошибке повтор скачивает только недостающие файлы.
+
+        Args:
+            parts: Части альбома (prepare_album)
+            bot: Объект бота для скачивания файлов
+        """
+        if not parts:
+            return
+
+        results = await asyncio.gather(
+            *(self._save_album_part(bot, part) for part in parts if not part.saved),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+        timestamp_display = self._format_timestamp()
+        user_name = self._get_user_name(parts[0].message.from_user)
+        for part in parts:
+            line = (
+                f"{timestamp_display} {user_name} отправил файл {part.icon} {part.filename} "
+                f"- полный путь {part.full_path}\n"
+            )
+            self._append_line(line, {
+                'kind': part.kind, 'sender': user_name, 'text': part.filename, 'media_path': part.full_path,
+                **self._message_meta(part.message),
+            })
+
+        caption_message = next((part.message for part in parts if part.message.caption), None)
+        if caption_message is not None:
+            caption = caption_message.caption.replace('\n', ' ')
+            self._append_line(f"{timestamp_display} {user_name}: {caption}\n", {
+                'kind': 'text', 'sender': user_name, 'text': caption_message.caption,
+                **self._message_meta(caption_message),
+            })
+
+        logger.info(f"[ARCHIVE] Saved album of {len(parts)} files from {user_name} in chat_id={self.chat_id}")
+
     def archive_bot_response(self, text: str):
         """
         Сохранение текстового ответа бота в history.txt (задача 1.4)
@@ -361,8 +694,7 @@ class ChatArchiver:
         text_oneline = text.replace('\n', ' ')
         line = f"{timestamp} 🤖 Бот: {text_oneline}\n"
 
-        with open(self.history_file, 'a', encoding='utf-8') as f:
-            f.write(line)
+        self._append_line(line, {'kind': 'bot_response', 'sender': 'Бот', 'text': text})
 
         logger.info(f"[ARCHIVE] Saved bot response in chat_id={self.chat_id}")
 
@@ -386,7 +718,7 @@ class ChatArchiver:
 
         # Определяем директорию (media/ или agent_files/) и иконку
         if 'media' in filepath:
-            icon = "📷" if filename.startswith('photo_') else "📄"
+            icon = "📷" if filename.startswith(PHOTO_PREFIX) else "📄"
         elif 'agent_files' in filepath:
             # Определяем тип файла по расширению
             ext = path.suffix.lower()
@@ -404,7 +736,215 @@ class ChatArchiver:
 
         line = f"{timestamp} 🤖 Бот отправил файл {icon} {filename} - полный путь {full_path}\n"
 
-        with open(self.history_file, 'a', encoding='utf-8') as f:
-            f.write(line)
+        self._append_line(line, {
+            'kind': 'bot_file', 'sender': 'Бот', 'text': filename, 'media_path': full_path,
+        })
+
+        # Отправленный файл использован - дальше в очереди на удаление по квоте
+        self.writer.submit(self.chat_id, self.quota.touch, filepath)
 
         logger.info(f"[ARCHIVE] Saved bot file record: {filename} in chat_id={self.chat_id}")
+
+
+class ArchiverRegistry:
+    """
+    Ограниченный реестр архиваторов чатов с вытеснением давно неактивных (LRU)
+
+    Архиватор, которым пользуется обработчик или фоновая задача (скачивание,
+    запрос агента), закрепляется через pin()/pinned() и не вытесняется, пока
+    закреплён: иначе задача дописывала бы историю через закрытый журнал, а
+    новый архиватор того же чата вёл бы отдельные сводки и окно последних строк.
+    """
+
+    def __init__(self, max_size: int = ARCHIVER_CACHE_SIZE):
+        """
+        Args:
+            max_size: Максимальное количество архиваторов в памяти
+        """
+        self.max_size = max(1, max_size)
+        self._archivers: "OrderedDict[int, ChatArchiver]" = OrderedDict()
+        # Количество закреплений архиватора по chat_id
+        self._pins: Dict[int, int] = {}
+
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, chat_id: int) -> ChatArchiver:
+        """
+        Получение архиватора чата (создаётся при первом обращении)
+
+        Args:
+            chat_id: ID чата
+
+        Returns:
+            Архиватор чата
+        """
+        archiver = self._archivers.get(chat_id)
+        if archiver is not None:
+            self._archivers.move_to_end(chat_id)
+            self.hits += 1
+            return archiver
+
+        self.misses += 1
+        archiver = ChatArchiver(chat_id)
+        self._archivers[chat_id] = archiver
+        self._evict(keep=chat_id)
+        return archiver
+
+    def _evict(self, keep: Optional[int] = None):
+        """
+        Вытеснение давно неактивных архиваторов сверх max_size
+
+        Закреплённые архиваторы пропускаются (реестр временно может быть больше
+        max_size); они вытесняются после открепления.
+
+        Args:
+            keep: Чат, архиватор которого только что запрошен
+        """
+        excess = len(self._archivers) - self.max_size
+        if excess <= 0:
+            return
+
+        victims = [chat_id for chat_id in self._archivers if chat_id not in self._pins and chat_id != keep]
+        for old_chat_id in victims[:excess]:
+            self._archivers.pop(old_chat_id).release()
+            self.evictions += 1
+            logger.debug(f"[ARCHIVE] Evicted archiver for chat_id={old_chat_id}")
+
+    def pin(self, chat_id: int) -> ChatArchiver:
+        """
+        Получение архиватора чата с защитой от вытеснения до unpin()
+
+        Args:
+            chat_id: ID чата
+
+        Returns:
+            Архиватор чата
+        """
+        archiver = self.get(chat_id)
+        self._pins[chat_id] = self._pins.get(chat_id, 0) + 1
+        return archiver
+
+    def unpin(self, chat_id: int):
+        """Снятие закрепления (архиватор снова может быть вытеснен)"""
+        pins = self._pins.get(chat_id, 0) - 1
+        if pins > 0:
+            self._pins[chat_id] = pins
+            return
+        self._pins.pop(chat_id, None)
+        self._evict()
+
+    @contextmanager
+    def pinned(self, chat_id: int) -> Iterator[ChatArchiver]:
+        """Архиватор чата, закреплённый на время блока with"""
+        archiver = self.pin(chat_id)
+        try:
+            yield archiver
+        finally:
+            self.unpin(chat_id)
+
+    async def enforce_quota(self, chat_id: int) -> int:
+        """
+        Удаление давно не использованных файлов, если квота превышена
+
+        Проверка квоты идёт по итогам в памяти; файлы удаляются в потоках
+        записи своих чатов, в истории каждого чата остаётся отметка.
+
+        Args:
+            chat_id: ID чата, в котором появились файлы
+
+        Returns:
+            Освобождённый в учёте размер в байтах
+        """
+        quota = get_storage_quota(ARCHIVE_BASE)
+        if not quota.is_over_quota(chat_id):
+            return 0
+
+        plan = await asyncio.to_thread(quota.plan_eviction, chat_id)
+        freed = 0
+        for candidate in plan:
+            try:
+                with self.pinned(candidate.chat_id) as archiver:
+                    freed += await archiver.evict_file(candidate)
+            except Exception as e:
+                logger.error(f"[QUOTA] Error evicting {candidate.path}: {e}", exc_info=True)
+
+        logger.info(f"[QUOTA] Evicted {len(plan)} files ({freed} bytes) after chat_id={chat_id} exceeded quota")
+        return freed
+
+    def peek(self, chat_id: int) -> Optional[ChatArchiver]:
+        """Архиватор чата, если он в памяти (без создания и без обновления LRU)"""
+        return self._archivers.get(chat_id)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._archivers
+
+    def __len__(self) -> int:
+        return len(self._archivers)
+
+    def values(self):
+        """Архиваторы в памяти"""
+        return list(self._archivers.values())
+
+    def get_stats(self) -> dict:
+        """Метрики реестра: size, max_size, pinned, hits, misses, evictions, known_dirs"""
+        return {
+            'size': len(self._archivers),
+            'max_size': self.max_size,
+            'pinned': len(self._pins),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'known_dirs': len(_known_chat_dirs),
+        }
+
+    def close_all(self):
+        """Сброс и закрытие всех архиваторов с ожиданием записи (при остановке)"""
+        for chat_id, archiver in list(self._archivers.items()):
+            try:
+                archiver.close()
+            except Exception as e:
+                logger.error(f"[ARCHIVE] Error closing archiver for chat_id={chat_id}: {e}")
+        self._archivers.clear()
+        self._pins.clear()
+
+
+async def compact_all_chats(registry: ArchiverRegistry) -> dict:
+    """
+    Сжатие холодных данных всех чатов архива (фоновая задача бота)
+
+    Сжатие идёт в потоке записи чата, поэтому не пересекается с записью истории.
+
+    Args:
+        registry: Реестр архиваторов бота
+
+    Returns:
+        Количество чатов и сжатых файлов: chats, files
+    """
+    writer = get_writer()
+    media_store = get_media_store(ARCHIVE_BASE)
+    base = Path(ARCHIVE_BASE)
+    chat_dirs = await asyncio.to_thread(lambda: sorted(p for p in base.glob('chat_*') if p.is_dir()))
+
+    files = 0
+    for chat_dir in chat_dirs:
+        try:
+            chat_id = int(chat_dir.name[len('chat_'):])
+        except ValueError:
+            continue
+
+        archiver = registry.peek(chat_id)
+        try:
+            if archiver is not None:
+                summary = await archiver.compact()
+            else:
+                summary = await writer.run(
+                    chat_id, compact_chat, chat_dir, media_store=media_store, quota=get_storage_quota(ARCHIVE_BASE),
+                )
+            files += summary['files']
+        except Exception as e:
+            logger.error(f"[COMPACT] Error compacting {chat_dir.name}: {e}", exc_info=True)
+
+    return {'chats': len(chat_dirs), 'files': files}
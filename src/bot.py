@@ -4,13 +4,22 @@ Telegram AI Bot with archiving and Claude Agent SDK integration
 """
 
 import os
+import asyncio
 import logging
+from typing import List, Optional, Set
 from aiogram import Bot, Dispatcher
 from aiogram.types import Message, FSInputFile
 from aiogram.filters import Command
 from aiogram.enums import ParseMode
-from archiver import ChatArchiver
+from archiver import ChatArchiver, ArchiverRegistry, preload_known_chats, compact_all_chats
+from cold_storage import COMPACTION_INTERVAL, get_compaction_stats
+from archive_io import get_writer, shutdown_writer
+from dedup import get_dedup_stats
+from media_queue import MediaDownloadQueue
+from media_groups import MediaGroupCollector
 from agent import ClaudeAgent
+from agent_scheduler import AgentScheduler, AgentQueueFull
+from agent_tools import get_tool_stats
 from formatter import markdown_to_telegram_html
 from file_sender import parse_file_paths, mask_file_paths, get_file_type
 
@@ -26,6 +35,9 @@ logger = logging.getLogger(__name__)
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 CLAUDE_CODE_OAUTH_TOKEN = os.getenv('CLAUDE_CODE_OAUTH_TOKEN')
 
+# Telegram ID администраторов через запятую (для /storage)
+ADMIN_USER_IDS = {int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()}
+
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN not found in environment")
 if not CLAUDE_CODE_OAUTH_TOKEN:
@@ -35,12 +47,21 @@ if not CLAUDE_CODE_OAUTH_TOKEN:
 bot = Bot(token=BOT_TOKEN)
 dp = Dispatcher()
 
-# Словарь архиваторов для каждого чата
-archivers = {}
+# Архиваторы чатов (ограниченный LRU-реестр)
+archivers = ArchiverRegistry()
+
+# Фоновая очередь скачивания медиа
+media_queue = MediaDownloadQueue()
+
+# Проверки квоты хранилища после скачиваний (дожидаемся при остановке)
+quota_tasks: Set[asyncio.Task] = set()
 
 # AI-агент
 agent = ClaudeAgent()
 
+# Очередь запросов к агенту: по одному на чат, общий лимит одновременных
+scheduler = AgentScheduler()
+
 
 @dp.message(Command("start"))
 async def cmd_start(message: Message):
@@ -49,11 +70,137 @@ async def cmd_start(message: Message):
     logger.info(f"[START] chat_id={message.chat.id}")
 
 
+@dp.message(Command("iostats"))
+async def cmd_iostats(message: Message):
+    """Метрики фоновой записи архива: глубина очередей и задержки"""
+    stats = get_writer().get_stats()
+    registry = archivers.get_stats()
+    compaction = get_compaction_stats()
+    dedup = get_dedup_stats()
+    sessions = agent.get_session_stats()
+    pool = agent.get_pool_stats()
+    queue = scheduler.get_stats()
+    cache = agent.get_cache_stats()
+    await message.answer(
+        f"💾 Запись архива\n"
+        f"Очередь: {stats['queue_depth']} (макс. {stats['max_queue_depth']})\n"
+        f"Выполнено: {stats['completed']}, ошибок: {stats['failed']}\n"
+        f"Ожидание: avg {stats['wait_ms_avg']} мс, p95 {stats['wait_ms_p95']} мс\n"
+        f"Запись: avg {stats['write_ms_avg']} мс, p95 {stats['write_ms_p95']} мс, "
+        f"max {stats['write_ms_max']} мс\n"
+        f"Архиваторов в памяти: {registry['size']}/{registry['max_size']}, "
+        f"вытеснено: {registry['evictions']}\n"
+        f"Сжато файлов: {compaction['files']} (x{compaction['ratio']}), "
+        f"распаковка {compaction['decode_mb_s']} MB/s\n"
+        f"Повторных апдейтов отброшено: {dedup['duplicates']} из {dedup['checked']}\n"
+        f"Сессий агента: {sessions['live']}/{sessions['max_sessions']} (занято {sessions['busy']}), "
+        f"вытеснено: {sessions['evicted']}, закрыто по простою: {sessions['reaped'] + sessions['expired']}\n"
+        f"Пул клиентов: {pool['ready']}/{pool['target']}, из пула {pool['hits']} из {pool['hits'] + pool['misses']}\n"
+        f"Старт сессии: из пула p50 {pool['warm']['p50_ms']:.0f} мс, "
+        f"холодный p50 {pool['cold']['p50_ms']:.0f} мс, p95 {pool['cold']['p95_ms']:.0f} мс\n"
+        f"Запросы к агенту: выполняется {queue['running']}/{queue['max_concurrent']}, "
+        f"ждут {queue['waiting']} (макс. {queue['max_waiting']}), отклонено {queue['rejected']}, "
+        f"ожидание p95 {queue['wait_ms_p95']} мс\n"
+        f"Кэш ответов: {cache['hits']} из {cache['hits'] + cache['misses']} "
+        f"({cache['hit_rate'] * 100:.0f}%), уточнений мимо кэша {cache['bypassed']}, "
+        f"сэкономлено ${cache['saved_cost_usd']:.2f}"
+    )
+    logger.info(f"[IOSTATS] chat_id={message.chat.id}: {stats}")
+
+
+@dp.message(Command("mediastats"))
+async def cmd_mediastats(message: Message):
+    """Статистика дедупликации медиафайлов"""
+    store = get_archiver(message.chat.id).media_store
+    stats = await asyncio.to_thread(store.get_stats)
+    mb = 1024 * 1024
+    await message.answer(
+        f"🗂️ Хранилище медиа\n"
+        f"Файлов в чатах: {stats['files']}, уникальных: {stats['blobs']}\n"
+        f"Занято: {stats['stored_bytes'] / mb:.1f} МБ из {stats['logical_bytes'] / mb:.1f} МБ\n"
+        f"Сэкономлено: {stats['bytes_saved'] / mb:.1f} МБ (коэффициент {stats['dedup_ratio']})\n"
+        f"Скачиваний пропущено: {stats['downloads_skipped']} "
+        f"({stats['bytes_not_downloaded'] / mb:.1f} МБ), "
+        f"дубликатов по содержимому: {stats['content_duplicates']}"
+    )
+    queue_stats = media_queue.get_stats()
+    await message.answer(
+        f"📥 Очередь скачивания\n"
+        f"В очереди: {queue_stats['depth']}, качается: {queue_stats['in_flight']}\n"
+        f"Готово: {queue_stats['completed']}, ошибок: {queue_stats['failed']}, "
+        f"повторов: {queue_stats['retried']}, ждали места в очереди: {queue_stats['throttled']}\n"
+        f"За минуту: {queue_stats['files_per_min']} файлов, {queue_stats['mb_per_sec']} МБ/с\n"
+        f"Среднее время скачивания: {queue_stats['avg_download_s']} с"
+    )
+    album_stats = media_groups.get_stats()
+    await message.answer(
+        f"🖼️ Альбомы\n"
+        f"Собрано: {album_stats['albums']} ({album_stats['parts']} файлов, "
+        f"в среднем {album_stats['avg_parts']}), ждут частей: {album_stats['pending']}"
+    )
+    logger.info(f"[MEDIASTATS] chat_id={message.chat.id}: {stats}, queue: {queue_stats}, albums: {album_stats}")
+
+
+@dp.message(Command("toolstats"))
+async def cmd_toolstats(message: Message):
+    """Вызовы инструментов архива агентом: количество, время, размер ответов"""
+    stats = get_tool_stats()
+    lines = ["🛠️ Инструменты архива"]
+    for name, tool_stats in sorted(stats.items(), key=lambda item: -item[1]['calls']):
+        if not tool_stats['calls']:
+            continue
+        lines.append(
+            f"{name}: {tool_stats['calls']} вызовов, ошибок {tool_stats['errors']}, "
+            f"avg {tool_stats['avg_ms']} мс, p95 {tool_stats['p95_ms']} мс, "
+            f"~{tool_stats['avg_chars']} симв."
+        )
+    if len(lines) == 1:
+        lines.append("Вызовов пока не было")
+    await message.answer('\n'.join(lines))
+    logger.info(f"[TOOLSTATS] chat_id={message.chat.id}: {stats}")
+
+
+def _format_size(size: int) -> str:
+    """Размер в МБ для сообщений"""
+    return f"{size / (1024 * 1024):.1f} МБ"
+
+
+@dp.message(Command("storage"))
+async def cmd_storage(message: Message):
+    """Занятое место и квоты хранилища (только для администраторов)"""
+    if not message.from_user or message.from_user.id not in ADMIN_USER_IDS:
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+
+    quota = get_archiver(message.chat.id).quota
+    stats = await asyncio.to_thread(quota.get_stats)
+    chat = await asyncio.to_thread(quota.chat_stats, message.chat.id)
+
+    def limit(value: int) -> str:
+        return _format_size(value) if value else "без ограничения"
+
+    top = "\n".join(f"  chat_{chat_id}: {_format_size(size)}" for chat_id, size in stats['top_chats'])
+    await message.answer(
+        f"🗄 Хранилище\n"
+        f"Всего: {_format_size(stats['total'])} (квота: {limit(stats['global_quota'])})\n"
+        f"Файлы агента: {_format_size(stats['by_category'].get('agent_files', 0))}, "
+        f"медиа: {_format_size(stats['by_category'].get('media', 0))}\n"
+        f"Этот чат: {_format_size(chat['total'])} (квота: {limit(stats['chat_quota'])})\n"
+        f"Удалено по квоте: {stats['evicted_files']} файлов, {_format_size(stats['evicted_bytes'])}\n"
+        f"Крупнейшие чаты:\n{top or '  нет данных'}"
+    )
+    logger.info(f"[STORAGE] chat_id={message.chat.id}: {stats}")
+
+
 def get_archiver(chat_id: int) -> ChatArchiver:
     """Получение или создание архиватора для чата"""
-    if chat_id not in archivers:
-        archivers[chat_id] = ChatArchiver(chat_id)
-    return archivers[chat_id]
+    return archivers.get(chat_id)
+
+
+def is_reply_to_bot(message: Message) -> bool:
+    """Ответ на сообщение бота (продолжение беседы с агентом)"""
+    reply = message.reply_to_message
+    return bool(reply and reply.from_user and reply.from_user.is_bot)
 
 
 def is_bot_mentioned(message: Message) -> bool:
@@ -65,15 +212,17 @@ def is_bot_mentioned(message: Message) -> bool:
     - reply на сообщение бота
     """
     # Проверка reply на сообщение бота
-    if message.reply_to_message and message.reply_to_message.from_user.is_bot:
+    if is_reply_to_bot(message):
         return True
 
-    # Проверка @mention
-    if message.entities:
-        for entity in message.entities:
+    # Проверка @mention (в тексте или в подписи к файлу)
+    text = message.text or message.caption or ''
+    entities = message.entities or getattr(message, 'caption_entities', None)
+    if entities:
+        for entity in entities:
             if entity.type == "mention":
                 # Извлекаем текст упоминания
-                mention = message.text[entity.offset:entity.offset + entity.length]
+                mention = text[entity.offset:entity.offset + entity.length]
                 # Проверяем что это наш бот
                 # Примечание: сравниваем с username бота
                 return True  # Упрощённая проверка - любой @mention активирует
@@ -85,58 +234,133 @@ def is_bot_mentioned(message: Message) -> bool:
 async def handle_message(message: Message):
     """Обработчик всех входящих сообщений"""
     chat_id = message.chat.id
-    archiver = get_archiver(chat_id)
 
-    # Архивация системных событий
-    if message.new_chat_members:
-        archiver.handle_new_chat_members(message)
+    # Архиватор не вытесняется, пока сообщение обрабатывается (в том числе запрос агента)
+    with archivers.pinned(chat_id) as archiver:
+        # Повторно доставленный апдейт (после перезапуска) не пишется и не скачивается заново
+        if await archiver.is_duplicate(message):
+            return
+
+        # Архивация системных событий
+        if message.new_chat_members:
+            archiver.handle_new_chat_members(message)
+
+        if message.left_chat_member:
+            archiver.handle_left_chat_member(message)
+
+        if message.new_chat_title:
+            archiver.handle_new_chat_title(message)
+
+        if message.new_chat_photo:
+            archiver.handle_new_chat_photo(message)
+
+        # Часть альбома - обрабатывается вместе с остальными частями
+        if message.media_group_id:
+            media_groups.add(message)
+            return
+
+        # Архивация текстового сообщения
+        if message.text:
+            # Проверка активации агента (задача 3.2); вопрос боту не меняет версию архива
+            mentioned = is_bot_mentioned(message)
+            archiver.archive_text_message(message, is_query=mentioned)
+            text_preview = message.text[:50]
+            logger.info(f"[MESSAGE] chat_id={chat_id}: {text_preview}")
+
+            if mentioned:
+                await handle_agent_query(message, archiver)
+
+        # Архивация медиа (задачи 2.1-2.3) - в фоновой очереди скачивания,
+        # строка в history.txt пишется после завершения скачивания
+        if message.photo:
+            await submit_media(
+                chat_id, message.photo[-1].file_size,
+                lambda: archiver.archive_photo(message, bot), "photo",
+            )
+
+        if message.document:
+            await submit_media(
+                chat_id, message.document.file_size,
+                lambda: archiver.archive_document(message, bot), "document",
+            )
+
+        if message.voice:
+            await submit_media(
+                chat_id, message.voice.file_size,
+                lambda: archiver.archive_voice(message, bot), "voice",
+            )
+
+        if message.video_note:
+            await submit_media(
+                chat_id, message.video_note.file_size,
+                lambda: archiver.archive_video_note(message, bot), "video_note",
+            )
+
+
+async def submit_media(chat_id: int, size: Optional[int], factory, description: str):
+    """
+    Постановка скачивания в очередь
 
-    if message.left_chat_member:
-        archiver.handle_left_chat_member(message)
+    Архиватор чата закреплён до завершения задачи и проверки квоты после неё.
+    Квота проверяется отдельно от задачи очереди: её ошибка не повторяет скачивание.
+    """
+    archivers.pin(chat_id)
+    try:
+        future = await media_queue.submit(chat_id, size, factory, description)
+    except BaseException:
+        archivers.unpin(chat_id)
+        raise
 
-    if message.new_chat_title:
-        archiver.handle_new_chat_title(message)
+    def on_done(_):
+        task = asyncio.create_task(enforce_quota_after_media(chat_id))
+        quota_tasks.add(task)
+        task.add_done_callback(quota_tasks.discard)
 
-    if message.new_chat_photo:
-        archiver.handle_new_chat_photo(message)
+    future.add_done_callback(on_done)
 
-    # Архивация текстового сообщения
-    if message.text:
-        archiver.archive_text_message(message)
-        text_preview = message.text[:50]
-        logger.info(f"[MESSAGE] chat_id={chat_id}: {text_preview}")
 
-        # Проверка активации агента (задача 3.2)
-        if is_bot_mentioned(message):
-            await handle_agent_query(message, archiver)
+async def enforce_quota_after_media(chat_id: int):
+    """Проверка квоты хранилища после скачивания (ошибки только логируются)"""
+    try:
+        await archivers.enforce_quota(chat_id)
+    except Exception as e:
+        logger.error(f"[QUOTA] Error enforcing quota after media in chat_id={chat_id}: {e}", exc_info=True)
+    finally:
+        archivers.unpin(chat_id)
 
-    # Архивация медиа (задачи 2.1-2.3)
-    if message.photo:
-        await archiver.archive_photo(message, bot)
 
-    if message.document:
-        await archiver.archive_document(message, bot)
+async def handle_media_group(messages: List[Message]):
+    """Обработка собранного альбома: одна задача скачивания и не больше одного запроса к агенту"""
+    first = messages[0]
+    chat_id = first.chat.id
 
-    if message.voice:
-        await archiver.archive_voice(message, bot)
+    with archivers.pinned(chat_id) as archiver:
+        parts = archiver.prepare_album(messages)
+        if parts:
+            size = sum(getattr(part.file, 'file_size', None) or 0 for part in parts)
+            await submit_media(chat_id, size, lambda: archiver.archive_album(parts, bot), f"album of {len(parts)}")
+        logger.info(f"[MESSAGE] chat_id={chat_id}: album of {len(messages)} parts")
 
-    if message.video_note:
-        await archiver.archive_video_note(message, bot)
+        caption_message = next((message for message in messages if message.caption), None)
+        if caption_message is not None and is_bot_mentioned(caption_message):
+            await handle_agent_query(caption_message, archiver, query=caption_message.caption)
 
 
-async def handle_agent_query(message: Message, archiver: ChatArchiver):
+# Сборка частей альбомов (media group) перед обработкой
+media_groups = MediaGroupCollector(handle_media_group)
+
+
+async def handle_agent_query(message: Message, archiver: ChatArchiver, query: Optional[str] = None):
     """
     Обработка запроса к AI-агенту
 
     Args:
         message: Сообщение от пользователя
         archiver: Архиватор чата
+        query: Текст запроса (по умолчанию текст сообщения; для альбома - подпись)
     """
     chat_id = message.chat.id
 
-    # Получаем пути к архиву
-    archive_paths = archiver.get_archive_paths()
-
     # Создаём статусное сообщение
     status_msg = await message.answer("⏳ Секунду...")
 
@@ -154,15 +378,27 @@ async def handle_agent_query(message: Message, archiver: ChatArchiver):
         except Exception as e:
             logger.debug(f"[STATUS] Could not update status: {e}")
 
-    try:
-        # Отправка запроса агенту
-        response = await agent.query(
+    # Место в очереди запросов (0 - очередь дошла)
+    async def update_position(position: int):
+        await update_status(f"⏳ В очереди: {position}" if position else "⏳ Секунду...")
+
+    # Запуск агента, когда очередь дошла: буфер истории сбрасывается только теперь,
+    # чтобы агент видел и сообщения, пришедшие за время ожидания
+    async def run_query():
+        await archiver.flush()
+        return await agent.query(
             chat_id=chat_id,
-            message=message.text,
-            archive_paths=archive_paths,
-            on_status_update=update_status
+            message=query or message.text,
+            archive_paths=archiver.get_archive_paths(),
+            on_status_update=update_status,
+            archive_version=archiver.version,
+            follow_up=is_reply_to_bot(message),
         )
 
+    try:
+        # Отправка запроса агенту (в свою очередь: по одному на чат, общий лимит)
+        response = await scheduler.run(chat_id, run_query, on_position=update_position)
+
         # Парсим пути к файлам в ответе (задача 5.1)
         found_files = parse_file_paths(response, chat_id)
 
@@ -216,24 +452,71 @@ async def handle_agent_query(message: Message, archiver: ChatArchiver):
                 except Exception as e:
                     logger.error(f"[FILES] Error sending file {filepath}: {e}", exc_info=True)
 
+        # Учёт файлов, созданных агентом, и проверка квоты хранилища
+        await archiver.track_agent_files()
+        await archivers.enforce_quota(chat_id)
+
+    except AgentQueueFull as e:
+        logger.warning(f"[AGENT] Query rejected in chat_id={chat_id}: {e}")
+        await status_msg.edit_text(f"🚦 Слишком много запросов ({e}). Попробуй чуть позже.")
+
     except Exception as e:
         logger.error(f"[AGENT] Error processing query: {e}", exc_info=True)
         await status_msg.edit_text(f"❌ Ошибка при обработке запроса: {str(e)}")
 
 
 
+async def compaction_loop():
+    """Периодическое сжатие холодных сегментов истории и документов"""
+    while True:
+        await asyncio.sleep(COMPACTION_INTERVAL)
+        try:
+            result = await compact_all_chats(archivers)
+            logger.info(f"[COMPACT] Checked {result['chats']} chats, compressed {result['files']} files")
+        except Exception as e:
+            logger.error(f"[COMPACT] Compaction failed: {e}", exc_info=True)
+
+
 async def main():
     """Запуск бота"""
     logger.info("[STARTUP] Starting Telegram AI Bot...")
     logger.info(f"[CONFIG] BOT_TOKEN configured: {BOT_TOKEN[:10]}...")
     logger.info(f"[CONFIG] CLAUDE_CODE_OAUTH_TOKEN configured: {CLAUDE_CODE_OAUTH_TOKEN[:15]}...")
 
+    # Кэш уже созданных директорий чатов: одно чтение каталога вместо проверок на каждый чат
+    known_chats = await asyncio.to_thread(preload_known_chats)
+    logger.info(f"[STARTUP] Found {known_chats} archived chats")
+
+    media_queue.start()
+    agent.start()
+
+    compaction_task = None
+    if COMPACTION_INTERVAL > 0:
+        compaction_task = asyncio.create_task(compaction_loop())
+
     logger.info("[STARTUP] Bot started successfully!")
 
     # Запуск polling
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if compaction_task is not None:
+            compaction_task.cancel()
+
+        # Дожидаемся начатых скачиваний (и недособранных альбомов), чтобы их строки попали в историю
+        await media_groups.drain()
+        await media_queue.drain()
+        await asyncio.gather(*quota_tasks, return_exceptions=True)
+
+        # Закрываем сессии агента (подпроцессы CLI) параллельно
+        await agent.cleanup()
+
+        # Сбрасываем буферы истории всех чатов перед остановкой
+        count = len(archivers)
+        archivers.close_all()
+        logger.info(f"[SHUTDOWN] Flushed {count} chat archives")
+        shutdown_writer()
 
 
 if __name__ == '__main__':
-    import asyncio
     asyncio.run(main())
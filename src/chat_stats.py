@@ -0,0 +1,260 @@
+"""
+Модуль статистики активности чата
+Сводки обновляются на каждой записанной пачке истории: сообщения и файлы
+по участникам, гистограммы по дням, часам и дням недели. Ответ на вопрос
+"кто пишет больше всех?" - чтение stats.json, а не просмотр всей истории
+
+Формат stats.json:
+    {"offset": <прочитано байт events.jsonl>, "first": ts, "last": ts,
+     "kinds": {kind: n}, "users": {имя: {"messages": n, "media": n, <kind>: n,
+     "first": ts, "last": ts}}, "days": {"YYYY-MM-DD": n},
+     "hours": [24 числа], "weekdays": [7 чисел, с понедельника]}
+
+Пересчёт по существующему events.jsonl:
+    python src/chat_stats.py rebuild <chat_id> [<chat_id> ...]
+    python src/chat_stats.py rebuild --all
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+from cold_storage import archive_size, open_archive_file
+from event_log import iter_events
+
+logger = logging.getLogger(__name__)
+
+STATS_NAME = "stats.json"
+
+# Как часто сохранять stats.json (секунды); после сбоя недостающее
+# досчитывается по events.jsonl с сохранённого смещения
+STATS_SAVE_INTERVAL = float(os.getenv('STATS_SAVE_INTERVAL', 10))
+
+# Сообщения участников (учитываются в гистограммах и по участникам)
+MESSAGE_KINDS = ('text',)
+MEDIA_KINDS = ('photo', 'document', 'voice', 'video_note')
+
+
+def empty_stats() -> dict:
+    """Пустые сводки"""
+    return {
+        'offset': 0,
+        'first': None,
+        'last': None,
+        'kinds': {},
+        'users': {},
+        'days': {},
+        'hours': [0] * 24,
+        'weekdays': [0] * 7,
+    }
+
+
+def load_stats(path: Path) -> dict:
+    """
+    Чтение stats.json
+
+    Returns:
+        Сводки (пустые, если файла нет или он повреждён)
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return empty_stats()
+    except (OSError, ValueError) as e:
+        logger.warning(f"[STATS] Unreadable {path}, recounting: {e}")
+        return empty_stats()
+
+
+def apply_event(stats: dict, timestamp: datetime, kind: str, sender: Optional[str]):
+    """
+    Учёт одного события в сводках
+
+    Args:
+        stats: Сводки
+        timestamp: Время события
+        kind: Тип события (text, photo, system, bot_response, ...)
+        sender: Отправитель
+    """
+    ts = timestamp.isoformat(timespec='seconds')
+    if stats['first'] is None or ts < stats['first']:
+        stats['first'] = ts
+    if stats['last'] is None or ts > stats['last']:
+        stats['last'] = ts
+
+    kinds = stats['kinds']
+    kinds[kind] = kinds.get(kind, 0) + 1
+
+    if kind not in MESSAGE_KINDS and kind not in MEDIA_KINDS:
+        return
+
+    day = ts[:10]
+    stats['days'][day] = stats['days'].get(day, 0) + 1
+    stats['hours'][timestamp.hour] += 1
+    stats['weekdays'][timestamp.weekday()] += 1
+
+    if not sender:
+        return
+    user = stats['users'].get(sender)
+    if user is None:
+        user = stats['users'][sender] = {'messages': 0, 'media': 0, 'first': ts, 'last': ts}
+    user['messages' if kind in MESSAGE_KINDS else 'media'] += 1
+    if kind in MEDIA_KINDS:
+        user[kind] = user.get(kind, 0) + 1
+    if ts < user['first']:
+        user['first'] = ts
+    if ts > user['last']:
+        user['last'] = ts
+
+
+def save_stats(path: Path, stats: dict):
+    """Атомарное сохранение stats.json"""
+    tmp_file = Path(f"{path}.tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(stats, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_file, path)
+
+
+def count_events(stats: dict, events_file: Path) -> int:
+    """
+    Досчёт сводок по events.jsonl начиная с сохранённого смещения
+
+    Returns:
+        Количество учтённых событий
+    """
+    count = 0
+    end = stats['offset']
+    for event in iter_events(events_file, stats['offset']):
+        apply_event(stats, event.ts, event.kind, event.sender)
+        end = event.offset
+        count += 1
+
+    if count:
+        # Конец диапазона - начало следующей (ещё не записанной целиком) строки
+        with open_archive_file(events_file) as f:
+            f.seek(end)
+            stats['offset'] = end + len(f.readline())
+    return count
+
+
+class ChatStats:
+    """Сводки активности чата (получает пачки из HistoryJournal после EventLog)"""
+
+    def __init__(self, stats_file: Path, events_file: Path, save_interval: float = STATS_SAVE_INTERVAL):
+        """
+        Args:
+            stats_file: Путь к сводкам (chat_{id}/stats.json)
+            events_file: Путь к events.jsonl
+            save_interval: Как часто сохранять сводки в секундах
+        """
+        self.stats_file = Path(stats_file)
+        self.events_file = Path(events_file)
+        self.save_interval = save_interval
+
+        self._stats: Optional[dict] = None
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    def _load(self):
+        """
+        Чтение сводок и досчёт событий, записанных после последнего сохранения
+
+        Вызывается на первой пачке: она уже в events.jsonl, поэтому учитывается здесь же.
+        """
+        self._stats = load_stats(self.stats_file)
+        if self.events_file.exists() and self._stats['offset'] > archive_size(self.events_file):
+            # events.jsonl заменён - сводки считаются заново
+            self._stats = empty_stats()
+        started = time.monotonic()
+        count = count_events(self._stats, self.events_file)
+        if count > 1:
+            logger.info(
+                f"[STATS] Counted {count} events for {self.stats_file} "
+                f"in {(time.monotonic() - started) * 1000:.0f} ms"
+            )
+        self._dirty = True
+
+    def write_batch(self, records: List):
+        """
+        Учёт пачки событий
+
+        Args:
+            records: Записи журнала (HistoryRecord)
+        """
+        if self._stats is None:
+            self._load()
+        else:
+            for record in records:
+                event = record.event
+                if event:
+                    apply_event(self._stats, record.timestamp, event.get('kind', 'text'), event.get('sender'))
+            self._dirty = True
+
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self.flush()
+
+    def flush(self):
+        """Сохранение сводок (перед запросом агента)"""
+        if not self._dirty:
+            return
+        # EventLog уже дописал все учтённые пачки - конец файла и есть смещение сводок
+        self._stats['offset'] = archive_size(self.events_file)
+        save_stats(self.stats_file, self._stats)
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    def close(self):
+        """Сохранение сводок перед остановкой"""
+        self.flush()
+
+
+def rebuild_stats(events_file: Path, stats_file: Path) -> dict:
+    """
+    Пересчёт сводок по events.jsonl целиком
+
+    Returns:
+        Сводки
+    """
+    stats = empty_stats()
+    count_events(stats, Path(events_file))
+    save_stats(Path(stats_file), stats)
+    return stats
+
+
+def main(argv: List[str]) -> int:
+    """Точка входа командной строки: rebuild <chat_id>... | rebuild --all"""
+    import argparse
+    from archiver import ARCHIVE_BASE
+    from event_log import EVENT_LOG_NAME
+
+    parser = argparse.ArgumentParser(description="Сводки активности чатов (stats.json)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = subparsers.add_parser('rebuild', help="пересчитать сводки по events.jsonl")
+    rebuild_parser.add_argument('chat_ids', nargs='*', type=int)
+    rebuild_parser.add_argument('--all', action='store_true', help="все чаты архива")
+    args = parser.parse_args(argv)
+
+    base = Path(ARCHIVE_BASE)
+    if args.all:
+        chat_dirs = sorted(p for p in base.glob('chat_*') if p.is_dir())
+    else:
+        chat_dirs = [base / f"chat_{chat_id}" for chat_id in args.chat_ids]
+
+    for chat_dir in chat_dirs:
+        events_file = chat_dir / EVENT_LOG_NAME
+        if not events_file.exists():
+            print(f"{chat_dir.name}: {EVENT_LOG_NAME} не найден, пропускаю")
+            continue
+        stats = rebuild_stats(events_file, chat_dir / STATS_NAME)
+        print(f"{chat_dir.name}: {sum(stats['kinds'].values())} событий, {len(stats['users'])} участников")
+
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
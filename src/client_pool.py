@@ -0,0 +1,312 @@
+"""
+Модуль пула заранее запущенных клиентов агента
+Запуск ClaudeSDKClient (подпроцесс CLI и MCP-инициализация) занимает секунды;
+первый запрос чата (или первый после истечения сессии) берёт уже запущенный
+клиент из пула, а пул пополняется в фоне
+
+Размер пула подстраивается под частоту создания сессий за последние
+AGENT_POOL_RATE_WINDOW секунд: столько клиентов, сколько сессий успевает
+понадобиться за время запуска одного клиента (не меньше AGENT_POOL_MIN,
+не больше AGENT_POOL_MAX). Время получения клиента копится в гистограммах
+"из пула" и "холодный запуск", чтобы выигрыш было видно в /iostats
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+# Границы размера пула
+AGENT_POOL_MIN = int(os.getenv('AGENT_POOL_MIN', 1))
+AGENT_POOL_MAX = int(os.getenv('AGENT_POOL_MAX', 3))
+
+# Окно (секунды), по которому считается частота создания сессий
+AGENT_POOL_RATE_WINDOW = float(os.getenv('AGENT_POOL_RATE_WINDOW', 600))
+
+# Сколько клиент может ждать в пуле до перезапуска (секунды)
+AGENT_POOL_MAX_AGE = float(os.getenv('AGENT_POOL_MAX_AGE', 30 * 60))
+
+# Как часто пересматривать размер пула без новых запросов (секунды)
+AGENT_POOL_CHECK_INTERVAL = float(os.getenv('AGENT_POOL_CHECK_INTERVAL', 30))
+
+# Оценка времени запуска клиента, пока нет замеров (секунды)
+DEFAULT_START_TIME = 5.0
+
+# Верхние границы корзин гистограмм (миллисекунды)
+LATENCY_BUCKETS_MS = (10, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+T = TypeVar('T')
+
+
+class LatencyHistogram:
+    """Гистограмма времени с фиксированными корзинами"""
+
+    def __init__(self, buckets_ms: Tuple[int, ...] = LATENCY_BUCKETS_MS):
+        self.buckets_ms = buckets_ms
+        self.counts = [0] * (len(buckets_ms) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        """Учёт одного замера"""
+        ms = seconds * 1000
+        index = len(self.buckets_ms)
+        for i, bound in enumerate(self.buckets_ms):
+            if ms <= bound:
+                index = i
+                break
+        self.counts[index] += 1
+        self.count += 1
+        self.total += seconds
+
+    def percentile_ms(self, q: float) -> float:
+        """Оценка перцентиля сверху: граница корзины, в которую он попал"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets_ms, self.counts):
+            seen += n
+            if seen >= rank:
+                return float(bound)
+        return float('inf')
+
+    def get_stats(self) -> dict:
+        """
+        Сводка гистограммы
+
+        Returns:
+            Словарь: count, avg_ms, p50_ms, p95_ms, buckets ({"<=250ms": n, ...})
+        """
+        buckets = {f"<={bound}ms": n for bound, n in zip(self.buckets_ms, self.counts)}
+        buckets[f">{self.buckets_ms[-1]}ms"] = self.counts[-1]
+        return {
+            'count': self.count,
+            'avg_ms': round(self.total / self.count * 1000, 1) if self.count else 0.0,
+            'p50_ms': self.percentile_ms(0.5),
+            'p95_ms': self.percentile_ms(0.95),
+            'buckets': buckets,
+        }
+
+
+class ClientPool(Generic[T]):
+    """Пул заранее запущенных клиентов с адаптивным размером"""
+
+    def __init__(
+        self,
+        start: Callable[[], Awaitable[T]],
+        stop: Callable[[T], Awaitable],
+        min_size: int = AGENT_POOL_MIN,
+        max_size: int = AGENT_POOL_MAX,
+        rate_window: float = AGENT_POOL_RATE_WINDOW,
+        max_age: float = AGENT_POOL_MAX_AGE,
+        check_interval: float = AGENT_POOL_CHECK_INTERVAL,
+    ):
+        """
+        Args:
+            start: Запуск нового клиента
+            stop: Остановка клиента
+            min_size: Сколько клиентов держать всегда
+            max_size: Больше клиентов не держать (0 - пул выключен)
+            rate_window: Окно расчёта частоты создания сессий в секундах
+            max_age: Время жизни клиента в пуле в секундах
+            check_interval: Период пересмотра размера пула в секундах
+        """
+        self._start = start
+        self._stop = stop
+        self.max_size = max(max_size, 0)
+        self.min_size = min(max(min_size, 0), self.max_size)
+        self.rate_window = rate_window
+        self.max_age = max_age
+        self.check_interval = check_interval
+
+        self._ready: deque = deque()
+        self._starting = 0
+        self._demand: deque = deque()
+        self._start_time = DEFAULT_START_TIME
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = set()
+
+        # Метрики
+        self.hits = 0
+        self.misses = 0
+        self.started = 0
+        self.retired = 0
+        self.start_errors = 0
+        self.histograms: Dict[str, LatencyHistogram] = {
+            'warm': LatencyHistogram(),
+            'cold': LatencyHistogram(),
+            'background': LatencyHistogram(),
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def start(self):
+        """Запуск фонового пополнения пула (из работающего event loop)"""
+        if self._task is None and self.enabled:
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._refill_loop())
+
+    def take(self) -> Optional[T]:
+        """
+        Клиент из пула для новой сессии
+
+        Каждый вызов учитывается как создание сессии (для размера пула)
+        и будит пополнение.
+
+        Returns:
+            Запущенный клиент или None, если пул пуст
+        """
+        started_at = time.monotonic()
+        self._demand.append(started_at)
+
+        item = None
+        while self._ready and item is None:
+            ready_at, candidate = self._ready.popleft()
+            if started_at - ready_at <= self.max_age:
+                item = candidate
+            else:
+                self._retire(candidate)
+
+        if self._wake is not None:
+            self._wake.set()
+        if item is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.histograms['warm'].observe(time.monotonic() - started_at)
+        return item
+
+    def observe_cold_start(self, seconds: float):
+        """Учёт времени запуска клиента по запросу (пул был пуст)"""
+        self.histograms['cold'].observe(seconds)
+
+    def target_size(self) -> int:
+        """
+        Нужный размер пула по частоте создания сессий
+
+        Returns:
+            Сколько сессий создаётся за время запуска одного клиента (в границах min/max)
+        """
+        now = time.monotonic()
+        while self._demand and now - self._demand[0] > self.rate_window:
+            self._demand.popleft()
+
+        rate = len(self._demand) / self.rate_window if self.rate_window > 0 else 0.0
+        needed = math.ceil(rate * self._start_time)
+        return min(max(needed, self.min_size), self.max_size)
+
+    def _retire(self, item: T):
+        """Остановка клиента, который больше не нужен пулу"""
+        self.retired += 1
+        task = asyncio.create_task(self._stop_quietly(item))
+        self._stopping.add(task)
+        task.add_done_callback(self._stopping.discard)
+
+    async def _stop_quietly(self, item: T):
+        try:
+            await self._stop(item)
+        except Exception as e:
+            logger.error(f"[POOL] Error stopping pooled client: {e}")
+
+    async def _start_one(self) -> bool:
+        """Запуск одного клиента в пул"""
+        self._starting += 1
+        started_at = time.monotonic()
+        try:
+            item = await self._start()
+        except Exception as e:
+            self.start_errors += 1
+            logger.error(f"[POOL] Failed to start pooled client: {e}")
+            return False
+        finally:
+            self._starting -= 1
+
+        elapsed = time.monotonic() - started_at
+        self.started += 1
+        self.histograms['background'].observe(elapsed)
+        # Сглаженное время запуска - для расчёта размера пула
+        self._start_time = 0.8 * self._start_time + 0.2 * elapsed
+        self._ready.append((time.monotonic(), item))
+        logger.info(f"[POOL] Client ready in {elapsed * 1000:.0f} ms, pool {len(self._ready)}/{self.target_size()}")
+        return True
+
+    async def _refill_loop(self):
+        while True:
+            try:
+                now = time.monotonic()
+                while self._ready and now - self._ready[0][0] > self.max_age:
+                    self._retire(self._ready.popleft()[1])
+
+                target = self.target_size()
+                while len(self._ready) > target:
+                    self._retire(self._ready.pop()[1])
+
+                if len(self._ready) + self._starting < target:
+                    if await self._start_one():
+                        continue
+            except Exception as e:
+                logger.error(f"[POOL] Refill failed: {e}", exc_info=True)
+
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.check_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def get_stats(self) -> dict:
+        """
+        Метрики пула
+
+        Returns:
+            Словарь: ready, starting, target, hits, misses, started, retired,
+            start_errors, start_time_s и гистограммы warm/cold/background
+        """
+        stats = {
+            'ready': len(self._ready),
+            'starting': self._starting,
+            'target': self.target_size(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'started': self.started,
+            'retired': self.retired,
+            'start_errors': self.start_errors,
+            'start_time_s': round(self._start_time, 2),
+        }
+        for name, histogram in self.histograms.items():
+            stats[name] = histogram.get_stats()
+        return stats
+
+    async def close(self, deadline: float = 30.0):
+        """
+        Остановка пополнения и всех клиентов пула (при остановке бота)
+
+        Args:
+            deadline: Общее время на остановку в секундах
+        """
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        items: List[T] = [item for _, item in self._ready]
+        self._ready.clear()
+        if not items:
+            return
+
+        logger.info(f"[POOL] Stopping {len(items)} pooled clients")
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(self._stop_quietly(item) for item in items)),
+                deadline,
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"[POOL] Shutdown deadline {deadline}s exceeded, some clients not stopped")
@@ -0,0 +1,869 @@
+"""
+Модуль сжатия холодных данных архива
+Текстовые файлы сжимаются в gzip из независимых кадров с индексом кадров,
+поэтому любой байт читается без распаковки файла с начала; крупные текстовые
+документы в media/ можно сжимать целиком. open_archive_file() читает файл
+одинаково, сжат он или нет.
+
+Формат: <имя>.gz - последовательность gzip-членов (кадров) по
+COMPRESSION_FRAME_SIZE байт исходного текста, разрезанных по границам строк
+(файл читается и обычным zcat); <имя>.gz.idx - JSON с началом каждого
+кадра в исходном и в сжатом файле.
+
+history.txt и events.jsonl дописываются, поэтому сжимается только их холодное
+начало: <имя>.cold.gz в том же формате хранит байты [0, base), а сам файл -
+всё, что после. В индексе кадров ("tails") записано, с какого base начинается
+файл с данным inode, поэтому читатель, открывший файл до переноса, продолжает
+видеть согласованные данные. Смещения (индексы строк и времени, оглавление,
+сводки) считаются в полном содержимом: zcat history.txt.cold.gz; cat history.txt.
+
+Сжатие (при остановленном боте; работающий бот сжимает сам раз в COMPACTION_INTERVAL):
+    python src/cold_storage.py compact <chat_id> [<chat_id> ...] [--media-days N]
+    python src/cold_storage.py compact --all [--media-days N]
+
+Подбор уровня сжатия по степени сжатия и скорости распаковки:
+    python src/cold_storage.py bench <файл> [--levels 1,6,9]
+"""
+
+import io
+import os
+import sys
+import gzip
+import json
+import time
+import shutil
+import bisect
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+GZ_SUFFIX = ".gz"
+FRAME_INDEX_SUFFIX = ".idx"
+COLD_PREFIX_SUFFIX = ".cold.gz"
+
+# Сколько последних пар (inode, base) хранить в индексе сжатого начала
+PREFIX_TAILS = 2
+
+# Уровень gzip (1 - быстро, 9 - компактно) и размер кадра исходного текста
+COMPRESSION_LEVEL = int(os.getenv('COMPRESSION_LEVEL', 6))
+COMPRESSION_FRAME_SIZE = int(os.getenv('COMPRESSION_FRAME_SIZE', 1024 * 1024))
+
+# Сегменты старше N полных месяцев считаются холодными
+COLD_SEGMENT_MONTHS = int(os.getenv('COLD_SEGMENT_MONTHS', 2))
+
+# Сжатие документов в media/: возраст в днях (0 - не сжимать) и минимальный размер
+COLD_MEDIA_DAYS = int(os.getenv('COLD_MEDIA_DAYS', 0))
+COLD_MEDIA_MIN_SIZE = int(os.getenv('COLD_MEDIA_MIN_SIZE', 1024 * 1024))
+
+# Период фонового сжатия в работающем боте (секунды, 0 - выключено)
+COMPACTION_INTERVAL = float(os.getenv('COMPACTION_INTERVAL', 24 * 3600))
+
+# Документы, которые имеет смысл сжимать (фото, видео, голосовые и офисные
+# форматы уже сжаты)
+COMPRESSIBLE_EXTENSIONS = {
+    '.txt', '.csv', '.tsv', '.json', '.jsonl', '.xml', '.html', '.htm',
+    '.log', '.md', '.sql', '.yaml', '.yml',
+}
+
+# Сжатый файл сохраняется, только если он меньше исходного хотя бы на 10%
+MIN_SAVING_RATIO = 0.9
+
+# Итоги всех сжатий процесса (для /iostats)
+_totals = {'files': 0, 'raw_bytes': 0, 'stored_bytes': 0, 'compress_s': 0.0, 'decode_s': 0.0}
+
+
+def compressed_path(path: Path) -> Path:
+    """Путь сжатой копии файла: <имя>.gz"""
+    return Path(f"{path}{GZ_SUFFIX}")
+
+
+def frame_index_path(gz_path: Path) -> Path:
+    """Путь индекса кадров сжатого файла: <имя>.gz.idx"""
+    return Path(f"{gz_path}{FRAME_INDEX_SUFFIX}")
+
+
+def cold_prefix_path(path: Path) -> Path:
+    """Путь сжатого начала дописываемого файла: <имя>.cold.gz"""
+    return Path(f"{path}{COLD_PREFIX_SUFFIX}")
+
+
+def resolve_archive_file(path: Path) -> Path:
+    """
+    Фактический путь файла архива: исходный или его сжатая копия
+
+    Raises:
+        FileNotFoundError: Нет ни исходного, ни сжатого файла
+    """
+    path = Path(path)
+    if path.exists():
+        return path
+    gz_path = compressed_path(path)
+    if gz_path.exists():
+        return gz_path
+    raise FileNotFoundError(f"No such archive file: {path}")
+
+
+def _iter_frames(f: BinaryIO, frame_size: int) -> Iterator[bytes]:
+    """Нарезка потока на кадры не меньше frame_size по границам строк"""
+    buffer = []
+    size = 0
+    for line in f:
+        buffer.append(line)
+        size += len(line)
+        if size >= frame_size:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _read_frame_index(gz_path: Path) -> Optional[dict]:
+    """Индекс кадров или None, если файл сжат целиком (без кадров)"""
+    try:
+        with open(frame_index_path(gz_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_frame_index(gz_path: Path, index: dict):
+    """Атомарная запись индекса кадров"""
+    index_file = frame_index_path(gz_path)
+    tmp_file = Path(f"{index_file}.tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f, separators=(',', ':'))
+    os.replace(tmp_file, index_file)
+
+
+def _write_frames(out: BinaryIO, frames: Iterator[bytes], index: dict, level: int):
+    """Дозапись кадров в открытый файл с обновлением индекса в памяти"""
+    for frame in frames:
+        index['frames'].append([index['raw_size'], index['size']])
+        data = gzip.compress(frame, compresslevel=level, mtime=0)
+        out.write(data)
+        index['raw_size'] += len(frame)
+        index['size'] += len(data)
+
+
+def compress_file(
+    source: Path,
+    level: int = COMPRESSION_LEVEL,
+    frame_size: int = COMPRESSION_FRAME_SIZE,
+) -> dict:
+    """
+    Сжатие файла в gzip из кадров с индексом (исходный файл не удаляется)
+
+    Сжатый файл и индекс записываются через временные файлы, затем
+    распаковываются целиком для проверки.
+
+    Args:
+        source: Исходный файл
+        level: Уровень gzip
+        frame_size: Размер кадра исходного текста в байтах
+
+    Returns:
+        Словарь: raw_bytes, stored_bytes, frames, compress_s, decode_s
+
+    Raises:
+        IOError: Распакованные данные не совпали по размеру с исходными
+    """
+    source = Path(source)
+    gz_path = compressed_path(source)
+    tmp_file = Path(f"{gz_path}.tmp")
+    index = {'frame_size': frame_size, 'frames': [], 'raw_size': 0, 'size': 0}
+
+    started = time.monotonic()
+    with open(source, 'rb') as src, open(tmp_file, 'wb') as out:
+        _write_frames(out, _iter_frames(src, frame_size), index, level)
+        out.flush()
+        os.fsync(out.fileno())
+    compress_s = time.monotonic() - started
+
+    decode_s, decoded = measure_decode(tmp_file, index)
+    if decoded != index['raw_size'] or decoded != source.stat().st_size:
+        tmp_file.unlink(missing_ok=True)
+        raise IOError(f"Compressed copy of {source} is inconsistent: {decoded} != {index['raw_size']}")
+
+    os.replace(tmp_file, gz_path)
+    _write_frame_index(gz_path, index)
+    return {
+        'raw_bytes': index['raw_size'],
+        'stored_bytes': index['size'],
+        'frames': len(index['frames']),
+        'compress_s': compress_s,
+        'decode_s': decode_s,
+    }
+
+
+def append_frames(
+    gz_path: Path,
+    data: bytes,
+    level: int = COMPRESSION_LEVEL,
+    frame_size: Optional[int] = None,
+) -> int:
+    """
+    Дозапись данных в сжатый файл новыми кадрами (поздние строки старого месяца)
+
+    Хвост файла, не попавший в индекс (запись прервалась), отрезается.
+
+    Returns:
+        Размер сжатого файла после дозаписи
+    """
+    gz_path = Path(gz_path)
+    index = _read_frame_index(gz_path)
+    if index is None:
+        raise IOError(f"{gz_path} has no frame index, cannot append")
+
+    with open(gz_path, 'r+b') as out:
+        out.truncate(index['size'])
+        out.seek(index['size'])
+        frames = _iter_frames(io.BytesIO(data), frame_size or index['frame_size'])
+        _write_frames(out, frames, index, level)
+
+    _write_frame_index(gz_path, index)
+    return index['size']
+
+
+def _read_lines(f: BinaryIO, limit: int) -> Iterator[bytes]:
+    """Строки потока до limit байт (limit приходится на границу строки)"""
+    while limit > 0:
+        line = f.readline(limit)
+        if not line:
+            break
+        limit -= len(line)
+        yield line
+
+
+def compress_prefix(
+    path: Path,
+    cut: int,
+    level: int = COMPRESSION_LEVEL,
+    frame_size: int = COMPRESSION_FRAME_SIZE,
+) -> Optional[dict]:
+    """
+    Перенос начала дописываемого файла до смещения cut в сжатое <имя>.cold.gz
+
+    Выполняется в потоке записи чата (файл в это время не дописывается).
+    Порядок: остаток файла копируется во временный файл, начало дописывается
+    кадрами в <имя>.cold.gz и проверяется распаковкой, в индекс кадров
+    записывается base нового файла, и только затем файл заменяется остатком.
+    Перенос, прерванный до замены, откатывается при следующем вызове.
+
+    Args:
+        path: Путь к файлу (history.txt, events.jsonl)
+        cut: Смещение в полном содержимом, до которого данные холодные
+            (начало строки)
+        level: Уровень gzip
+        frame_size: Размер кадра исходного текста в байтах
+
+    Returns:
+        Словарь: raw_bytes, stored_bytes, frames, compress_s, decode_s
+        или None, если переносить нечего
+
+    Raises:
+        IOError: Распакованные данные не совпали по размеру с перенесёнными
+    """
+    path = Path(path)
+    gz_path = cold_prefix_path(path)
+    index = _read_prefix_index(path)
+    if index is None:
+        index = {'frame_size': frame_size, 'frames': [], 'raw_size': 0, 'size': 0, 'tails': []}
+
+    stat = path.stat()
+    base = _tail_base(index, stat.st_ino) if index['frames'] else 0
+    cut = min(cut, base + stat.st_size)
+    if cut <= base:
+        return None
+
+    if index['raw_size'] > base:
+        # Прерванный перенос: кадры после base из файла ещё не убраны
+        first = next(i for i, frame in enumerate(index['frames']) if frame[0] >= base)
+        index['size'] = index['frames'][first][1]
+        index['raw_size'] = base
+        del index['frames'][first:]
+        index['tails'] = [tail for tail in index['tails'] if tail[1] <= base]
+        logger.warning(f"[COMPACT] Rolled back interrupted compaction of {path}")
+
+    tmp_file = Path(f"{path}.compact.tmp")
+    frames_before, size_before = len(index['frames']), index['size']
+    started = time.monotonic()
+    with open(path, 'rb') as src:
+        src.seek(cut - base)
+        with open(tmp_file, 'wb') as out:
+            shutil.copyfileobj(src, out, COMPRESSION_FRAME_SIZE)
+            out.flush()
+            os.fsync(out.fileno())
+
+        src.seek(0)
+        with open(gz_path, 'r+b' if gz_path.exists() else 'wb') as out:
+            out.truncate(index['size'])
+            out.seek(index['size'])
+            _write_frames(out, _iter_frames(_read_lines(src, cut - base), frame_size), index, level)
+            out.flush()
+            os.fsync(out.fileno())
+    compress_s = time.monotonic() - started
+
+    started = time.monotonic()
+    with FramedGzipReader(gz_path, index) as reader:
+        reader.seek(base)
+        decoded = 0
+        while True:
+            chunk = reader.read(COMPRESSION_FRAME_SIZE)
+            if not chunk:
+                break
+            decoded += len(chunk)
+    decode_s = time.monotonic() - started
+    if decoded != cut - base or index['raw_size'] != cut:
+        tmp_file.unlink(missing_ok=True)
+        raise IOError(f"Compressed prefix of {path} is inconsistent: {decoded} != {cut - base}")
+
+    tails = [tail for tail in index['tails'] if tail[0] != stat.st_ino]
+    tails.append([stat.st_ino, base])
+    tails.append([os.stat(tmp_file).st_ino, cut])
+    index['tails'] = tails[-PREFIX_TAILS:]
+    _write_frame_index(gz_path, index)
+    os.replace(tmp_file, path)
+
+    return {
+        'path': path,
+        'raw_bytes': cut - base,
+        'stored_bytes': index['size'] - size_before,
+        'frames': len(index['frames']) - frames_before,
+        'compress_s': compress_s,
+        'decode_s': decode_s,
+    }
+
+
+def measure_decode(gz_path: Path, index: Optional[dict] = None):
+    """
+    Полная распаковка сжатого файла для проверки и замера скорости
+
+    Returns:
+        (время распаковки в секундах, размер распакованных данных)
+    """
+    started = time.monotonic()
+    decoded = 0
+    with open_compressed(gz_path, index) as f:
+        while True:
+            chunk = f.read(COMPRESSION_FRAME_SIZE)
+            if not chunk:
+                break
+            decoded += len(chunk)
+    return time.monotonic() - started, decoded
+
+
+class FramedGzipReader(io.RawIOBase):
+    """Чтение gzip из кадров с произвольным доступом по индексу кадров"""
+
+    def __init__(self, gz_path: Path, index: dict):
+        """
+        Args:
+            gz_path: Сжатый файл
+            index: Индекс кадров
+        """
+        super().__init__()
+        self._file = open(gz_path, 'rb')
+        self._raw_offsets = [frame[0] for frame in index['frames']]
+        self._offsets = [frame[1] for frame in index['frames']]
+        self.raw_size = index['raw_size']
+        self._size = index['size']
+
+        self._pos = 0
+        self._frame = -1
+        self._data = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.raw_size
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def _load(self, frame: int):
+        """Распаковка кадра (последний распакованный кадр кэшируется)"""
+        if frame == self._frame:
+            return
+        start = self._offsets[frame]
+        end = self._offsets[frame + 1] if frame + 1 < len(self._offsets) else self._size
+        self._file.seek(start)
+        self._data = gzip.decompress(self._file.read(end - start))
+        self._frame = frame
+
+    def readinto(self, buffer) -> int:
+        if self._pos >= self.raw_size:
+            return 0
+
+        frame = bisect.bisect_right(self._raw_offsets, self._pos) - 1
+        self._load(frame)
+        start = self._pos - self._raw_offsets[frame]
+        chunk = self._data[start:start + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def open_compressed(gz_path: Path, index: Optional[dict] = None) -> BinaryIO:
+    """Открытие сжатого файла на чтение (по индексу кадров, если он есть)"""
+    if index is None:
+        index = _read_frame_index(gz_path)
+    if index is None:
+        return gzip.open(gz_path, 'rb')
+    return io.BufferedReader(FramedGzipReader(gz_path, index), buffer_size=64 * 1024)
+
+
+def _tail_base(index: dict, inode: int) -> int:
+    """Начало файла с данным inode в полном содержимом (неизвестный inode - файл скопирован)"""
+    for tail_inode, base in index.get('tails', []):
+        if tail_inode == inode:
+            return base
+    return index['raw_size']
+
+
+def _read_prefix_index(path: Path) -> Optional[dict]:
+    """
+    Индекс кадров сжатого начала файла или None, если начало не сжималось
+
+    Raises:
+        IOError: Сжатое начало есть, а индекса у него нет
+    """
+    gz_path = cold_prefix_path(path)
+    if not gz_path.exists():
+        return None
+    index = _read_frame_index(gz_path)
+    if index is None:
+        raise IOError(f"{gz_path} has no frame index")
+    return index
+
+
+def prefix_base(path: Path, inode: Optional[int] = None) -> int:
+    """
+    Смещение первого байта файла в полном содержимом (размер сжатого начала)
+
+    Args:
+        path: Путь к дописываемому файлу (history.txt, events.jsonl)
+        inode: inode открытого файла (по умолчанию - текущего файла по пути)
+
+    Returns:
+        0, если начало файла не сжималось
+    """
+    index = _read_prefix_index(Path(path))
+    if index is None:
+        return 0
+    if inode is None:
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            return index['raw_size']
+    return _tail_base(index, inode)
+
+
+def archive_size(path: Path) -> int:
+    """Размер полного содержимого дописываемого файла (сжатое начало + сам файл)"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return prefix_base(path)
+    return prefix_base(path, stat.st_ino) + stat.st_size
+
+
+class PrefixedReader(io.RawIOBase):
+    """Чтение файла со сжатым началом как одного файла (смещения - в полном содержимом)"""
+
+    def __init__(self, path: Path, index: dict):
+        """
+        Args:
+            path: Путь к дописываемому файлу
+            index: Индекс кадров сжатого начала
+        """
+        super().__init__()
+        self._hot = open(path, 'rb')
+        self.base = _tail_base(index, os.fstat(self._hot.fileno()).st_ino)
+        self._cold = FramedGzipReader(cold_prefix_path(path), index)
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.base + os.fstat(self._hot.fileno()).st_size
+        self._pos = max(offset, 0)
+        return self._pos
+
+    def readinto(self, buffer) -> int:
+        if self._pos < self.base:
+            # Сжатое начало (кадры дальше base относятся к более позднему переносу)
+            self._cold.seek(self._pos)
+            count = self._cold.readinto(memoryview(buffer)[:self.base - self._pos])
+        else:
+            self._hot.seek(self._pos - self.base)
+            count = self._hot.readinto(buffer)
+        self._pos += count
+        return count
+
+    def close(self):
+        self._hot.close()
+        self._cold.close()
+        super().close()
+
+
+def open_archive_file(path: Path, mode: str = 'rb'):
+    """
+    Открытие файла архива на чтение независимо от того, сжат ли он
+
+    Если исходного файла нет, читается <имя>.gz; если сжато начало файла
+    (<имя>.cold.gz), оно читается перед самим файлом. Смещения и seek()
+    считаются в байтах полного исходного файла.
+
+    Args:
+        path: Путь к исходному файлу (например, history.txt)
+        mode: 'rb' или 'r' (текст в UTF-8)
+
+    Returns:
+        Файловый объект
+    """
+    index = _read_prefix_index(Path(path)) if Path(path).suffix != GZ_SUFFIX else None
+    if index is not None:
+        f = io.BufferedReader(PrefixedReader(path, index), buffer_size=64 * 1024)
+        return f if 'b' in mode else io.TextIOWrapper(f, encoding='utf-8')
+
+    resolved = resolve_archive_file(path)
+    if resolved.suffix != GZ_SUFFIX or Path(path).suffix == GZ_SUFFIX:
+        return open(resolved, mode, encoding=None if 'b' in mode else 'utf-8')
+
+    f = open_compressed(resolved)
+    if 'b' in mode:
+        return f
+    return io.TextIOWrapper(f, encoding='utf-8')
+
+
+def remove_cold_prefix(path: Path):
+    """Удаление сжатого начала файла (файл переписан целиком, например импортом)"""
+    gz_path = cold_prefix_path(path)
+    frame_index_path(gz_path).unlink(missing_ok=True)
+    gz_path.unlink(missing_ok=True)
+
+
+def _record(stats: dict):
+    """Учёт сжатия в итогах процесса"""
+    _totals['files'] += 1
+    _totals['raw_bytes'] += stats['raw_bytes']
+    _totals['stored_bytes'] += stats['stored_bytes']
+    _totals['compress_s'] += stats['compress_s']
+    _totals['decode_s'] += stats['decode_s']
+
+
+def summarize(stats_list: List[dict]) -> dict:
+    """
+    Сводка по сжатым файлам
+
+    Returns:
+        Словарь: files, raw_bytes, stored_bytes, ratio, compress_mb_s, decode_mb_s
+    """
+    raw = sum(stats['raw_bytes'] for stats in stats_list)
+    stored = sum(stats['stored_bytes'] for stats in stats_list)
+    compress_s = sum(stats['compress_s'] for stats in stats_list)
+    decode_s = sum(stats['decode_s'] for stats in stats_list)
+    mb = raw / (1024 * 1024)
+    return {
+        'files': len(stats_list),
+        'raw_bytes': raw,
+        'stored_bytes': stored,
+        'ratio': round(raw / stored, 2) if stored else 1.0,
+        'compress_mb_s': round(mb / compress_s, 1) if compress_s else 0.0,
+        'decode_mb_s': round(mb / decode_s, 1) if decode_s else 0.0,
+    }
+
+
+def get_compaction_stats() -> dict:
+    """Итоги всех сжатий процесса (формат summarize)"""
+    stats = summarize([_totals])
+    stats['files'] = _totals['files']
+    return stats
+
+
+def cold_cutoff(now: Optional[datetime] = None, months: int = COLD_SEGMENT_MONTHS) -> str:
+    """Ключ первого тёплого месяца: сегменты с меньшим ключом холодные"""
+    now = now or datetime.now()
+    index = now.year * 12 + now.month - 1 - months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def compress_cold_media(
+    media_dir: Path,
+    media_store=None,
+    min_age_days: int = COLD_MEDIA_DAYS,
+    min_size: int = COLD_MEDIA_MIN_SIZE,
+    level: int = COMPRESSION_LEVEL,
+) -> List[dict]:
+    """
+    Сжатие старых крупных текстовых документов чата целиком в <имя>.gz
+
+    Документ в media/ - ссылка на общее хранилище, поэтому исходник удаляется
+    через хранилище (место освобождается, когда ссылок на файл не остаётся).
+
+    Args:
+        media_dir: Директория media/ чата
+        media_store: Общее хранилище медиа (MediaStore)
+        min_age_days: Минимальный возраст файла в днях (0 - не сжимать)
+        min_size: Минимальный размер файла в байтах
+
+    Returns:
+        Статистика по каждому сжатому файлу
+    """
+    if min_age_days <= 0 or not Path(media_dir).exists():
+        return []
+
+    cutoff = time.time() - min_age_days * 86400
+    results = []
+    for path in sorted(Path(media_dir).rglob('*')):
+        if path.suffix.lower() not in COMPRESSIBLE_EXTENSIONS or not path.is_file():
+            continue
+        stat = path.stat()
+        if stat.st_size < min_size or stat.st_mtime > cutoff:
+            continue
+
+        gz_path = compressed_path(path)
+        tmp_file = Path(f"{gz_path}.tmp")
+        started = time.monotonic()
+        with open(path, 'rb') as src, gzip.open(tmp_file, 'wb', compresslevel=level) as out:
+            shutil.copyfileobj(src, out, COMPRESSION_FRAME_SIZE)
+        compress_s = time.monotonic() - started
+
+        stored = tmp_file.stat().st_size
+        if stored > stat.st_size * MIN_SAVING_RATIO:
+            tmp_file.unlink()
+            continue
+
+        decode_s, decoded = measure_decode(tmp_file, None)
+        if decoded != stat.st_size:
+            tmp_file.unlink()
+            logger.error(f"[COMPACT] Compressed copy of {path} is inconsistent, skipping")
+            continue
+
+        os.replace(tmp_file, gz_path)
+        os.utime(gz_path, (stat.st_atime, stat.st_mtime))
+        if media_store is not None:
+            media_store.unlink(path)
+        else:
+            path.unlink()
+
+        results.append({
+            'path': path,
+            'compressed_path': gz_path,
+            'raw_bytes': stat.st_size,
+            'stored_bytes': stored,
+            'frames': 1,
+            'compress_s': compress_s,
+            'decode_s': decode_s,
+        })
+    return results
+
+
+def _history_cut(segment_store, cutoff: str) -> int:
+    """Начало первого тёплого месяца в history.txt (всё до него - холодное)"""
+    if not segment_store.loaded:
+        segment_store.load()
+    warm = [segment['ranges'][0][0] for segment in segment_store.segments if segment['month'] >= cutoff]
+    return min(warm) if warm else segment_store.covered
+
+
+def _events_cut(events_file: Path, cutoff: str) -> int:
+    """Начало первого события тёплого месяца в events.jsonl (или конец последнего целого события)"""
+    from event_log import iter_events
+
+    end = prefix_base(events_file)
+    for event in iter_events(events_file, end):
+        if event.ts.strftime("%Y-%m") >= cutoff:
+            return event.offset
+        end = event.offset
+    with open_archive_file(events_file) as f:
+        f.seek(end)
+        return end + len(f.readline())
+
+
+def _dir_size(path: Path) -> int:
+    """Занятое место в директории чата без media/ (документы учитываются отдельно)"""
+    total = 0
+    for root, dirs, files in os.walk(path):
+        if root == str(path):
+            dirs[:] = [name for name in dirs if name != "media"]
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def compact_chat(
+    chat_dir: Path,
+    segment_store=None,
+    media_store=None,
+    now: Optional[datetime] = None,
+    media_days: int = COLD_MEDIA_DAYS,
+    level: int = COMPRESSION_LEVEL,
+    quota=None,
+) -> dict:
+    """
+    Сжатие холодных данных чата (выполняется в потоке записи чата)
+
+    Начало history.txt и events.jsonl до первого тёплого месяца переносится
+    в <имя>.cold.gz; старые документы media/ сжимаются целиком.
+
+    Args:
+        chat_dir: Директория чата
+        segment_store: Оглавление истории чата (по умолчанию читается с диска)
+        media_store: Общее хранилище медиа
+        now: Текущее время (для определения холодных месяцев)
+        media_days: Возраст документов media/ для сжатия в днях (0 - не сжимать)
+        level: Уровень gzip
+        quota: Учёт занятого места (StorageQuota), размеры сжатых документов обновляются
+
+    Returns:
+        Сводка summarize() по перенесённым данным и сжатым файлам, а также
+        bytes_before и bytes_after - место, занятое файлами чата (без media/)
+    """
+    from segments import SegmentStore
+
+    chat_dir = Path(chat_dir)
+    history_file = chat_dir / "history.txt"
+    events_file = chat_dir / "events.jsonl"
+    cutoff = cold_cutoff(now)
+    bytes_before = _dir_size(chat_dir)
+
+    results = []
+    if history_file.exists():
+        if segment_store is None:
+            segment_store = SegmentStore(chat_dir / "history", history_file)
+        stats = compress_prefix(history_file, _history_cut(segment_store, cutoff), level=level)
+        if stats:
+            results.append(stats)
+    if events_file.exists():
+        stats = compress_prefix(events_file, _events_cut(events_file, cutoff), level=level)
+        if stats:
+            results.append(stats)
+    bytes_after = _dir_size(chat_dir)
+
+    media = compress_cold_media(chat_dir / "media", media_store, min_age_days=media_days, level=level)
+    if quota is not None:
+        for stats in media:
+            quota.rename(stats['path'], stats['compressed_path'])
+    results.extend(media)
+
+    for stats in results:
+        _record(stats)
+
+    summary = summarize(results)
+    summary['bytes_before'] = bytes_before
+    summary['bytes_after'] = bytes_after
+    if results:
+        logger.info(
+            f"[COMPACT] {chat_dir.name}: chat files {bytes_before} -> {bytes_after} bytes, "
+            f"{summary['files']} compressed ({summary['raw_bytes']} -> {summary['stored_bytes']} bytes, "
+            f"x{summary['ratio']}), compress {summary['compress_mb_s']} MB/s, "
+            f"decode {summary['decode_mb_s']} MB/s"
+        )
+    return summary
+
+
+def benchmark(path: Path, levels: List[int], frame_size: int = COMPRESSION_FRAME_SIZE) -> List[dict]:
+    """
+    Замер степени сжатия и скорости для разных уровней gzip на копии файла
+
+    Returns:
+        Сводка summarize() с полем level для каждого уровня
+    """
+    import tempfile
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sample = Path(tmp_dir) / Path(path).name
+        shutil.copyfile(path, sample)
+        for level in levels:
+            summary = summarize([compress_file(sample, level=level, frame_size=frame_size)])
+            summary['level'] = level
+            results.append(summary)
+    return results
+
+
+def main(argv: List[str]) -> int:
+    """Точка входа командной строки: compact <chat_id>... | compact --all | bench <файл>"""
+    import argparse
+    from archiver import ARCHIVE_BASE
+    from media_store import get_media_store
+
+    parser = argparse.ArgumentParser(description="Сжатие холодных данных архива")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    compact_parser = subparsers.add_parser('compact', help="сжать холодные данные чатов")
+    compact_parser.add_argument('chat_ids', nargs='*', type=int)
+    compact_parser.add_argument('--all', action='store_true', help="все чаты архива")
+    compact_parser.add_argument(
+        '--media-days', type=int, default=COLD_MEDIA_DAYS,
+        help="сжимать документы в media/ старше N дней (0 - не сжимать)",
+    )
+    compact_parser.add_argument('--level', type=int, default=COMPRESSION_LEVEL)
+
+    bench_parser = subparsers.add_parser('bench', help="сравнить уровни сжатия на файле")
+    bench_parser.add_argument('path', type=Path)
+    bench_parser.add_argument('--levels', default='1,3,6,9')
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        for result in benchmark(args.path, [int(level) for level in args.levels.split(',')]):
+            print(
+                f"level {result['level']}: x{result['ratio']}, "
+                f"compress {result['compress_mb_s']} MB/s, decode {result['decode_mb_s']} MB/s"
+            )
+        return 0
+
+    base = Path(ARCHIVE_BASE)
+    if args.all:
+        chat_dirs = sorted(p for p in base.glob('chat_*') if p.is_dir())
+    else:
+        chat_dirs = [base / f"chat_{chat_id}" for chat_id in args.chat_ids]
+
+    media_store = get_media_store(ARCHIVE_BASE)
+    for chat_dir in chat_dirs:
+        summary = compact_chat(
+            chat_dir, media_store=media_store, media_days=args.media_days, level=args.level,
+        )
+        print(
+            f"{chat_dir.name}: файлы чата {summary['bytes_before']} -> {summary['bytes_after']} байт; "
+            f"сжато {summary['files']}, {summary['raw_bytes']} -> {summary['stored_bytes']} байт "
+            f"(x{summary['ratio']}), распаковка {summary['decode_mb_s']} MB/s"
+        )
+    media_store.close()
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
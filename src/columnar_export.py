@@ -0,0 +1,239 @@
+"""
+Модуль колоночной выгрузки истории (Parquet)
+Инкрементально переносит новые события из events.jsonl в
+chat_{id}/exports/month=YYYY-MM/part-*.parquet для быстрого анализа в pandas
+"""
+
+import os
+import re
+import json
+import time
+import logging
+from pathlib import Path
+from typing import Dict, List
+from cold_storage import open_archive_file
+from event_log import iter_events
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+EXPORT_DIR_NAME = "exports"
+CHECKPOINT_NAME = "_checkpoint.json"
+
+# Как часто выгружать новые события (секунды) и минимальное количество новых событий
+PARQUET_EXPORT_INTERVAL = float(os.getenv('PARQUET_EXPORT_INTERVAL', 60))
+PARQUET_EXPORT_MIN_EVENTS = int(os.getenv('PARQUET_EXPORT_MIN_EVENTS', 500))
+
+# Сколько файлов в месяце допускается до объединения в один
+PARQUET_MAX_PARTS = int(os.getenv('PARQUET_MAX_PARTS', 20))
+
+# part-<начало>-<конец>.parquet: диапазон байтов events.jsonl, из которого собран файл
+PART_PATTERN = re.compile(r'^part-(\d{16})-(\d{16})\.parquet$')
+
+if pa is not None:
+    SCHEMA = pa.schema([
+        ('ts', pa.timestamp('us')),
+        ('date', pa.date32()),
+        ('hour', pa.int8()),
+        ('chat_id', pa.int64()),
+        ('kind', pa.string()),
+        ('sender', pa.string()),
+        ('sender_id', pa.int64()),
+        ('message_id', pa.int64()),
+        ('reply_to', pa.int64()),
+        ('text', pa.string()),
+        ('media_path', pa.string()),
+        ('event_type', pa.string()),
+    ])
+else:
+    SCHEMA = None
+
+_warned_missing = False
+
+
+def parquet_available() -> bool:
+    """Проверка наличия pyarrow (выгрузка отключается без него)"""
+    global _warned_missing
+    if pa is None and not _warned_missing:
+        logger.warning("[EXPORT] pyarrow is not installed, Parquet export disabled")
+        _warned_missing = True
+    return pa is not None
+
+
+def _part_name(start: int, end: int) -> str:
+    return f"part-{start:016d}-{end:016d}.parquet"
+
+
+class ParquetExporter:
+    """Инкрементальная выгрузка events.jsonl в Parquet (работает как sink журнала)"""
+
+    def __init__(
+        self,
+        events_file: Path,
+        export_dir: Path,
+        interval: float = PARQUET_EXPORT_INTERVAL,
+        min_events: int = PARQUET_EXPORT_MIN_EVENTS,
+    ):
+        """
+        Args:
+            events_file: Путь к events.jsonl
+            export_dir: Директория выгрузки (chat_{id}/exports/)
+            interval: Максимальная задержка выгрузки новых событий в секундах
+            min_events: Количество новых событий, при котором выгрузка идёт сразу
+        """
+        self.events_file = Path(events_file)
+        self.export_dir = Path(export_dir)
+        self.checkpoint_file = self.export_dir / CHECKPOINT_NAME
+        self.interval = interval
+        self.min_events = min_events
+
+        self._pending = 0
+        self._last_export = time.monotonic()
+
+    def write_batch(self, records: List):
+        """
+        Учёт новых событий; выгрузка, когда их накопилось достаточно или прошёл интервал
+
+        Вызывается после EventLog, поэтому события пачки уже в events.jsonl.
+        """
+        self._pending += len(records)
+        if self._pending >= self.min_events or time.monotonic() - self._last_export >= self.interval:
+            self.export()
+
+    def flush(self):
+        """Выгрузка всех накопленных событий (перед запросом агента)"""
+        if self._pending:
+            self.export()
+
+    def close(self):
+        """Выгрузка остатка перед остановкой"""
+        self.flush()
+
+    def _read_checkpoint(self) -> int:
+        """Смещение в events.jsonl, до которого события уже выгружены"""
+        try:
+            with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                return int(json.load(f)['offset'])
+        except (OSError, ValueError, KeyError):
+            return 0
+
+    def _write_checkpoint(self, offset: int):
+        """Атомарное сохранение смещения"""
+        tmp_file = self.checkpoint_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'offset': offset}, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def export(self) -> int:
+        """
+        Выгрузка событий, появившихся после контрольной точки
+
+        Файлы называются по диапазону байтов events.jsonl, поэтому повтор после
+        сбоя перезаписывает тот же файл, а не создаёт дубликат.
+
+        Returns:
+            Количество выгруженных событий
+        """
+        self._pending = 0
+        self._last_export = time.monotonic()
+
+        if not parquet_available() or not self.events_file.exists():
+            return 0
+
+        self.export_dir.mkdir(parents=True, exist_ok=True)
+        start = self._read_checkpoint()
+
+        columns: Dict[str, Dict[str, list]] = {}
+        end = start
+        count = 0
+        for event in iter_events(self.events_file, start):
+            month = event.ts.strftime('%Y-%m')
+            data = columns.get(month)
+            if data is None:
+                data = columns[month] = {name: [] for name in SCHEMA.names}
+
+            data['ts'].append(event.ts)
+            data['date'].append(event.ts.date())
+            data['hour'].append(event.ts.hour)
+            data['chat_id'].append(event.chat_id)
+            data['kind'].append(event.kind)
+            data['sender'].append(event.sender)
+            data['sender_id'].append(event.sender_id)
+            data['message_id'].append(event.message_id)
+            data['reply_to'].append(event.reply_to)
+            data['text'].append(event.text)
+            data['media_path'].append(event.media_path)
+            data['event_type'].append(event.event_type)
+            count += 1
+            end = event.offset
+
+        if not count:
+            return 0
+
+        # Конец диапазона - начало следующей (ещё не выгруженной) строки
+        with open_archive_file(self.events_file) as f:
+            f.seek(end)
+            end += len(f.readline())
+
+        started = time.monotonic()
+        for month, data in columns.items():
+            partition_dir = self.export_dir / f"month={month}"
+            partition_dir.mkdir(exist_ok=True)
+            table = pa.Table.from_pydict(data, schema=SCHEMA)
+            pq.write_table(table, partition_dir / _part_name(start, end), compression='zstd')
+            self._compact_partition(partition_dir)
+
+        self._write_checkpoint(end)
+        logger.info(
+            f"[EXPORT] Exported {count} events to {self.export_dir} "
+            f"in {(time.monotonic() - started) * 1000:.0f} ms"
+        )
+        return count
+
+    def _compact_partition(self, partition_dir: Path):
+        """
+        Объединение мелких файлов месяца в один
+
+        Новый файл покрывает диапазоны всех исходных и записывается раньше,
+        чем они удаляются; файлы, чей диапазон целиком покрыт другим, удаляются
+        и при следующем запуске (если прошлый прервался).
+        """
+        parts = []
+        for path in partition_dir.iterdir():
+            match = PART_PATTERN.match(path.name)
+            if match:
+                parts.append((int(match.group(1)), int(match.group(2)), path))
+        parts.sort()
+
+        # Удаление файлов, покрытых объединённым файлом
+        covered = set()
+        for start, end, path in parts:
+            for other_start, other_end, other in parts:
+                if other is not path and other_start <= start and end <= other_end \
+                        and (other_start, other_end) != (start, end):
+                    covered.add(path)
+                    break
+        for path in covered:
+            path.unlink(missing_ok=True)
+        parts = [part for part in parts if part[2] not in covered]
+
+        if len(parts) <= PARQUET_MAX_PARTS:
+            return
+
+        table = pa.concat_tables([pq.read_table(path, schema=SCHEMA) for _, _, path in parts])
+        merged = partition_dir / _part_name(parts[0][0], parts[-1][1])
+        tmp_file = merged.with_suffix('.tmp')
+        pq.write_table(table, tmp_file, compression='zstd')
+        os.replace(tmp_file, merged)
+
+        for _, _, path in parts:
+            if path != merged:
+                path.unlink(missing_ok=True)
+
+        logger.info(f"[EXPORT] Compacted {len(parts)} parts in {partition_dir}")
@@ -0,0 +1,178 @@
+"""
+Модуль защиты от повторной обработки сообщений
+После перезапуска или сбоя polling Telegram доставляет апдейты повторно;
+повтор распознаётся по (chat_id, message_id) в памяти, до записи в историю
+и скачивания файлов. Сообщение запоминается только после записи в историю:
+повтор сообщения, файл которого не скачался, обрабатывается заново
+
+В памяти - последние DEDUP_WINDOW записанных message_id чата (множество + очередь).
+На диске - chat_{id}/seen_ids.bin: message_id записанных в историю событий,
+8 байт (little-endian) на id, дописывается теми же пачками, что history.txt,
+и периодически обрезается до последних DEDUP_WINDOW id.
+"""
+
+import os
+import struct
+import logging
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SEEN_IDS_NAME = "seen_ids.bin"
+
+# Сколько последних message_id чата помнить
+DEDUP_WINDOW = int(os.getenv('DEDUP_WINDOW', 10000))
+
+ID_ENTRY = struct.Struct('<Q')
+
+# Общие счётчики всех чатов
+_totals: Dict[str, int] = {'checked': 0, 'duplicates': 0, 'too_old': 0}
+
+
+class SeenMessages:
+    """
+    Окно последних message_id чата
+
+    message_id в чате растут, поэтому id старше окна заведомо уже был
+    обработан: такие сообщения тоже считаются повтором.
+    """
+
+    def __init__(self, seen_file: Path, window: int = DEDUP_WINDOW):
+        """
+        Args:
+            seen_file: Путь к сохранённым id (chat_{id}/seen_ids.bin)
+            window: Сколько последних id помнить
+        """
+        self.seen_file = Path(seen_file)
+        self.window = window
+
+        self._ids = set()
+        self._order = deque()
+        self._floor = 0
+        self.loaded = False
+
+    def _remember(self, message_id: int):
+        self._ids.add(message_id)
+        self._order.append(message_id)
+        if len(self._order) > self.window:
+            evicted = self._order.popleft()
+            self._ids.discard(evicted)
+            self._floor = max(self._floor, evicted)
+
+    def load(self):
+        """Чтение сохранённых id (в потоке записи чата, один раз)"""
+        if self.loaded:
+            return
+        try:
+            with open(self.seen_file, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                start = max(size // ID_ENTRY.size - self.window, 0) * ID_ENTRY.size
+                f.seek(start)
+                data = f.read(size - start)
+        except FileNotFoundError:
+            data = b''
+
+        count = len(data) // ID_ENTRY.size
+        ids = sorted(set(struct.unpack(f'<{count}Q', data[:count * ID_ENTRY.size])))
+        if count >= self.window and ids:
+            # Окно заполнено: более старые id уже вытеснены
+            self._floor = max(self._floor, ids[0] - 1)
+        for message_id in ids:
+            if message_id not in self._ids:
+                self._remember(message_id)
+        self.loaded = True
+
+    def check(self, message_id: Optional[int]) -> bool:
+        """
+        Проверка message_id (запоминается отдельно, после записи - mark())
+
+        Args:
+            message_id: ID сообщения (None - проверка не выполняется)
+
+        Returns:
+            True, если сообщение уже обрабатывалось
+        """
+        if message_id is None:
+            return False
+
+        _totals['checked'] += 1
+        if message_id in self._ids:
+            _totals['duplicates'] += 1
+            return True
+        if message_id <= self._floor:
+            _totals['duplicates'] += 1
+            _totals['too_old'] += 1
+            return True
+        return False
+
+    def mark(self, message_id: Optional[int]):
+        """
+        Запоминание message_id сообщения, записанного в историю
+
+        Args:
+            message_id: ID сообщения (None - не запоминается)
+        """
+        if message_id is not None and message_id not in self._ids:
+            self._remember(message_id)
+
+
+class SeenIdsLog:
+    """Дозапись message_id записанных событий в seen_ids.bin (получает пачки из HistoryJournal)"""
+
+    def __init__(self, seen_file: Path, window: int = DEDUP_WINDOW):
+        """
+        Args:
+            seen_file: Путь к seen_ids.bin
+            window: Сколько последних id хранить (файл обрезается при вдвое большем размере)
+        """
+        self.seen_file = Path(seen_file)
+        self.window = window
+
+    def write_batch(self, records: List):
+        """
+        Дозапись id событий пачки
+
+        Args:
+            records: Записи журнала (HistoryRecord)
+        """
+        ids = [
+            record.event['message_id'] for record in records
+            if record.event and record.event.get('message_id') is not None
+        ]
+        if not ids:
+            return
+
+        with open(self.seen_file, 'ab') as f:
+            f.write(struct.pack(f'<{len(ids)}Q', *ids))
+            size = f.tell()
+
+        if size > 2 * self.window * ID_ENTRY.size:
+            self._truncate(size)
+
+    def _truncate(self, size: int):
+        """Атомарная обрезка файла до последних window id"""
+        keep = self.window * ID_ENTRY.size
+        with open(self.seen_file, 'rb') as f:
+            f.seek(size - keep)
+            data = f.read(keep)
+
+        tmp_file = Path(f"{self.seen_file}.tmp")
+        with open(tmp_file, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_file, self.seen_file)
+
+    def close(self):
+        """Файл дописывается на каждой пачке, закрывать нечего"""
+
+
+def get_dedup_stats() -> Dict[str, int]:
+    """
+    Счётчики повторов по всем чатам
+
+    Returns:
+        Словарь: checked, duplicates, too_old (старше окна)
+    """
+    return dict(_totals)
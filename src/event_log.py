@@ -0,0 +1,137 @@
+"""
+Модуль структурированного журнала событий (events.jsonl)
+Машиночитаемая копия истории: одно событие = один JSON-объект в строке,
+без потерь (message_id, reply_to, id отправителя, точное время, исходный текст)
+"""
+
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Optional
+from cold_storage import open_archive_file
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOG_NAME = "events.jsonl"
+
+# Поля события в порядке записи (пустые поля не сохраняются)
+EVENT_FIELDS = (
+    'kind', 'sender', 'sender_id', 'message_id', 'reply_to',
+    'text', 'media_path', 'event_type',
+)
+
+
+class ArchiveEvent(NamedTuple):
+    """Событие архива, прочитанное из events.jsonl"""
+
+    ts: datetime
+    chat_id: int
+    kind: str
+    sender: Optional[str] = None
+    sender_id: Optional[int] = None
+    message_id: Optional[int] = None
+    reply_to: Optional[int] = None
+    text: Optional[str] = None
+    media_path: Optional[str] = None
+    event_type: Optional[str] = None
+    # Смещение события в events.jsonl с учётом сжатого начала (для инкрементальной обработки)
+    offset: int = 0
+
+
+def encode_event(chat_id: int, timestamp: datetime, event: dict) -> bytes:
+    """
+    Сериализация события в компактную строку JSON
+
+    Args:
+        chat_id: ID чата
+        timestamp: Время события
+        event: Поля события
+
+    Returns:
+        Строка JSON с переводом строки в UTF-8
+    """
+    obj = {'ts': timestamp.isoformat(), 'chat_id': chat_id}
+    for field in EVENT_FIELDS:
+        value = event.get(field)
+        if value is not None:
+            obj[field] = value
+    return (json.dumps(obj, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class EventLog:
+    """Дозапись событий в events.jsonl (получает пачки из HistoryJournal)"""
+
+    def __init__(self, path: Path, chat_id: int):
+        """
+        Args:
+            path: Путь к журналу событий (chat_{id}/events.jsonl)
+            chat_id: ID чата
+        """
+        self.path = Path(path)
+        self.chat_id = chat_id
+
+    def write_batch(self, records: List):
+        """
+        Дозапись пачки событий одной операцией
+
+        Args:
+            records: Записи журнала (HistoryRecord)
+        """
+        data = b''.join(
+            encode_event(self.chat_id, record.timestamp, record.event)
+            for record in records
+        )
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+    def close(self):
+        """Журнал дописывается на каждой пачке, закрывать нечего"""
+
+
+def iter_events(path: Path, start_offset: int = 0) -> Iterator[ArchiveEvent]:
+    """
+    Потоковое чтение журнала событий без загрузки файла в память
+
+    Незавершённая последняя строка (запись прервана) пропускается,
+    повреждённые строки логируются и пропускаются. Сжатое начало
+    (events.jsonl.cold.gz) читается перед самим файлом.
+
+    Args:
+        path: Путь к events.jsonl
+        start_offset: Смещение, с которого читать (конец ранее прочитанной части)
+
+    Yields:
+        ArchiveEvent
+    """
+    path = Path(path)
+    if not path.exists():
+        return
+
+    with open_archive_file(path) as f:
+        f.seek(start_offset)
+        offset = start_offset
+        for raw in f:
+            line_offset = offset
+            offset += len(raw)
+
+            if not raw.endswith(b'\n'):
+                break
+
+            try:
+                obj = json.loads(raw)
+                yield ArchiveEvent(
+                    ts=datetime.fromisoformat(obj['ts']),
+                    chat_id=obj['chat_id'],
+                    kind=obj.get('kind', 'text'),
+                    sender=obj.get('sender'),
+                    sender_id=obj.get('sender_id'),
+                    message_id=obj.get('message_id'),
+                    reply_to=obj.get('reply_to'),
+                    text=obj.get('text'),
+                    media_path=obj.get('media_path'),
+                    event_type=obj.get('event_type'),
+                    offset=line_offset,
+                )
+            except (ValueError, KeyError) as e:
+                logger.warning(f"[EVENTS] Skipping corrupted event at {path}:{line_offset}: {e}")
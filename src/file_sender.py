@@ -8,6 +8,7 @@ import re
 import logging
 from typing import List, Tuple
 from pathlib import Path
+from media_layout import resolve_media_path
 
 logger = logging.getLogger(__name__)
 
@@ -63,8 +64,8 @@ def parse_file_paths(text: str, chat_id: int) -> List[str]:
                 logger.info(f"[FILE_PARSER] Found backtick path: {relative_path} -> {full_path}")
                 continue
 
-        # Попытка 2: относительно media/
-        media_path = f"/app/chat_archive/chat_{chat_id}/media/{relative_path}"
+        # Попытка 2: относительно media/ (старые плоские пути - через таблицу переноса)
+        media_path = resolve_media_path(f"/app/chat_archive/chat_{chat_id}/media/{relative_path}")
         if os.path.exists(media_path) and os.path.isfile(media_path):
             if media_path not in found_files:
                 found_files.append(media_path)
@@ -72,6 +73,7 @@ def parse_file_paths(text: str, chat_id: int) -> List[str]:
                 continue
 
         # Попытка 3: полный путь как есть (если это уже абсолютный путь)
+        relative_path = resolve_media_path(relative_path)
         if os.path.exists(relative_path) and os.path.isfile(relative_path):
             if relative_path not in found_files:
                 found_files.append(relative_path)
@@ -91,6 +93,7 @@ def mask_file_paths(text: str) -> str:
     Заменяет:
     /app/chat_archive/chat_123/agent_files/report.xlsx -> report.xlsx
     /app/chat_archive/chat_123/media/photo.jpg -> photo.jpg
+    /app/chat_archive/chat_123/media/2025/03/photo.jpg -> photo.jpg
     `/app/chat_archive/chat_123/agent_files/report.xlsx` -> `report.xlsx`
 
     Args:
@@ -102,7 +105,8 @@ def mask_file_paths(text: str) -> str:
     # Паттерн для замены: /app/chat_archive/chat_{id}/{subdir}/filename.ext
     # Поддерживаем отрицательные chat_id (группы начинаются с минуса)
     # Включаем backtick в список stop-символов, чтобы правильно обрабатывать пути в backticks
-    pattern = r'/app/chat_archive/chat_-?\d+/(?:agent_files|media)/([^\s\'"<>|`]+)'
+    # Подкаталоги (media/YYYY/MM/) тоже убираются - остаётся имя файла
+    pattern = r'/app/chat_archive/chat_-?\d+/(?:agent_files|media)/(?:[^\s\'"<>|`]+/)?([^\s\'"<>|`/]+)'
 
     def replace_with_filename(match):
         full_path = match.group(0)
@@ -0,0 +1,191 @@
+"""
+Модуль разбора строк history.txt
+Восстанавливает структуру событий (время, отправитель, тип, текст, путь к файлу)
+из человекочитаемого формата ChatArchiver
+"""
+
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+from cold_storage import open_archive_file, resolve_archive_file
+
+# [DD.MM HH:MM] остаток строки
+LINE_PATTERN = re.compile(r'^\[(\d{2})\.(\d{2}) (\d{2}):(\d{2})\] (.*)$')
+
+BOT_FILE_PATTERN = re.compile(r'^🤖 Бот отправил файл (\S+) (.+?) - полный путь (.+)$')
+USER_FILE_PATTERN = re.compile(r'^(.+?) отправил файл (\S+) (.+?) - полный путь (.+)$')
+TEXT_PATTERN = re.compile(r'^(.+?): (.*)$')
+
+BOT_PREFIX = '🤖 Бот: '
+
+# Иконки файлов пользователей → тип события
+FILE_ICONS = {
+    '📷': 'photo',
+    '📄': 'document',
+    '🎤': 'voice',
+    '🎥': 'video_note',
+}
+
+# Иконки системных событий (см. ChatArchiver.archive_system_event)
+SYSTEM_ICONS = {'👤', '👋', '✏️', '🖼️', '📌', '🗑️'}
+
+
+def parse_line(line: str) -> Optional[dict]:
+    """
+    Разбор одной строки истории
+
+    Args:
+        line: Строка history.txt
+
+    Returns:
+        Словарь с полями day, month, hour, minute, kind, sender, text, media_path
+        или None, если строка не в формате истории
+    """
+    match = LINE_PATTERN.match(line.rstrip('\n'))
+    if not match:
+        return None
+
+    day, month, hour, minute, body = match.groups()
+    event = {
+        'day': int(day),
+        'month': int(month),
+        'hour': int(hour),
+        'minute': int(minute),
+        'kind': 'text',
+        'sender': None,
+        'text': body,
+        'media_path': None,
+    }
+
+    bot_file = BOT_FILE_PATTERN.match(body)
+    if bot_file:
+        _, filename, path = bot_file.groups()
+        event.update(kind='bot_file', sender='Бот', text=filename, media_path=path)
+        return event
+
+    if body.startswith(BOT_PREFIX):
+        event.update(kind='bot_response', sender='Бот', text=body[len(BOT_PREFIX):])
+        return event
+
+    user_file = USER_FILE_PATTERN.match(body)
+    if user_file:
+        sender, icon, filename, path = user_file.groups()
+        event.update(kind=FILE_ICONS.get(icon, 'document'), sender=sender, text=filename, media_path=path)
+        return event
+
+    icon, _, details = body.partition(' ')
+    if icon in SYSTEM_ICONS:
+        event.update(kind='system', text=details)
+        return event
+
+    text = TEXT_PATTERN.match(body)
+    if text:
+        sender, message_text = text.groups()
+        event.update(sender=sender, text=message_text)
+
+    return event
+
+
+def _iter_dated(path: Path, end_year: Optional[int]) -> Iterator[Tuple[Optional[datetime], Optional[dict], int, str]]:
+    """
+    Все строки history.txt с восстановленным годом
+
+    Yields:
+        (время или None, разобранная строка или None, смещение, строка);
+        время None - строка не в формате истории или дата невозможна
+    """
+    path = Path(path)
+    if end_year is None:
+        end_year = datetime.fromtimestamp(resolve_archive_file(path).stat().st_mtime).year
+
+    rollovers = 0
+    last_month = None
+    with open_archive_file(path) as f:
+        for raw in f:
+            match = LINE_PATTERN.match(raw.decode('utf-8', errors='replace'))
+            if not match:
+                continue
+            month = int(match.group(2))
+            if last_month is not None and month < last_month:
+                rollovers += 1
+            last_month = month
+
+    year = end_year - rollovers
+    last_month = None
+    offset = 0
+    with open_archive_file(path) as f:
+        for raw in f:
+            line_offset = offset
+            offset += len(raw)
+
+            line = raw.decode('utf-8', errors='replace')
+            event = parse_line(line)
+            if event is None:
+                yield None, None, line_offset, line
+                continue
+
+            if last_month is not None and event['month'] < last_month:
+                year += 1
+            last_month = event['month']
+
+            try:
+                timestamp = datetime(year, event['month'], event['day'], event['hour'], event['minute'])
+            except ValueError:
+                # 29.02 в невисокосном году после неверной оценки года
+                timestamp = None
+            yield timestamp, event, line_offset, line
+
+
+def iter_history(path: Path, end_year: Optional[int] = None) -> Iterator[Tuple[datetime, dict, int, str]]:
+    """
+    Потоковое чтение history.txt с восстановлением года
+
+    В строках истории нет года, поэтому файл читается дважды: первый проход
+    считает переходы через Новый год (месяц уменьшился), второй отдаёт события
+    с годом, отсчитанным назад от года последней записи.
+
+    Args:
+        path: Путь к history.txt или к сегменту (сжатый сегмент читается прозрачно)
+        end_year: Год последней строки (по умолчанию год изменения файла)
+
+    Yields:
+        (время события, разобранная строка, смещение строки в байтах, строка)
+    """
+    for timestamp, event, offset, line in _iter_dated(path, end_year):
+        if timestamp is not None:
+            yield timestamp, event, offset, line
+
+
+def iter_history_lines(path: Path, end_year: Optional[int] = None) -> Iterator[Tuple[datetime, Optional[dict], str]]:
+    """
+    Все строки history.txt со временем, без пропусков (для переписывания файла)
+
+    Строка без времени (продолжение многострочного сообщения) или с
+    невозможной датой получает время предыдущей строки, строки до первой
+    датированной - время этой строки.
+
+    Args:
+        path: Путь к history.txt
+        end_year: Год последней строки (по умолчанию год изменения файла)
+
+    Yields:
+        (время, разобранная строка или None, строка)
+    """
+    last = None
+    leading = []
+    for timestamp, event, _, line in _iter_dated(path, end_year):
+        if timestamp is None:
+            timestamp = last
+        if timestamp is None:
+            leading.append((event, line))
+            continue
+        for leading_event, leading_line in leading:
+            yield timestamp, leading_event, leading_line
+        leading = []
+        last = timestamp
+        yield timestamp, event, line
+
+    # В файле нет ни одной датированной строки
+    for event, line in leading:
+        yield datetime.fromtimestamp(Path(path).stat().st_mtime), event, line
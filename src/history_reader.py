@@ -0,0 +1,750 @@
+"""
+Модуль чтения истории по диапазонам
+Разреженный индекс время → смещение в history.txt и чтение окна времени
+без просмотра файла с начала; индекс начал строк для count/tail/lines;
+короткая копия последних строк history_recent.txt для агента
+
+Формат индекса history.tsidx: записи фиксированной длины
+    YYYY-MM-DDTHH:MM:SS <смещение, 16 цифр>\\n
+Записи упорядочены по времени, поэтому поиск идёт бинарно прямо по mmap.
+
+Формат индекса history.lidx: смещение начала каждой строки history.txt,
+8 байт (little-endian); число строк = размер файла / 8.
+
+Смещения в обоих индексах считаются в полной истории: сжатое начало
+history.txt.cold.gz и сам history.txt читаются как один файл.
+
+Пересборка индексов и history_recent.txt по существующему history.txt:
+    python src/history_reader.py rebuild <chat_id> [<chat_id> ...]
+    python src/history_reader.py rebuild --all
+"""
+
+import os
+import sys
+import mmap
+import struct
+import time
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+from cold_storage import archive_size, open_archive_file
+from history_parser import LINE_PATTERN, iter_history
+
+logger = logging.getLogger(__name__)
+
+TIME_INDEX_NAME = "history.tsidx"
+LINE_INDEX_NAME = "history.lidx"
+RECENT_NAME = "history_recent.txt"
+
+# Запись индекса делается не реже, чем раз в N строк (и на каждый новый час)
+HISTORY_INDEX_EVERY = int(os.getenv('HISTORY_INDEX_EVERY', 500))
+
+ENTRY_SIZE = 37
+TS_SIZE = 19
+
+LINE_ENTRY = struct.Struct('<Q')
+
+# Размер history_recent.txt: последние N строк, не старше K дней (0 - без ограничения по дням)
+RECENT_LINES = int(os.getenv('RECENT_LINES', 500))
+RECENT_DAYS = int(os.getenv('RECENT_DAYS', 0))
+
+# Как часто переписывать history_recent.txt (секунды; перед запросом агента - всегда)
+RECENT_SAVE_INTERVAL = float(os.getenv('RECENT_SAVE_INTERVAL', 5))
+
+
+def _format_entry(timestamp: datetime, offset: int) -> bytes:
+    """Запись индекса фиксированной длины"""
+    return f"{timestamp:%Y-%m-%dT%H:%M:%S} {offset:016d}\n".encode('ascii')
+
+
+def _parse_entry(raw: bytes) -> Tuple[datetime, int]:
+    """Разбор записи индекса: (время, смещение)"""
+    return datetime.strptime(raw[:TS_SIZE].decode('ascii'), "%Y-%m-%dT%H:%M:%S"), int(raw[TS_SIZE + 1:ENTRY_SIZE - 1])
+
+
+def _replace_file(path: Path, data: bytes):
+    """Атомарная перезапись файла индекса"""
+    tmp_file = Path(f"{path}.tmp")
+    with open(tmp_file, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_file, path)
+
+
+def _tail_points(history_file: Path, offset: int, end: int, last: datetime) -> Iterator[Tuple[datetime, int]]:
+    """
+    Время и смещение строк history.txt после строки со смещением offset до end
+
+    Год восстанавливается от времени строки offset (last); строки с
+    невозможной датой пропускаются.
+    """
+    year, last_month = last.year, last.month
+    with open_archive_file(history_file) as f:
+        f.seek(offset)
+        position = offset + len(f.readline())
+        for raw in f:
+            if position >= end:
+                break
+            line_offset = position
+            position += len(raw)
+            match = LINE_PATTERN.match(raw.decode('utf-8', errors='replace'))
+            if not match:
+                continue
+            day, month, hour, minute = (int(value) for value in match.groups()[:4])
+            if month < last_month:
+                year += 1
+            last_month = month
+            try:
+                timestamp = datetime(year, month, day, hour, minute)
+            except ValueError:
+                continue
+            yield timestamp, line_offset
+
+
+class SparseTimeIndex:
+    """Разреженный индекс времени history.txt (получает пачки из HistoryJournal)"""
+
+    def __init__(self, index_file: Path, history_file: Path, every: int = HISTORY_INDEX_EVERY):
+        """
+        Инициализация индекса (состояние читается в потоке записи)
+
+        Args:
+            index_file: Путь к файлу индекса (chat_{id}/history.tsidx)
+            history_file: Путь к history.txt
+            every: Максимальное число строк между записями индекса
+        """
+        self.index_file = Path(index_file)
+        self.history_file = Path(history_file)
+        self.every = every
+
+        # Конец учтённой части history.txt (None - индекс ещё не сверялся)
+        self._end: Optional[int] = None
+        self._last_ts: Optional[datetime] = None
+        self._since_last = 0
+
+    def _entries(self, points: Iterable[Tuple[datetime, int]]) -> List[bytes]:
+        """
+        Отбор точек (время, смещение), попадающих в разреженный индекс
+
+        Точка попадает в индекс, если начался новый час или с прошлой записи
+        прошло every строк. Время в индексе не убывает (нужно для бинарного поиска).
+        """
+        entries = []
+        for timestamp, offset in points:
+            self._since_last += 1
+            if self._last_ts is not None:
+                if timestamp < self._last_ts:
+                    continue
+                same_hour = timestamp.replace(minute=0, second=0, microsecond=0) == \
+                    self._last_ts.replace(minute=0, second=0, microsecond=0)
+                if same_hour and self._since_last < self.every:
+                    continue
+
+            entries.append(_format_entry(timestamp, offset))
+            self._last_ts = timestamp
+            self._since_last = 0
+        return entries
+
+    def _catch_up(self, upto: int):
+        """
+        Сверка индекса с history.txt до смещения upto
+
+        Выполняется на первой пачке и на пачке, перед которой запись индекса не
+        удалась: недописанная запись отрезается, а строки после последней записи
+        индекса (пропущенная пачка или архив старше индекса) индексируются по
+        history.txt. Если индекс указывает дальше upto (history.txt заменён),
+        он строится заново.
+        """
+        size = self.index_file.stat().st_size if self.index_file.exists() else 0
+        last = None
+        if size >= ENTRY_SIZE:
+            with open(self.index_file, 'rb') as f:
+                f.seek(size - size % ENTRY_SIZE - ENTRY_SIZE)
+                last = _parse_entry(f.read(ENTRY_SIZE))
+
+        self._end = upto
+        if last is None or last[1] >= upto:
+            self._last_ts = None
+            self._since_last = 0
+            if not upto and not size:
+                return
+            logger.info(f"[TIME_INDEX] Rebuilding {self.index_file} for existing history")
+            points = (
+                (timestamp, offset)
+                for timestamp, _, offset, _ in iter_history(self.history_file)
+                if offset < upto
+            )
+            _replace_file(self.index_file, b''.join(self._entries(points)))
+            return
+
+        self._last_ts, offset = last
+        self._since_last = 0
+        entries = self._entries(_tail_points(self.history_file, offset, upto, self._last_ts))
+        with open(self.index_file, 'r+b') as f:
+            f.truncate(size - size % ENTRY_SIZE)
+            f.seek(0, os.SEEK_END)
+            f.write(b''.join(entries))
+        if entries:
+            logger.warning(f"[TIME_INDEX] Added {len(entries)} missing entries to {self.index_file}")
+
+    def write_batch(self, records: List):
+        """
+        Добавление точек индекса для пачки строк
+
+        Args:
+            records: Записи журнала (HistoryRecord) с заполненным offset
+        """
+        if self._end != records[0].offset:
+            self._catch_up(records[0].offset)
+
+        entries = self._entries((record.timestamp, record.offset) for record in records)
+        if entries:
+            with open(self.index_file, 'ab') as f:
+                f.write(b''.join(entries))
+        last = records[-1]
+        self._end = last.offset + len(last.line.encode('utf-8'))
+
+    def close(self):
+        """Индекс дописывается на каждой пачке, закрывать нечего"""
+
+
+def rebuild_time_index(history_file: Path, index_file: Path) -> int:
+    """
+    Пересборка индекса времени по history.txt
+
+    Args:
+        history_file: Путь к history.txt
+        index_file: Путь к файлу индекса
+
+    Returns:
+        Количество записей индекса
+    """
+    index = SparseTimeIndex(index_file, history_file)
+    entries = index._entries(
+        (timestamp, offset) for timestamp, _, offset, _ in iter_history(history_file)
+    )
+    _replace_file(index_file, b''.join(entries))
+    return len(entries)
+
+
+def _locate(index_file: Path, start: datetime, end: datetime, history_size: int) -> Tuple[int, int, Optional[datetime]]:
+    """
+    Поиск диапазона байтов history.txt для окна времени
+
+    Returns:
+        (начальное смещение, конечное смещение, время записи индекса в начале диапазона)
+    """
+    size = index_file.stat().st_size if index_file.exists() else 0
+    count = size // ENTRY_SIZE
+    if count == 0:
+        return 0, history_size, None
+
+    # Строки истории имеют точность до минуты: окно расширяется до целых минут
+    start_key = f"{start:%Y-%m-%dT%H:%M}:00".encode('ascii')
+    end_key = f"{end:%Y-%m-%dT%H:%M}:59".encode('ascii')
+
+    with open(index_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        def key(i: int) -> bytes:
+            return mm[i * ENTRY_SIZE:i * ENTRY_SIZE + TS_SIZE]
+
+        # Последняя запись с временем < start (все строки до неё - раньше окна)
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key(mid) < start_key:
+                lo = mid + 1
+            else:
+                hi = mid
+        first = max(lo - 1, 0)
+        base_ts, start_offset = _parse_entry(mm[first * ENTRY_SIZE:(first + 1) * ENTRY_SIZE])
+        if lo == 0:
+            start_offset = 0
+
+        # Первая запись с временем > end
+        lo, hi = first, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key(mid) <= end_key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < count:
+            _, end_offset = _parse_entry(mm[lo * ENTRY_SIZE:(lo + 1) * ENTRY_SIZE])
+        else:
+            end_offset = history_size
+
+    return start_offset, end_offset, base_ts
+
+
+def read_window(
+    history_file: Path,
+    index_file: Path,
+    start: datetime,
+    end: datetime,
+    max_lines: Optional[int] = None,
+) -> dict:
+    """
+    Чтение строк истории за период [start, end]
+
+    По индексу находится диапазон байтов, и читается только он.
+    Год строк восстанавливается от времени записи индекса в начале диапазона.
+
+    Args:
+        history_file: Путь к history.txt
+        index_file: Путь к индексу времени
+        start: Начало периода
+        end: Конец периода (включительно)
+        max_lines: Максимальное количество строк в ответе
+
+    Returns:
+        Словарь: lines (строки без перевода строки), total, truncated, bytes_read
+    """
+    history_file = Path(history_file)
+    result = {'lines': [], 'total': 0, 'truncated': False, 'bytes_read': 0}
+
+    history_size = archive_size(history_file)
+    if history_size == 0:
+        return result
+
+    start_offset, end_offset, base_ts = _locate(Path(index_file), start, end, history_size)
+    end_offset = min(end_offset, history_size)
+    if end_offset <= start_offset:
+        return result
+
+    # Строки истории с точностью до минуты
+    start = start.replace(second=0, microsecond=0)
+    year = base_ts.year if base_ts else end.year
+    last_month = base_ts.month if base_ts else None
+
+    chunk = _read_range(history_file, start_offset, end_offset)
+    result['bytes_read'] = len(chunk)
+
+    for raw in chunk.splitlines():
+        line = raw.decode('utf-8', errors='replace')
+        match = LINE_PATTERN.match(line)
+        if not match:
+            continue
+
+        day, month, hour, minute = (int(value) for value in match.groups()[:4])
+        if last_month is not None and month < last_month:
+            year += 1
+        last_month = month
+
+        try:
+            timestamp = datetime(year, month, day, hour, minute)
+        except ValueError:
+            continue
+
+        if timestamp < start:
+            continue
+        if timestamp > end:
+            break
+
+        result['total'] += 1
+        if max_lines is None or len(result['lines']) < max_lines:
+            result['lines'].append(line)
+        else:
+            result['truncated'] = True
+
+    return result
+
+
+def _read_range(history_file: Path, start_offset: int, end_offset: int) -> bytes:
+    """Байты истории из диапазона [start_offset, end_offset)"""
+    with open_archive_file(history_file) as f:
+        f.seek(start_offset)
+        return f.read(end_offset - start_offset)
+
+
+def _scan_line_starts(history_file: Path, end_offset: Optional[int] = None, offset: int = 0) -> List[int]:
+    """Смещения начал строк истории в [offset, end_offset) (потоковое чтение)"""
+    starts = []
+    with open_archive_file(history_file) as f:
+        f.seek(offset)
+        for raw in f:
+            if end_offset is not None and offset >= end_offset:
+                break
+            starts.append(offset)
+            offset += len(raw)
+    return starts
+
+
+def _line_starts(data, base: int = 0) -> List[int]:
+    """Смещения начал строк в блоке (блок начинается с начала строки)"""
+    starts = []
+    position = 0
+    size = len(data)
+    while position < size:
+        starts.append(base + position)
+        newline = data.find(b'\n', position)
+        if newline < 0:
+            break
+        position = newline + 1
+    return starts
+
+
+class LineIndex:
+    """Индекс начал строк history.txt (получает пачки из HistoryJournal)"""
+
+    def __init__(self, index_file: Path, history_file: Path):
+        """
+        Args:
+            index_file: Путь к индексу строк (chat_{id}/history.lidx)
+            history_file: Путь к history.txt
+        """
+        self.index_file = Path(index_file)
+        self.history_file = Path(history_file)
+        # Конец учтённой части history.txt (None - индекс ещё не сверялся)
+        self._end: Optional[int] = None
+
+    def _catch_up(self, upto: int):
+        """
+        Сверка индекса с history.txt до смещения upto
+
+        Выполняется на первой пачке и на пачке, перед которой запись индекса не
+        удалась: недописанная запись отрезается, начала строк после последней
+        строки индекса (пропущенная пачка или архив старше индекса) дописываются
+        по history.txt. Если индекс указывает дальше upto (history.txt заменён),
+        он строится заново.
+        """
+        size = self.index_file.stat().st_size if self.index_file.exists() else 0
+        count = size // LINE_ENTRY.size
+        last = None
+        if count:
+            with open(self.index_file, 'rb') as f:
+                f.seek((count - 1) * LINE_ENTRY.size)
+                last, = LINE_ENTRY.unpack(f.read(LINE_ENTRY.size))
+
+        self._end = upto
+        if last is not None and last >= upto:
+            logger.info(f"[LINE_INDEX] Rebuilding {self.index_file}: history.txt was replaced")
+            starts = _scan_line_starts(self.history_file, upto)
+            _replace_file(self.index_file, struct.pack(f'<{len(starts)}Q', *starts))
+            return
+
+        start = 0
+        if last is not None:
+            with open_archive_file(self.history_file) as f:
+                f.seek(last)
+                start = last + len(f.readline())
+        starts = _scan_line_starts(self.history_file, upto, start) if start < upto else []
+        if starts:
+            logger.info(f"[LINE_INDEX] Adding {len(starts)} missing lines to {self.index_file}")
+        with open(self.index_file, 'ab') as f:
+            f.truncate(count * LINE_ENTRY.size)
+            f.write(struct.pack(f'<{len(starts)}Q', *starts))
+
+    def write_batch(self, records: List):
+        """
+        Добавление начал строк пачки
+
+        Args:
+            records: Записи журнала (HistoryRecord) с заполненным offset
+        """
+        if self._end != records[0].offset:
+            self._catch_up(records[0].offset)
+
+        starts = []
+        for record in records:
+            if record.line.count('\n') > 1:
+                # Перевод строки внутри записи - индексируем каждую физическую строку
+                starts.extend(_line_starts(record.line.encode('utf-8'), record.offset))
+            else:
+                starts.append(record.offset)
+
+        with open(self.index_file, 'ab') as f:
+            f.write(struct.pack(f'<{len(starts)}Q', *starts))
+        last = records[-1]
+        self._end = last.offset + len(last.line.encode('utf-8'))
+
+    def close(self):
+        """Индекс дописывается на каждой пачке, закрывать нечего"""
+
+
+def rebuild_line_index(history_file: Path, index_file: Path) -> int:
+    """
+    Пересборка индекса строк по history.txt
+
+    Returns:
+        Количество строк
+    """
+    starts = _scan_line_starts(history_file)
+    _replace_file(index_file, struct.pack(f'<{len(starts)}Q', *starts))
+    return len(starts)
+
+
+class HistoryLines:
+    """
+    Быстрые ответы по строкам истории: количество, последние строки, диапазон
+
+    Смещения строк берутся из индекса history.lidx, сами строки читаются
+    только в нужном диапазоне. Без индекса или если он отстал от history.txt
+    (запись индекса не удалась) строки ищутся потоковым чтением (медленнее,
+    но без загрузки файла в память).
+    """
+
+    def __init__(self, history_file: Path, index_file: Path):
+        """
+        Args:
+            history_file: Путь к history.txt
+            index_file: Путь к индексу строк
+        """
+        self.history_file = Path(history_file)
+        self.index_file = Path(index_file)
+
+    def _history_size(self) -> int:
+        return archive_size(self.history_file)
+
+    def _starts(self, first: int, last: int) -> List[int]:
+        """Смещения строк с номерами [first, last) (с нуля) из индекса"""
+        with open(self.index_file, 'rb') as f:
+            f.seek(first * LINE_ENTRY.size)
+            data = f.read((last - first) * LINE_ENTRY.size)
+        return list(struct.unpack(f'<{len(data) // LINE_ENTRY.size}Q', data))
+
+    def _indexed_count(self) -> Optional[int]:
+        """
+        Количество строк по индексу или None, если индекса нет или он
+        не доходит до конца history.txt (строки тогда ищутся чтением файла)
+        """
+        if not self.index_file.exists():
+            return None
+        count = self.index_file.stat().st_size // LINE_ENTRY.size
+        size = self._history_size()
+        if not count:
+            return None if size else 0
+
+        last, = self._starts(count - 1, count)
+        with open_archive_file(self.history_file) as f:
+            f.seek(last)
+            end = last + len(f.readline())
+        if end != size:
+            logger.warning(f"[LINE_INDEX] {self.index_file} covers {end} of {size} bytes, scanning history")
+            return None
+        return count
+
+    def count(self) -> int:
+        """Количество строк истории"""
+        count = self._indexed_count()
+        if count is not None:
+            return count
+        if not self._history_size():
+            return 0
+        return len(_scan_line_starts(self.history_file))
+
+    def _read(self, start_offset: int, end_offset: int) -> List[str]:
+        """Строки history.txt из диапазона байтов"""
+        end_offset = min(end_offset, self._history_size())
+        if end_offset <= start_offset:
+            return []
+        chunk = _read_range(self.history_file, start_offset, end_offset)
+        return [raw.decode('utf-8', errors='replace') for raw in chunk.splitlines()]
+
+    def lines(self, first: int, last: int) -> List[str]:
+        """
+        Строки с номерами от first до last включительно (нумерация с 1)
+
+        Args:
+            first: Номер первой строки
+            last: Номер последней строки
+
+        Returns:
+            Строки без перевода строки
+        """
+        starts = None
+        total = self._indexed_count()
+        if total is None:
+            starts = _scan_line_starts(self.history_file)
+            total = len(starts)
+        first = max(first, 1)
+        last = min(last, total)
+        if first > last:
+            return []
+
+        if starts is None:
+            bounds = self._starts(first - 1, min(last + 1, total))
+        else:
+            bounds = starts[first - 1:last + 1]
+
+        end_offset = bounds[last - first + 1] if len(bounds) > last - first + 1 else self._history_size()
+        return self._read(bounds[0], end_offset)
+
+    def tail(self, n: int) -> List[str]:
+        """Последние n строк истории"""
+        total = self.count()
+        return self.lines(total - n + 1, total) if n > 0 else []
+
+
+def _line_times(lines: List[str], newest: datetime) -> List[Optional[datetime]]:
+    """
+    Время строк истории, идущих подряд и заканчивающихся строкой со временем newest
+
+    Год восстанавливается проходом от конца: месяц вырос - значит, перешли
+    через Новый год назад. Строки без времени получают None.
+    """
+    times: List[Optional[datetime]] = [None] * len(lines)
+    year = newest.year
+    next_month = newest.month
+    for i in range(len(lines) - 1, -1, -1):
+        match = LINE_PATTERN.match(lines[i])
+        if not match:
+            continue
+        day, month, hour, minute = (int(group) for group in match.groups()[:4])
+        if month > next_month:
+            year -= 1
+        next_month = month
+        try:
+            times[i] = datetime(year, month, day, hour, minute)
+        except ValueError:
+            pass
+    return times
+
+
+class RecentWindow:
+    """
+    Последние строки истории в отдельном файле history_recent.txt (получает пачки из HistoryJournal)
+
+    Строки держатся в памяти в кольцевом буфере; файл переписывается атомарно
+    (он маленький) не чаще раза в интервал и перед запросом агента.
+    """
+
+    def __init__(
+        self,
+        recent_file: Path,
+        history_file: Path,
+        index_file: Path,
+        max_lines: int = RECENT_LINES,
+        max_days: int = RECENT_DAYS,
+        save_interval: float = RECENT_SAVE_INTERVAL,
+    ):
+        """
+        Args:
+            recent_file: Путь к history_recent.txt
+            history_file: Путь к history.txt (для заполнения при первой пачке)
+            index_file: Путь к индексу строк history.lidx
+            max_lines: Сколько последних строк хранить
+            max_days: Не хранить строки старше стольких дней от последней (0 - без ограничения)
+            save_interval: Как часто переписывать файл в секундах
+        """
+        self.recent_file = Path(recent_file)
+        self.history = HistoryLines(history_file, index_file)
+        self.max_lines = max_lines
+        self.max_days = max_days
+        self.save_interval = save_interval
+
+        self._lines: Optional[deque] = None
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    def _load(self, newest: datetime):
+        """Заполнение буфера последними строками history.txt (первая пачка уже в нём)"""
+        lines = self.history.tail(self.max_lines)
+        self._lines = deque(zip(_line_times(lines, newest), lines), maxlen=self.max_lines)
+
+    def _trim(self):
+        """Отбрасывание строк старше max_days от последней"""
+        if not self.max_days or not self._lines:
+            return
+        newest = next((ts for ts, _ in reversed(self._lines) if ts is not None), None)
+        if newest is None:
+            return
+        cutoff = newest - timedelta(days=self.max_days)
+        while self._lines and (self._lines[0][0] is None or self._lines[0][0] < cutoff):
+            self._lines.popleft()
+
+    def write_batch(self, records: List):
+        """
+        Добавление строк пачки в буфер
+
+        Args:
+            records: Записи журнала (HistoryRecord)
+        """
+        if self._lines is None:
+            self._load(records[-1].timestamp)
+        else:
+            self._lines.extend((record.timestamp, record.line.rstrip('\n')) for record in records)
+        self._trim()
+        self._dirty = True
+
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self.flush()
+
+    def flush(self):
+        """Перезапись history_recent.txt (перед запросом агента)"""
+        if not self._dirty:
+            return
+        write_recent(self.recent_file, [line for _, line in self._lines])
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    def close(self):
+        """Сохранение буфера перед остановкой"""
+        self.flush()
+
+
+def write_recent(recent_file: Path, lines: Iterable[str]):
+    """Атомарная запись history_recent.txt"""
+    tmp_file = Path(f"{recent_file}.tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.writelines(f"{line}\n" for line in lines)
+    os.replace(tmp_file, recent_file)
+
+
+def rebuild_recent(
+    history_file: Path,
+    index_file: Path,
+    recent_file: Path,
+    max_lines: int = RECENT_LINES,
+    max_days: int = RECENT_DAYS,
+) -> int:
+    """
+    Пересборка history_recent.txt по history.txt
+
+    Год последней строки берётся по времени изменения history.txt.
+
+    Returns:
+        Количество строк
+    """
+    window = RecentWindow(recent_file, history_file, index_file, max_lines, max_days)
+    window._load(datetime.fromtimestamp(Path(history_file).stat().st_mtime))
+    window._trim()
+    write_recent(recent_file, [line for _, line in window._lines])
+    return len(window._lines)
+
+
+def main(argv: List[str]) -> int:
+    """Точка входа командной строки: rebuild <chat_id>... | rebuild --all"""
+    import argparse
+    from archiver import ARCHIVE_BASE
+
+    parser = argparse.ArgumentParser(description="Индексы времени и строк history.txt")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = subparsers.add_parser('rebuild', help="пересобрать индексы и history_recent.txt по history.txt")
+    rebuild_parser.add_argument('chat_ids', nargs='*', type=int)
+    rebuild_parser.add_argument('--all', action='store_true', help="все чаты архива")
+    args = parser.parse_args(argv)
+
+    base = Path(ARCHIVE_BASE)
+    if args.all:
+        chat_dirs = sorted(p for p in base.glob('chat_*') if p.is_dir())
+    else:
+        chat_dirs = [base / f"chat_{chat_id}" for chat_id in args.chat_ids]
+
+    for chat_dir in chat_dirs:
+        history_file = chat_dir / "history.txt"
+        if not history_file.exists():
+            print(f"{chat_dir.name}: history.txt не найден, пропускаю")
+            continue
+
+        count = rebuild_time_index(history_file, chat_dir / TIME_INDEX_NAME)
+        lines = rebuild_line_index(history_file, chat_dir / LINE_INDEX_NAME)
+        recent = rebuild_recent(history_file, chat_dir / LINE_INDEX_NAME, chat_dir / RECENT_NAME)
+        print(f"{chat_dir.name}: {count} записей индекса времени, {lines} строк, {recent} в {RECENT_NAME}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,592 @@
+"""
+Модуль импорта выгрузки Telegram Desktop в архив чата
+Переносит историю из result.json (и файлы из папки выгрузки) в формат
+ChatArchiver: history.txt, events.jsonl, media/, сегменты и индексы.
+
+result.json читается потоково (по одному сообщению), строки пишутся пачками,
+файлы копируются параллельно через общее хранилище медиа. После каждой пачки
+сохраняется контрольная точка, поэтому прерванный импорт продолжается с того
+же места. Сообщения, уже попавшие в архив (по message_id), пропускаются,
+а импортированные строки встают в историю по точному времени из result.json.
+
+Этапы импорта (записываются в контрольную точку, завершённые при повторном
+запуске пропускаются): staging - разбор выгрузки в import/, staged - разбор
+закончен, history_merged - history.txt слит, events_merged - events.jsonl слит.
+
+Запускать при остановленном боте:
+    python src/importer.py <chat_id> <папка выгрузки> [--workers N]
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import shutil
+import codecs
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, List, Optional, Set, Tuple
+from cold_storage import archive_size, open_archive_file, remove_cold_prefix
+from event_log import EVENT_LOG_NAME, encode_event, iter_events
+from history_parser import iter_history_lines
+from media_layout import PHOTO_PREFIX, VOICE_PREFIX, VIDEO_NOTE_PREFIX, shard_subdir
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FILE_NAME = "result.json"
+IMPORT_DIR_NAME = "import"
+
+# Сообщений в одной пачке записи (после пачки сохраняется контрольная точка)
+IMPORT_BATCH = int(os.getenv('IMPORT_BATCH', 10000))
+
+# Параллельное копирование файлов выгрузки
+IMPORT_MEDIA_WORKERS = int(os.getenv('IMPORT_MEDIA_WORKERS', 8))
+
+READ_CHUNK = 1024 * 1024
+
+# Этапы импорта по порядку (см. описание модуля)
+IMPORT_PHASES = ('staging', 'staged', 'history_merged', 'events_merged')
+
+# Путь к media/ в строках истории (как у ChatArchiver)
+MEDIA_PATH_TEMPLATE = "/app/chat_archive/chat_{chat_id}/media/{subdir}/{filename}"
+
+# Файл не попал в выгрузку (Telegram Desktop пишет это вместо пути)
+MISSING_FILE_PREFIX = "(File not included"
+
+# Служебные действия выгрузки → (тип события, иконка)
+SERVICE_ACTIONS = {
+    'invite_members': ('user_joined', '👤'),
+    'join_group_by_link': ('user_joined', '👤'),
+    'join_group_by_request': ('user_joined', '👤'),
+    'remove_members': ('user_left', '👋'),
+    'edit_group_title': ('title_changed', '✏️'),
+    'edit_group_photo': ('photo_changed', '🖼️'),
+}
+
+
+def iter_export_messages(path: Path, start_offset: int = 0) -> Iterator[Tuple[dict, int]]:
+    """
+    Потоковое чтение массива messages из result.json
+
+    Файл читается кусками по READ_CHUNK, сообщения разбираются по одному
+    через JSONDecoder.raw_decode, поэтому память не зависит от размера выгрузки.
+
+    Args:
+        path: Путь к result.json
+        start_offset: Смещение в байтах сразу после последнего обработанного
+                      сообщения (из контрольной точки), 0 - с начала
+
+    Yields:
+        (сообщение, смещение в байтах сразу после него)
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+
+    with open(path, 'rb') as f:
+        f.seek(start_offset)
+        buffer = ''
+        # Позиция в buffer, до которой всё разобрано, и её смещение в файле
+        pos = 0
+        byte_pos = start_offset
+
+        def read_more() -> bool:
+            nonlocal buffer, pos
+            chunk = f.read(READ_CHUNK)
+            # Разобранная часть буфера отбрасывается только при чтении нового куска
+            buffer = buffer[pos:] + utf8.decode(chunk, final=not chunk)
+            pos = 0
+            return bool(chunk)
+
+        def consume(end: int):
+            nonlocal pos, byte_pos
+            byte_pos += len(buffer[pos:end].encode('utf-8'))
+            pos = end
+
+        # Начало массива сообщений
+        if start_offset == 0:
+            while True:
+                key = buffer.find('"messages"', pos)
+                bracket = buffer.find('[', key) if key >= 0 else -1
+                if bracket >= 0:
+                    consume(bracket + 1)
+                    break
+                if not read_more():
+                    raise ValueError(f"{path}: messages array not found")
+
+        while True:
+            # Пропуск разделителей между сообщениями
+            end = pos
+            while True:
+                while end < len(buffer) and buffer[end] in ' \t\r\n,':
+                    end += 1
+                if end < len(buffer):
+                    break
+                consume(end)
+                if not read_more():
+                    return
+                end = pos
+            consume(end)
+
+            if buffer[pos] == ']':
+                return
+
+            while True:
+                try:
+                    message, end = decoder.raw_decode(buffer, pos)
+                    break
+                except json.JSONDecodeError:
+                    if not read_more():
+                        raise
+
+            consume(end)
+            yield message, byte_pos
+
+
+def _export_text(value) -> str:
+    """Текст сообщения выгрузки (строка или список фрагментов с разметкой)"""
+    if isinstance(value, str):
+        return value
+    return ''.join(part if isinstance(part, str) else part.get('text', '') for part in value or [])
+
+
+def _export_user_id(value) -> Optional[int]:
+    """Числовой ID из from_id выгрузки ("user123" → 123)"""
+    if isinstance(value, int):
+        return value
+    digits = ''.join(ch for ch in str(value or '') if ch.isdigit())
+    return int(digits) if digits else None
+
+
+class ExportImporter:
+    """Импорт выгрузки Telegram Desktop в архив одного чата"""
+
+    def __init__(self, chat_id: int, export_dir: Path, archive_base: str, workers: int = IMPORT_MEDIA_WORKERS):
+        """
+        Args:
+            chat_id: ID чата в архиве
+            export_dir: Папка выгрузки (с result.json и файлами)
+            archive_base: Базовая директория архива
+            workers: Потоков копирования файлов
+        """
+        from media_store import get_media_store
+        from storage_quota import get_storage_quota
+
+        self.chat_id = chat_id
+        self.export_dir = Path(export_dir)
+        self.source = self.export_dir / EXPORT_FILE_NAME
+        self.chat_dir = Path(archive_base) / f"chat_{chat_id}"
+        self.media_dir = self.chat_dir / "media"
+        self.history_file = self.chat_dir / "history.txt"
+        self.events_file = self.chat_dir / EVENT_LOG_NAME
+
+        self.import_dir = self.chat_dir / IMPORT_DIR_NAME
+        self.staged_history = self.import_dir / "history.part"
+        self.staged_events = self.import_dir / "events.part"
+        self.checkpoint_file = self.import_dir / "checkpoint.json"
+        self.merged_history = Path(f"{self.history_file}.import.tmp")
+        self.merged_events = Path(f"{self.events_file}.import.tmp")
+
+        self.media_store = get_media_store(archive_base)
+        self.quota = get_storage_quota(archive_base)
+        self.workers = workers
+
+        self._known_ids: Set[int] = set()
+        self._media_names: Set[str] = set()
+
+    def _read_checkpoint(self) -> dict:
+        """Контрольная точка прерванного импорта этой же выгрузки"""
+        try:
+            with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            if checkpoint.get('source') == str(self.source):
+                return checkpoint
+        except (OSError, ValueError):
+            pass
+        return {
+            'source': str(self.source), 'phase': IMPORT_PHASES[0], 'offset': 0,
+            'history_bytes': 0, 'events_bytes': 0, 'messages': 0, 'skipped': 0, 'files': 0,
+        }
+
+    def _write_checkpoint(self, checkpoint: dict):
+        """Атомарное сохранение контрольной точки"""
+        tmp_file = self.checkpoint_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def _convert(self, message: dict, copies: List[Tuple[Path, Path]]) -> List[Tuple[datetime, str, dict]]:
+        """
+        Строки истории и события для одного сообщения выгрузки
+
+        Args:
+            message: Сообщение из result.json
+            copies: Сюда добавляются пары (файл выгрузки, путь в media/) для копирования
+
+        Returns:
+            Список (время, строка, событие)
+        """
+        timestamp = datetime.fromisoformat(message['date'])
+        display = timestamp.strftime("[%d.%m %H:%M]")
+        meta = {
+            'message_id': message.get('id'),
+            'reply_to': message.get('reply_to_message_id'),
+            'sender_id': _export_user_id(message.get('from_id') or message.get('actor_id')),
+        }
+
+        if message.get('type') == 'service':
+            actor = message.get('actor') or 'Unknown'
+            action = message.get('action', '')
+            event_type, icon = SERVICE_ACTIONS.get(action, (action or 'service', '📌'))
+            if event_type == 'user_joined':
+                details = [f"{member} присоединился" for member in message.get('members') or [actor]]
+            elif event_type == 'user_left':
+                details = [f"{member} покинул чат" for member in message.get('members') or [actor]]
+            elif event_type == 'title_changed':
+                details = [f"Название изменено: {message.get('title', '')}"]
+            elif event_type == 'photo_changed':
+                details = ["Фото чата изменено"]
+            else:
+                details = [f"{actor}: {action}"]
+            return [
+                (timestamp, f"{display} {icon} {text}\n", {'kind': 'system', 'event_type': event_type, 'text': text, **meta})
+                for text in details
+            ]
+
+        sender = message.get('from') or 'Unknown'
+        entries = []
+
+        media = self._media(message, timestamp)
+        if media is not None:
+            kind, icon, source, filename = media
+            if source.startswith(MISSING_FILE_PREFIX) or not (self.export_dir / source).is_file():
+                text = f"[{icon} {filename} - файл не включён в выгрузку]"
+                entries.append((timestamp, f"{display} {sender}: {text}\n", {'kind': 'text', 'sender': sender, 'text': text, **meta}))
+            else:
+                subdir = shard_subdir(timestamp)
+                full_path = MEDIA_PATH_TEMPLATE.format(chat_id=self.chat_id, subdir=subdir, filename=filename)
+                copies.append((self.export_dir / source, self.media_dir / subdir / filename))
+                entries.append((
+                    timestamp,
+                    f"{display} {sender} отправил файл {icon} {filename} - полный путь {full_path}\n",
+                    {'kind': kind, 'sender': sender, 'text': filename, 'media_path': full_path, **meta},
+                ))
+
+        text = _export_text(message.get('text'))
+        if text:
+            entries.append((
+                timestamp,
+                f"{display} {sender}: {text.replace(chr(10), ' ')}\n",
+                {'kind': 'text', 'sender': sender, 'text': text, **meta},
+            ))
+        return entries
+
+    def _media(self, message: dict, timestamp: datetime) -> Optional[Tuple[str, str, str, str]]:
+        """Файл сообщения: (тип события, иконка, путь в выгрузке, имя в media/) или None"""
+        stamp = timestamp.strftime("%Y%m%d_%H%M%S")
+        message_id = message.get('id')
+
+        if message.get('photo'):
+            return 'photo', '📷', message['photo'], f"{PHOTO_PREFIX}{stamp}_{message_id}.jpg"
+
+        source = message.get('file')
+        if not source:
+            return None
+
+        media_type = message.get('media_type')
+        if media_type == 'voice_message':
+            return 'voice', '🎤', source, f"{VOICE_PREFIX}{stamp}_{message_id}.ogg"
+        if media_type == 'video_message':
+            return 'video_note', '🎥', source, f"{VIDEO_NOTE_PREFIX}{stamp}_{message_id}.mp4"
+
+        # Документы сохраняются с оригинальным именем, при совпадении - с ID сообщения
+        filename = message.get('file_name') or Path(source).name
+        if source.startswith(MISSING_FILE_PREFIX) and not message.get('file_name'):
+            filename = f"document_{stamp}"
+        if filename in self._media_names:
+            stem, dot, suffix = filename.rpartition('.')
+            filename = f"{stem}_{message_id}.{suffix}" if dot else f"{filename}_{message_id}"
+        self._media_names.add(filename)
+        return 'document', '📄', source, filename
+
+    def _copy(self, source: Path, destination: Path) -> bool:
+        """Копирование файла выгрузки через хранилище (повтор после сбоя пропускается)"""
+        if destination.exists():
+            return False
+        self.media_store.import_file(source, destination)
+        self.quota.record(self.chat_id, 'media', destination)
+        return True
+
+    def _set_phase(self, checkpoint: dict, phase: str):
+        """Отметка завершённого этапа в контрольной точке"""
+        checkpoint['phase'] = phase
+        self._write_checkpoint(checkpoint)
+
+    def _stage(self, checkpoint: dict):
+        """
+        Потоковый разбор выгрузки в промежуточные файлы import/ с контрольными точками
+
+        Строки history.part и события events.part идут парами (строка на событие),
+        поэтому время каждой строки берётся точно из события.
+        """
+
+        # Промежуточные файлы обрезаются до последней контрольной точки
+        for path, size in ((self.staged_history, checkpoint['history_bytes']),
+                           (self.staged_events, checkpoint['events_bytes'])):
+            with open(path, 'ab') as f:
+                f.truncate(size)
+
+        if checkpoint['offset']:
+            logger.info(f"[IMPORT] Resuming {self.source} from byte {checkpoint['offset']}")
+
+        history_out = open(self.staged_history, 'ab')
+        events_out = open(self.staged_events, 'ab')
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='import')
+        started = time.monotonic()
+
+        def flush_batch(lines: List[bytes], events: List[bytes], copies: List[Tuple[Path, Path]], offset: int):
+            # Файлы пачки копируются до сохранения контрольной точки
+            checkpoint['files'] += sum(executor.map(lambda pair: self._copy(*pair), copies))
+            history_out.write(b''.join(lines))
+            events_out.write(b''.join(events))
+            history_out.flush()
+            events_out.flush()
+            os.fsync(history_out.fileno())
+            os.fsync(events_out.fileno())
+            checkpoint['offset'] = offset
+            checkpoint['history_bytes'] = history_out.tell()
+            checkpoint['events_bytes'] = events_out.tell()
+            self._write_checkpoint(checkpoint)
+
+        try:
+            lines, events, copies = [], [], []
+            pending = 0
+            offset = checkpoint['offset']
+            for message, offset in iter_export_messages(self.source, checkpoint['offset']):
+                pending += 1
+                if message.get('id') in self._known_ids or 'date' not in message:
+                    checkpoint['skipped'] += 1
+                else:
+                    for timestamp, line, event in self._convert(message, copies):
+                        lines.append(line.encode('utf-8'))
+                        events.append(encode_event(self.chat_id, timestamp, event))
+                    checkpoint['messages'] += 1
+
+                if pending >= IMPORT_BATCH:
+                    flush_batch(lines, events, copies, offset)
+                    lines, events, copies = [], [], []
+                    pending = 0
+                    elapsed = time.monotonic() - started
+                    logger.info(
+                        f"[IMPORT] {checkpoint['messages']} messages, {checkpoint['files']} files "
+                        f"({checkpoint['messages'] / elapsed:.0f} msg/s)"
+                    )
+
+            flush_batch(lines, events, copies, offset)
+        finally:
+            executor.shutdown(wait=True)
+            history_out.close()
+            events_out.close()
+
+        self._set_phase(checkpoint, 'staged')
+
+    def _iter_staged(self) -> Iterator[Tuple[datetime, dict, str]]:
+        """Строки history.part с точным временем и полями из парного события events.part"""
+        with open(self.staged_history, 'rb') as lines, open(self.staged_events, 'rb') as events:
+            for raw_line, raw_event in zip(lines, events):
+                event = json.loads(raw_event)
+                yield datetime.fromisoformat(event.pop('ts')), event, raw_line.decode('utf-8')
+
+    def _merge_history(self, end_year: Optional[int]):
+        """
+        Слияние импортированных и уже архивированных строк history.txt по времени в merged_history
+
+        Импортированные строки встают по точному времени из result.json; у строк
+        архива год восстанавливается от года последнего события events.jsonl,
+        строки без времени (продолжения, невозможная дата) идут следом за
+        предыдущей и не теряются. Оглавление по месяцам, FTS-индекс, индексы
+        времени и строк строятся заново по ходу записи.
+
+        Args:
+            end_year: Год последней строки history.txt (None - по времени изменения файла)
+        """
+        from journal import HistoryRecord
+        from segments import SegmentStore
+        from search_index import SearchIndex, INDEX_NAME
+        from history_reader import SparseTimeIndex, LineIndex, TIME_INDEX_NAME, LINE_INDEX_NAME
+
+        staged = ((timestamp, 0, event, line) for timestamp, event, line in self._iter_staged())
+        live = ()
+        if archive_size(self.history_file):
+            live = (
+                (timestamp, 1, event or {}, line)
+                for timestamp, event, line in iter_history_lines(self.history_file, end_year)
+            )
+
+        segments_dir = self.chat_dir / "history"
+        segments_dir.mkdir(exist_ok=True)
+        for path in segments_dir.iterdir():
+            if path.is_file():
+                path.unlink()
+        for name in (INDEX_NAME, f"{INDEX_NAME}-wal", f"{INDEX_NAME}-shm", TIME_INDEX_NAME, LINE_INDEX_NAME):
+            (self.chat_dir / name).unlink(missing_ok=True)
+
+        tmp_file = self.merged_history
+        sinks = [
+            SegmentStore(segments_dir, tmp_file), SearchIndex(self.chat_dir / INDEX_NAME),
+            SparseTimeIndex(self.chat_dir / TIME_INDEX_NAME, tmp_file),
+            LineIndex(self.chat_dir / LINE_INDEX_NAME, tmp_file),
+        ]
+
+        def write(batch: List[HistoryRecord]):
+            out.write(b''.join(record.line.encode('utf-8') for record in batch))
+            out.flush()
+            for sink in sinks:
+                sink.write_batch(batch)
+
+        offset = 0
+        with open(tmp_file, 'wb') as out:
+            batch = []
+            for timestamp, _, event, line in heapq.merge(staged, live, key=lambda item: (item[0], item[1])):
+                record = HistoryRecord(timestamp, line, event)
+                record.offset = offset
+                offset += len(line.encode('utf-8'))
+                batch.append(record)
+                if len(batch) >= IMPORT_BATCH:
+                    write(batch)
+                    batch = []
+            if batch:
+                write(batch)
+            os.fsync(out.fileno())
+
+        for sink in sinks:
+            sink.close()
+
+    def _merge_events(self):
+        """Слияние импортированных и уже архивированных событий events.jsonl по времени в merged_events"""
+        def with_ts(path: Path, order: int):
+            with open_archive_file(path) as f:
+                for raw in f:
+                    line = raw.decode('utf-8')
+                    # Время - первое поле события: {"ts":"..."
+                    yield line[7:line.find('"', 7)], order, line
+
+        sources = [with_ts(self.staged_events, 0)]
+        if self.events_file.exists():
+            sources.append(with_ts(self.events_file, 1))
+
+        with open(self.merged_events, 'w', encoding='utf-8', newline='') as out:
+            out.writelines(line for _, _, line in heapq.merge(*sources, key=lambda item: (item[0], item[1])))
+            out.flush()
+            os.fsync(out.fileno())
+
+    def _install(self, merged: Path, target: Path):
+        """
+        Замена файла архива слитым (повторный вызов после сбоя безопасен)
+
+        Сжатое начало старого файла удаляется: слитый файл содержит всю историю.
+        """
+        if merged.exists():
+            os.replace(merged, target)
+        remove_cold_prefix(target)
+
+    def _rebuild_stats(self):
+        """Пересчёт сводок активности с учётом импортированных событий"""
+        from chat_stats import rebuild_stats, STATS_NAME
+
+        rebuild_stats(self.events_file, self.chat_dir / STATS_NAME)
+
+    def _rebuild_export(self):
+        """Выгрузка Parquet заново: смещения в events.jsonl изменились"""
+        from columnar_export import ParquetExporter, EXPORT_DIR_NAME
+
+        export_dir = self.chat_dir / EXPORT_DIR_NAME
+        shutil.rmtree(export_dir, ignore_errors=True)
+        ParquetExporter(self.events_file, export_dir).export()
+
+    def run(self) -> dict:
+        """
+        Импорт выгрузки целиком (или продолжение прерванного)
+
+        Returns:
+            Итоги: messages, skipped, files, seconds
+        """
+        from history_reader import LINE_INDEX_NAME, RECENT_NAME, rebuild_recent
+
+        started = time.monotonic()
+        for name in ("media", "agent_files", "history"):
+            (self.chat_dir / name).mkdir(parents=True, exist_ok=True)
+        self.import_dir.mkdir(parents=True, exist_ok=True)
+
+        checkpoint = self._read_checkpoint()
+        done = IMPORT_PHASES.index(checkpoint.get('phase', IMPORT_PHASES[0]))
+        if done:
+            logger.info(f"[IMPORT] Resuming {self.source} after phase {checkpoint['phase']}")
+
+        if done < IMPORT_PHASES.index('history_merged'):
+            # Сообщения, уже попавшие в архив (бот был в чате), не импортируются повторно;
+            # год последнего события - опора для года строк history.txt
+            last_event = None
+            for event in iter_events(self.events_file):
+                if event.message_id is not None:
+                    self._known_ids.add(event.message_id)
+                last_event = event.ts
+
+            if done < IMPORT_PHASES.index('staged'):
+                self._media_names = {path.name for path in self.media_dir.rglob('*') if not path.is_dir()}
+                self._stage(checkpoint)
+            logger.info(f"[IMPORT] Staged {checkpoint['messages']} messages, merging into {self.chat_dir}")
+
+            self._merge_history(last_event.year if last_event else None)
+            # Этап отмечается до замены: повторный запуск только доделает замену
+            self._set_phase(checkpoint, 'history_merged')
+        self._install(self.merged_history, self.history_file)
+        rebuild_recent(self.history_file, self.chat_dir / LINE_INDEX_NAME, self.chat_dir / RECENT_NAME)
+
+        if done < IMPORT_PHASES.index('events_merged'):
+            self._merge_events()
+            self._set_phase(checkpoint, 'events_merged')
+        self._install(self.merged_events, self.events_file)
+
+        self._rebuild_stats()
+        self._rebuild_export()
+        shutil.rmtree(self.import_dir)
+
+        return {
+            'messages': checkpoint['messages'],
+            'skipped': checkpoint['skipped'],
+            'files': checkpoint['files'],
+            'seconds': time.monotonic() - started,
+        }
+
+
+def main(argv: List[str]) -> int:
+    """Точка входа командной строки: <chat_id> <папка выгрузки>"""
+    import argparse
+    from archiver import ARCHIVE_BASE
+
+    parser = argparse.ArgumentParser(description="Импорт выгрузки Telegram Desktop (result.json) в архив")
+    parser.add_argument('chat_id', type=int)
+    parser.add_argument('export_dir', type=Path)
+    parser.add_argument('--workers', type=int, default=IMPORT_MEDIA_WORKERS, help="потоков копирования файлов")
+    args = parser.parse_args(argv)
+
+    if not (args.export_dir / EXPORT_FILE_NAME).exists():
+        print(f"{args.export_dir / EXPORT_FILE_NAME} не найден")
+        return 1
+
+    result = ExportImporter(args.chat_id, args.export_dir, ARCHIVE_BASE, workers=args.workers).run()
+    rate = result['messages'] / result['seconds'] if result['seconds'] > 0 else result['messages']
+    print(
+        f"chat_{args.chat_id}: импортировано {result['messages']} сообщений "
+        f"(пропущено {result['skipped']}), файлов {result['files']} "
+        f"за {result['seconds']:.1f} с ({rate:.0f} сообщений/с)"
+    )
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
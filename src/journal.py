@@ -0,0 +1,268 @@
+"""
+Модуль буферизованной записи истории (write-behind журнал)
+Группирует строки history.txt в памяти и сбрасывает их на диск пачками
+"""
+
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+from archive_io import ArchiveWriter, get_writer, in_event_loop
+from cold_storage import prefix_base
+
+logger = logging.getLogger(__name__)
+
+# Максимальная задержка записи строки на диск в секундах (0 = писать сразу)
+JOURNAL_FLUSH_INTERVAL = float(os.getenv('JOURNAL_FLUSH_INTERVAL', 1.0))
+
+# Максимальный размер пачки: при достижении буфер сбрасывается немедленно
+JOURNAL_MAX_BATCH = int(os.getenv('JOURNAL_MAX_BATCH', 100))
+
+# fsync после каждой пачки (надёжнее, но медленнее на сетевых томах)
+JOURNAL_FSYNC = os.getenv('JOURNAL_FSYNC', '0') == '1'
+
+
+class HistoryRecord:
+    """Строка истории вместе со временем и структурой события"""
+
+    __slots__ = ('timestamp', 'line', 'event', 'offset')
+
+    def __init__(self, timestamp: datetime, line: str, event: Optional[dict] = None):
+        self.timestamp = timestamp
+        self.line = line
+        # kind, sender, text, media_path - для индексов поверх истории
+        self.event = event or {}
+        # Смещение строки в полной истории в байтах (заполняется при записи)
+        self.offset = None
+
+
+class HistoryJournal:
+    """Журнал дозаписи в history.txt с групповым сбросом на диск"""
+
+    def __init__(
+        self,
+        path: Path,
+        chat_id: int,
+        flush_interval: float = JOURNAL_FLUSH_INTERVAL,
+        max_batch: int = JOURNAL_MAX_BATCH,
+        fsync: bool = JOURNAL_FSYNC,
+        writer: Optional[ArchiveWriter] = None,
+        sinks: Optional[list] = None,
+    ):
+        """
+        Инициализация журнала
+
+        Args:
+            path: Путь к файлу истории
+            chat_id: ID чата (пачки чата пишутся одним потоком строго по порядку)
+            flush_interval: Задержка перед сбросом буфера в секундах
+            max_batch: Количество строк, при котором буфер сбрасывается сразу
+            fsync: Вызывать fsync после записи пачки
+            writer: Пул записи (по умолчанию общий)
+            sinks: Дополнительные хранилища, получающие каждую записанную пачку
+                (объекты с методами write_batch(records), close() и необязательным flush())
+        """
+        self.path = Path(path)
+        self.chat_id = chat_id
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.fsync = fsync
+        self.writer = writer or get_writer()
+        self.sinks = list(sinks or [])
+
+        self._buffer: List[HistoryRecord] = []
+        self._buffer_lock = threading.Lock()
+        self._flush_handle = None
+
+        # Строки из пачки, запись которой не удалась (допишутся следующей пачкой)
+        self._failed: List[HistoryRecord] = []
+
+        # Размер сжатого начала истории для текущего файла (inode, base)
+        self._prefix = (None, 0)
+
+    @property
+    def pending(self) -> int:
+        """Количество строк, ещё не переданных на запись"""
+        return len(self._buffer)
+
+    def append(self, line: str, timestamp: Optional[datetime] = None, event: Optional[dict] = None):
+        """
+        Добавление строки в буфер
+
+        Порядок строк сохраняется: буфер забирается целиком, а пачки одного
+        чата записываются одним потоком в порядке постановки.
+
+        Args:
+            line: Строка истории (с переводом строки в конце)
+            timestamp: Время события (по умолчанию текущее)
+            event: Структура события (kind, sender, text, media_path)
+        """
+        record = HistoryRecord(timestamp or datetime.now(), line, event)
+        with self._buffer_lock:
+            self._buffer.append(record)
+            size = len(self._buffer)
+
+        if not in_event_loop():
+            # Вне event loop (скрипты, тесты) таймера нет - пишем сразу
+            self.flush().result()
+            return
+
+        if size >= self.max_batch or self.flush_interval <= 0:
+            self.flush()
+            return
+
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self, flush_sinks: bool = False) -> Future:
+        """
+        Передача буфера в поток записи одной пачкой (без ожидания)
+
+        Args:
+            flush_sinks: После записи пачки сбросить и отложенную работу хранилищ
+
+        Returns:
+            Future с количеством записанных строк
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        with self._buffer_lock:
+            batch = self._buffer
+            self._buffer = []
+
+        return self.writer.submit(self.chat_id, self._write_batch, batch, flush_sinks)
+
+    async def aflush(self) -> int:
+        """
+        Сброс буфера с ожиданием записи на диск
+
+        Returns:
+            Количество записанных строк
+        """
+        return await asyncio.wrap_future(self.flush(flush_sinks=True))
+
+    def _write_batch(self, batch: List[HistoryRecord], flush_sinks: bool = False) -> int:
+        """
+        Запись пачки строк одной операцией (выполняется в потоке записи)
+
+        Args:
+            batch: Записи для сохранения
+            flush_sinks: Вызвать flush() у хранилищ, которые откладывают работу
+
+        Returns:
+            Количество записанных строк
+        """
+        records = self._failed + batch
+        if not records:
+            if flush_sinks:
+                self._flush_sinks()
+            return 0
+
+        chunks = [record.line.encode('utf-8') for record in records]
+        start = None
+
+        try:
+            with open(self.path, 'ab') as f:
+                # В режиме дозаписи позиция сразу стоит в конце файла
+                start = f.tell()
+                offset = self._base(f) + start
+                for record, chunk in zip(records, chunks):
+                    record.offset = offset
+                    offset += len(chunk)
+
+                f.write(b''.join(chunks))
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+        except OSError as e:
+            # Сохраняем строки, чтобы дописать их перед следующей пачкой
+            self._failed = records
+            logger.error(f"[JOURNAL] Error writing {len(records)} lines to {self.path}: {e}")
+            if start is not None:
+                self._truncate(start)
+            raise
+
+        self._failed = []
+
+        # history.txt - источник истины, ошибки дополнительных хранилищ только логируем
+        # (индексы строк и времени досчитывают пропущенную пачку по history.txt)
+        for sink in self.sinks:
+            try:
+                sink.write_batch(records)
+            except Exception as e:
+                logger.error(f"[JOURNAL] Sink {type(sink).__name__} failed for chat_id={self.chat_id}: {e}")
+
+        if flush_sinks:
+            self._flush_sinks()
+
+        logger.debug(f"[JOURNAL] Flushed {len(records)} lines to {self.path}")
+        return len(records)
+
+    def _base(self, f) -> int:
+        """Смещение начала открытого файла в полной истории (после сжатия начала файл заменяется)"""
+        inode = os.fstat(f.fileno()).st_ino
+        if self._prefix[0] != inode:
+            self._prefix = (inode, prefix_base(self.path, inode))
+        return self._prefix[1]
+
+    def _truncate(self, size: int):
+        """
+        Откат частично записанной пачки (ENOSPC, EIO), чтобы повтор не задвоил строки
+
+        Args:
+            size: Размер файла до записи пачки
+        """
+        try:
+            if os.path.getsize(self.path) > size:
+                os.truncate(self.path, size)
+                logger.warning(f"[JOURNAL] Rolled {self.path} back to {size} bytes after failed write")
+        except OSError as e:
+            logger.error(f"[JOURNAL] Error rolling back {self.path} to {size} bytes: {e}")
+
+    def _flush_sinks(self):
+        """Сброс отложенной работы хранилищ (у которых есть метод flush)"""
+        for sink in self.sinks:
+            flush = getattr(sink, 'flush', None)
+            if flush is None:
+                continue
+            try:
+                flush()
+            except Exception as e:
+                logger.error(f"[JOURNAL] Sink {type(sink).__name__} flush failed for chat_id={self.chat_id}: {e}")
+
+    def _close_sinks(self):
+        """Закрытие хранилищ (выполняется в потоке записи после последней пачки)"""
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                logger.error(f"[JOURNAL] Error closing sink {type(sink).__name__}: {e}")
+
+    def release(self) -> Future:
+        """
+        Сброс оставшихся строк и закрытие хранилищ без ожидания
+
+        Задачи встают в очередь потока записи чата, поэтому новый журнал того же
+        чата, созданный сразу после, начнёт писать только после закрытия этого.
+
+        Returns:
+            Future, завершающийся после закрытия хранилищ
+        """
+        self.flush()
+        return self.writer.submit(self.chat_id, self._close_sinks)
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Сброс оставшихся строк перед остановкой с ожиданием записи
+
+        Args:
+            timeout: Максимальное время ожидания в секундах
+        """
+        self.release().result(timeout=timeout)
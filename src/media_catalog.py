@@ -0,0 +1,216 @@
+"""
+Модуль каталога файлов чата для инструментов агента
+Список файлов media/ с типом, размером и датой и краткая сводка таблиц
+(Excel/CSV) - без запуска Glob/Bash и без вывода файла целиком в контекст
+"""
+
+import os
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import List
+from cold_storage import GZ_SUFFIX, FRAME_INDEX_SUFFIX, open_archive_file
+from media_layout import (
+    NAME_TIME_PATTERN, MEDIA_DIR_NAME, PHOTO_PREFIX, VOICE_PREFIX, VIDEO_NOTE_PREFIX, resolve_media_path,
+)
+
+try:
+    import pandas as pd
+except ImportError:
+    pd = None
+
+logger = logging.getLogger(__name__)
+
+# Тип файла по префиксу имени (остальное - документы)
+KIND_PREFIXES = (
+    (PHOTO_PREFIX, 'photo'),
+    (VOICE_PREFIX, 'voice'),
+    (VIDEO_NOTE_PREFIX, 'video_note'),
+)
+
+SPREADSHEET_EXTENSIONS = {'.xlsx', '.xls', '.csv', '.tsv'}
+
+# Ограничения сводки таблицы: листов, столбцов, строк примера, длины значения
+MAX_SHEETS = 10
+MAX_SUMMARY_COLUMNS = 40
+MAX_SAMPLE_ROWS = 20
+MAX_CELL_CHARS = 40
+
+
+def media_kind(name: str) -> str:
+    """Тип файла по имени: photo, voice, video_note или document"""
+    for prefix, kind in KIND_PREFIXES:
+        if name.startswith(prefix):
+            return kind
+    return 'document'
+
+
+def _entry_time(name: str, mtime: float) -> datetime:
+    """Время получения файла: из имени, иначе время изменения"""
+    match = NAME_TIME_PATTERN.search(name)
+    if match:
+        try:
+            return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(mtime)
+
+
+def _month_dirs(media_dir: Path, month: str) -> List[Path]:
+    """Папки месяцев media/YYYY/MM, от новых к старым (month - только YYYY-MM)"""
+    if month:
+        year, _, mon = month.partition('-')
+        path = media_dir / year / mon
+        return [path] if path.is_dir() else []
+
+    dirs = []
+    for year in sorted((p for p in media_dir.iterdir() if p.is_dir() and p.name.isdigit()), reverse=True):
+        dirs.extend(sorted((p for p in year.iterdir() if p.is_dir()), reverse=True))
+    return dirs
+
+
+def list_media(media_dir: Path, kind: str = '', name: str = '', month: str = '', limit: int = 50) -> dict:
+    """
+    Файлы media/ чата с типом, размером и датой, от новых к старым
+
+    Args:
+        media_dir: Директория media/ чата
+        kind: Фильтр по типу (photo, document, voice, video_note)
+        name: Фильтр по части имени (без учёта регистра)
+        month: Фильтр по месяцу YYYY-MM
+        limit: Сколько файлов вернуть
+
+    Returns:
+        Словарь: total (подходящих файлов), total_bytes, files - список словарей
+        name, path, kind, size, time, compressed
+    """
+    media_dir = Path(media_dir)
+    if not media_dir.exists():
+        return {'total': 0, 'total_bytes': 0, 'files': []}
+
+    # Файлы старой плоской раскладки лежат прямо в media/
+    dirs = _month_dirs(media_dir, month) + [media_dir]
+    needle = name.lower()
+    matched = []
+    for directory in dirs:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if not entry.is_file() or entry.name.endswith((FRAME_INDEX_SUFFIX, '.tmp')):
+                    continue
+                compressed = entry.name.endswith(GZ_SUFFIX)
+                original = entry.name[:-len(GZ_SUFFIX)] if compressed else entry.name
+                if kind and media_kind(original) != kind:
+                    continue
+                if needle and needle not in original.lower():
+                    continue
+                stat = entry.stat()
+                when = _entry_time(original, stat.st_mtime)
+                if month and directory == media_dir and when.strftime("%Y-%m") != month:
+                    continue
+                matched.append({
+                    'name': original,
+                    'path': str(Path(directory) / original),
+                    'kind': media_kind(original),
+                    'size': stat.st_size,
+                    'time': when,
+                    'compressed': compressed,
+                })
+
+    matched.sort(key=lambda item: item['time'], reverse=True)
+    return {
+        'total': len(matched),
+        'total_bytes': sum(item['size'] for item in matched),
+        'files': matched[:limit],
+    }
+
+
+def resolve_chat_file(chat_dir: Path, path: str) -> Path:
+    """
+    Путь файла внутри папки чата (старые пути media/ - через таблицу переноса)
+
+    Args:
+        chat_dir: Директория чата
+        path: Путь из истории, ответа list_media или имя файла в media/
+
+    Returns:
+        Путь к файлу
+
+    Raises:
+        ValueError: Путь ведёт за пределы папки чата
+    """
+    chat_dir = Path(chat_dir).resolve()
+    candidate = Path(path)
+    if not candidate.is_absolute():
+        candidate = chat_dir / MEDIA_DIR_NAME / candidate
+    elif chat_dir not in candidate.parents and f"/{chat_dir.name}/" in str(candidate):
+        # Путь из истории (/app/chat_archive/chat_{id}/...) при другом корне архива
+        candidate = chat_dir / str(candidate).split(f"/{chat_dir.name}/", 1)[1]
+    resolved = Path(resolve_media_path(str(candidate))).resolve()
+    if chat_dir not in resolved.parents:
+        raise ValueError(f"файл вне папки чата: {path}")
+    return resolved
+
+
+def _read_frames(path: Path, sheet: str) -> dict:
+    """Чтение таблицы: {имя листа: DataFrame}"""
+    suffix = path.suffix.lower()
+    with open_archive_file(path, 'rb') as f:
+        if suffix in ('.csv', '.tsv'):
+            return {path.name: pd.read_csv(f, sep='\t' if suffix == '.tsv' else ',')}
+        if sheet:
+            return {sheet: pd.read_excel(f, sheet_name=sheet)}
+        return pd.read_excel(f, sheet_name=None)
+
+
+def _cell(value) -> str:
+    text = str(value)
+    return text if len(text) <= MAX_CELL_CHARS else text[:MAX_CELL_CHARS - 1] + '…'
+
+
+def summarize_spreadsheet(path: Path, sheet: str = '', rows: int = 5) -> str:
+    """
+    Краткая сводка таблицы: листы, размер, столбцы с типами, числовые итоги, первые строки
+
+    Args:
+        path: Путь к .xlsx/.xls/.csv/.tsv (или сжатой копии .gz рядом)
+        sheet: Имя листа (по умолчанию все листы)
+        rows: Сколько первых строк показать
+
+    Returns:
+        Текст сводки
+    """
+    if pd is None:
+        return "pandas не установлен - сводка таблиц недоступна, используй Read."
+
+    path = Path(path)
+    if path.suffix == GZ_SUFFIX:
+        # Сжатая копия читается через исходное имя
+        path = path.with_suffix('')
+    if path.suffix.lower() not in SPREADSHEET_EXTENSIONS:
+        return f"{path.name}: не таблица (поддерживаются {', '.join(sorted(SPREADSHEET_EXTENSIONS))})."
+
+    frames = _read_frames(path, sheet)
+    rows = min(max(rows, 0), MAX_SAMPLE_ROWS)
+    lines = [f"{path.name}: листов {len(frames)}"]
+    for name, df in list(frames.items())[:MAX_SHEETS]:
+        lines.append("")
+        lines.append(f"Лист «{name}»: {len(df)} строк × {len(df.columns)} столбцов")
+        for column in list(df.columns)[:MAX_SUMMARY_COLUMNS]:
+            series = df[column]
+            info = f"• {_cell(column)} ({series.dtype}, заполнено {int(series.notna().sum())})"
+            numeric = pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+            if numeric and series.notna().any():
+                info += (
+                    f": min {series.min():g}, max {series.max():g}, "
+                    f"сумма {series.sum():g}, среднее {series.mean():g}"
+                )
+            lines.append(info)
+        if len(df.columns) > MAX_SUMMARY_COLUMNS:
+            lines.append(f"… ещё {len(df.columns) - MAX_SUMMARY_COLUMNS} столбцов")
+        if rows and len(df):
+            lines.append(f"Первые {min(rows, len(df))} строк:")
+            for _, row in df.head(rows).iterrows():
+                lines.append(" | ".join(_cell(value) for value in list(row.values)[:MAX_SUMMARY_COLUMNS]))
+    if len(frames) > MAX_SHEETS:
+        lines.append(f"\n… ещё {len(frames) - MAX_SHEETS} листов, укажи sheet")
+    return '\n'.join(lines)
@@ -0,0 +1,131 @@
+"""
+Модуль сборки альбомов (media group)
+Альбом приходит отдельными апдейтами с общим media_group_id; части
+собираются в течение короткого окна и обрабатываются вместе: файлы
+скачиваются параллельно, в историю пишется одна группа строк, а упоминание
+бота в подписи альбома даёт один запрос к агенту
+"""
+
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать следующую часть альбома (секунды с последней пришедшей части)
+MEDIA_GROUP_WINDOW = float(os.getenv('MEDIA_GROUP_WINDOW', 1.0))
+
+# Больше частей в альбоме Telegram не бывает - такой альбом обрабатывается сразу
+MEDIA_GROUP_MAX_PARTS = 10
+
+
+class AlbumPart:
+    """Файл альбома: куда сохраняется и скачан ли уже (для повторов)"""
+
+    __slots__ = ('message', 'kind', 'icon', 'file', 'filename', 'filepath', 'full_path', 'saved')
+
+    def __init__(self, message, kind: str, icon: str, file, filename: str, filepath, full_path: str):
+        self.message = message
+        self.kind = kind
+        self.icon = icon
+        self.file = file
+        self.filename = filename
+        self.filepath = filepath
+        self.full_path = full_path
+        self.saved = False
+
+
+class MediaGroupCollector:
+    """Сборка частей альбомов по (chat_id, media_group_id)"""
+
+    def __init__(self, handler: Callable[[List], Awaitable], window: float = MEDIA_GROUP_WINDOW):
+        """
+        Args:
+            handler: Обработчик собранного альбома (получает сообщения по порядку message_id)
+            window: Ожидание следующей части в секундах
+        """
+        self.handler = handler
+        self.window = window
+
+        self._groups: Dict[Tuple[int, str], List] = {}
+        self._timers: Dict[Tuple[int, str], asyncio.TimerHandle] = {}
+        self._tasks = set()
+
+        # Метрики
+        self.albums = 0
+        self.parts = 0
+
+    def add(self, message):
+        """
+        Добавление части альбома (обработка - после окна без новых частей)
+
+        Args:
+            message: Сообщение с media_group_id
+        """
+        key = (message.chat.id, message.media_group_id)
+        parts = self._groups.setdefault(key, [])
+        parts.append(message)
+
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+
+        if len(parts) >= MEDIA_GROUP_MAX_PARTS:
+            self._dispatch(key)
+        else:
+            self._timers[key] = asyncio.get_running_loop().call_later(self.window, self._dispatch, key)
+
+    def _dispatch(self, key: Tuple[int, str]):
+        """Передача собранного альбома обработчику"""
+        self._timers.pop(key, None)
+        parts = self._groups.pop(key, None)
+        if not parts:
+            return
+
+        parts.sort(key=lambda message: message.message_id)
+        self.albums += 1
+        self.parts += len(parts)
+        task = asyncio.create_task(self._run(key, parts))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Tuple[int, str], parts: List):
+        try:
+            await self.handler(parts)
+        except Exception as e:
+            logger.error(f"[MEDIA_GROUP] Album {key[1]} in chat_id={key[0]} failed: {e}", exc_info=True)
+
+    def pending(self) -> int:
+        """Количество альбомов, ожидающих остальных частей"""
+        return len(self._groups)
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Метрики сборки
+
+        Returns:
+            Словарь: albums, parts, avg_parts, pending
+        """
+        return {
+            'albums': self.albums,
+            'parts': self.parts,
+            'avg_parts': round(self.parts / self.albums, 1) if self.albums else 0.0,
+            'pending': self.pending(),
+        }
+
+    async def drain(self, timeout: Optional[float] = 30.0):
+        """
+        Обработка недособранных альбомов и ожидание обработчиков (при остановке)
+
+        Args:
+            timeout: Максимальное время ожидания в секундах
+        """
+        for key in list(self._groups):
+            self._dispatch(key)
+        if not self._tasks:
+            return
+
+        done, pending = await asyncio.wait(list(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning(f"[MEDIA_GROUP] Drain timeout, {len(pending)} albums not finished")
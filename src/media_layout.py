@@ -0,0 +1,216 @@
+"""
+Модуль раскладки media/ по месяцам
+Новые файлы сохраняются в chat_{id}/media/YYYY/MM/, чтобы каталоги не
+разрастались до десятков тысяч файлов (медленные Glob, листинги и проверки).
+
+Файлы старой плоской раскладки переносятся командой migrate; старые пути
+из history.txt продолжают работать через resolve_media_path: перенесённые
+файлы записаны в chat_{id}/media_legacy.json (имя → путь внутри media/).
+
+Перенос (повторный запуск безопасен):
+    python src/media_layout.py migrate <chat_id> [<chat_id> ...]
+    python src/media_layout.py migrate --all
+"""
+
+import os
+import re
+import sys
+import json
+import logging
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+MEDIA_DIR_NAME = "media"
+LEGACY_MAP_NAME = "media_legacy.json"
+
+# Префиксы имён файлов по типу (документы сохраняются с исходным именем);
+# по ним же list_media определяет тип файла
+PHOTO_PREFIX = "photo_"
+VOICE_PREFIX = "voice_"
+VIDEO_NOTE_PREFIX = "videonote_"
+
+# Время в имени файла: photo_20250312_101500.jpg, document_20250312_101500
+NAME_TIME_PATTERN = re.compile(r'_(\d{8}_\d{6})(?:_|\.|$)')
+
+# Кэш таблиц переноса: каталог чата → (mtime файла, таблица)
+_legacy_maps: Dict[Path, Tuple[float, Dict[str, str]]] = {}
+_legacy_lock = threading.Lock()
+
+
+def shard_subdir(when: datetime) -> str:
+    """Подкаталог media/ для файла, полученного в момент when: YYYY/MM"""
+    return when.strftime("%Y/%m")
+
+
+def shard_path(media_dir: Path, filename: str, when: datetime) -> Path:
+    """Путь файла в раскладке по месяцам"""
+    return Path(media_dir) / shard_subdir(when) / filename
+
+
+def _load_legacy_map(chat_dir: Path) -> Dict[str, str]:
+    """Таблица переноса чата (перечитывается, только если файл изменился)"""
+    path = chat_dir / LEGACY_MAP_NAME
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return {}
+
+    with _legacy_lock:
+        cached = _legacy_maps.get(chat_dir)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            mapping = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"[MEDIA_LAYOUT] Unreadable {path}: {e}")
+        return {}
+
+    with _legacy_lock:
+        _legacy_maps[chat_dir] = (mtime, mapping)
+    return mapping
+
+
+def resolve_media_path(path: str) -> str:
+    """
+    Фактический путь файла media/ (старые плоские пути → media/YYYY/MM/)
+
+    Для сжатого документа возвращается путь без .gz рядом со сжатой копией
+    (его открывает cold_storage.open_archive_file).
+
+    Args:
+        path: Путь из истории или ответа агента
+
+    Returns:
+        Путь к файлу (исходный, если переноса не было)
+    """
+    candidate = Path(path)
+    if candidate.parent.name != MEDIA_DIR_NAME or os.path.lexists(candidate):
+        return path
+
+    media_dir = candidate.parent
+    mapping = _load_legacy_map(media_dir.parent)
+    moved = mapping.get(candidate.name)
+    if moved is not None:
+        return str(media_dir / moved)
+
+    moved = mapping.get(f"{candidate.name}.gz")
+    if moved is not None:
+        return str(media_dir / moved[:-len('.gz')])
+    return path
+
+
+def _file_time(path: Path) -> datetime:
+    """Время получения файла: из имени, иначе время изменения"""
+    match = NAME_TIME_PATTERN.search(path.name)
+    if match:
+        try:
+            return datetime.strptime(match.group(1), "%Y%m%d_%H%M%S")
+        except ValueError:
+            pass
+    return datetime.fromtimestamp(path.lstat().st_mtime)
+
+
+def _write_legacy_map(chat_dir: Path, mapping: Dict[str, str]):
+    """Атомарное сохранение таблицы переноса"""
+    path = chat_dir / LEGACY_MAP_NAME
+    tmp_file = Path(f"{path}.tmp")
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(mapping, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_file, path)
+
+
+def migrate_chat(chat_dir: Path, quota=None) -> int:
+    """
+    Перенос файлов плоской раскладки media/ в media/YYYY/MM/
+
+    Таблица переноса сохраняется до переноса: пока файл не перенесён,
+    старый путь существует сам по себе, после - находится по таблице.
+
+    Args:
+        chat_dir: Директория чата
+        quota: Учёт места (StorageQuota), чтобы обновить пути файлов
+
+    Returns:
+        Количество перенесённых файлов
+    """
+    chat_dir = Path(chat_dir)
+    media_dir = chat_dir / MEDIA_DIR_NAME
+    if not media_dir.exists():
+        return 0
+
+    mapping = dict(_load_legacy_map(chat_dir))
+    moves: List[Tuple[Path, Path]] = []
+    taken = set()
+    for path in sorted(media_dir.iterdir()):
+        if path.is_dir() and not path.is_symlink():
+            continue
+
+        if path.name.endswith('.gz.idx') and path.name[:-len('.idx')] in mapping:
+            # Индекс сжатого документа лежит рядом со сжатой копией
+            target = media_dir / f"{mapping[path.name[:-len('.idx')]]}.idx"
+        else:
+            target = shard_path(media_dir, path.name, _file_time(path))
+        if target.exists() or target in taken:
+            # Такое имя уже есть в месяце - добавляем номер
+            stem, dot, suffix = path.name.partition('.')
+            number = 1
+            while True:
+                target = target.with_name(f"{stem}_{number}{dot}{suffix}")
+                if not target.exists() and target not in taken:
+                    break
+                number += 1
+        taken.add(target)
+        mapping[path.name] = target.relative_to(media_dir).as_posix()
+        moves.append((path, target))
+
+    if not moves:
+        return 0
+
+    _write_legacy_map(chat_dir, mapping)
+    for source, target in moves:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.rename(source, target)
+        if quota is not None:
+            quota.rename(source, target)
+
+    logger.info(f"[MEDIA_LAYOUT] Moved {len(moves)} files into monthly folders in {media_dir}")
+    return len(moves)
+
+
+def main(argv: List[str]) -> int:
+    """Точка входа командной строки: migrate <chat_id>... | migrate --all"""
+    import argparse
+    from archiver import ARCHIVE_BASE
+    from storage_quota import get_storage_quota
+
+    parser = argparse.ArgumentParser(description="Раскладка media/ по месяцам")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = subparsers.add_parser('migrate', help="перенести плоскую media/ в media/YYYY/MM/")
+    migrate_parser.add_argument('chat_ids', nargs='*', type=int)
+    migrate_parser.add_argument('--all', action='store_true', help="все чаты архива")
+    args = parser.parse_args(argv)
+
+    base = Path(ARCHIVE_BASE)
+    if args.all:
+        chat_dirs = sorted(p for p in base.glob('chat_*') if p.is_dir())
+    else:
+        chat_dirs = [base / f"chat_{chat_id}" for chat_id in args.chat_ids]
+
+    quota = get_storage_quota(ARCHIVE_BASE)
+    for chat_dir in chat_dirs:
+        moved = migrate_chat(chat_dir, quota)
+        print(f"{chat_dir.name}: перенесено {moved} файлов")
+
+    quota.close()
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
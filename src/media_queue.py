@@ -0,0 +1,273 @@
+"""
+Модуль фоновой очереди скачивания медиа
+Скачивание фото, документов, голосовых и видео-кружков не задерживает
+обработку апдейтов: задачи ставятся в очередь с приоритетом маленьких файлов,
+ограничением параллельности (общим и на чат) и повторами при ошибках.
+Заполненная очередь притормаживает постановку новых задач, но лимиты
+параллельности не обходит
+"""
+
+import os
+import time
+import asyncio
+import logging
+import itertools
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Общее количество одновременных скачиваний
+MEDIA_QUEUE_WORKERS = int(os.getenv('MEDIA_QUEUE_WORKERS', 4))
+
+# Одновременных скачиваний на один чат
+MEDIA_QUEUE_PER_CHAT = int(os.getenv('MEDIA_QUEUE_PER_CHAT', 2))
+
+# Максимальная длина очереди (при переполнении постановка ждёт освобождения места)
+MEDIA_QUEUE_MAX_SIZE = int(os.getenv('MEDIA_QUEUE_MAX_SIZE', 1000))
+
+# Повторы при ошибке скачивания и базовая пауза между ними (удваивается)
+MEDIA_QUEUE_RETRIES = int(os.getenv('MEDIA_QUEUE_RETRIES', 3))
+MEDIA_QUEUE_RETRY_DELAY = float(os.getenv('MEDIA_QUEUE_RETRY_DELAY', 1.0))
+
+# Приоритет: файл размером N байт ждёт N / MEDIA_QUEUE_SIZE_PENALTY секунд
+# дольше маленьких, поэтому маленькие идут первыми, но большие не голодают
+MEDIA_QUEUE_SIZE_PENALTY = float(os.getenv('MEDIA_QUEUE_SIZE_PENALTY', 1024 * 1024))
+
+THROUGHPUT_WINDOW = 60.0
+
+
+class MediaJob:
+    """Задача скачивания в очереди"""
+
+    __slots__ = ('chat_id', 'size', 'factory', 'description', 'future', 'enqueued_at', 'attempts')
+
+    def __init__(self, chat_id: int, size: int, factory: Callable[[], Awaitable], description: str):
+        self.chat_id = chat_id
+        self.size = size
+        self.factory = factory
+        self.description = description
+        self.future: Optional[asyncio.Future] = None
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+
+
+class MediaDownloadQueue:
+    """Очередь скачивания медиа с приоритетами и ограничением параллельности"""
+
+    def __init__(
+        self,
+        workers: int = MEDIA_QUEUE_WORKERS,
+        per_chat: int = MEDIA_QUEUE_PER_CHAT,
+        max_size: int = MEDIA_QUEUE_MAX_SIZE,
+        retries: int = MEDIA_QUEUE_RETRIES,
+    ):
+        """
+        Args:
+            workers: Общее количество одновременных скачиваний
+            per_chat: Одновременных скачиваний на чат
+            max_size: Максимальная длина очереди
+            retries: Количество повторов при ошибке
+        """
+        self.workers = workers
+        self.per_chat = per_chat
+        self.max_size = max_size
+        self.retries = retries
+
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._space: Optional[asyncio.Condition] = None
+        self._tasks = []
+        self._seq = itertools.count()
+
+        # Задачи чатов, упёршихся в лимит, ждут освобождения слота чата
+        self._active_per_chat: Dict[int, int] = {}
+        self._deferred: Dict[int, deque] = {}
+
+        # Метрики
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.throttled = 0
+        self._finished = deque()  # (время завершения, байты)
+        self._durations = deque(maxlen=1000)
+
+    def start(self):
+        """Запуск воркеров (вызывается из работающего event loop; повторный вызов ничего не делает)"""
+        if self._tasks:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._space = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        logger.info(f"[MEDIA_QUEUE] Started {self.workers} workers (per chat: {self.per_chat})")
+
+    def depth(self) -> int:
+        """Количество задач, ожидающих скачивания"""
+        queued = self._queue.qsize() if self._queue else 0
+        return queued + sum(len(jobs) for jobs in self._deferred.values())
+
+    async def submit(
+        self,
+        chat_id: int,
+        size: Optional[int],
+        factory: Callable[[], Awaitable],
+        description: str = "",
+    ) -> asyncio.Future:
+        """
+        Постановка скачивания в очередь
+
+        Если в очереди уже max_size задач, ждёт, пока воркеры разберут очередь
+        (обработчик апдейта притормаживает). Воркеры запускаются при первой
+        постановке, если start() ещё не вызывался.
+
+        Args:
+            chat_id: ID чата
+            size: Размер файла в байтах (из Telegram, если известен)
+            factory: Функция, создающая корутину скачивания и записи в историю
+            description: Описание для логов
+
+        Returns:
+            Future с результатом: True - скачано, False - ошибка после всех повторов
+        """
+        self.start()
+        if self.depth() >= self.max_size:
+            self.throttled += 1
+            logger.warning(f"[MEDIA_QUEUE] Queue is full ({self.depth()}), waiting to enqueue {description}")
+            async with self._space:
+                await self._space.wait_for(lambda: self.depth() < self.max_size)
+
+        job = MediaJob(chat_id, size or 0, factory, description)
+        job.future = asyncio.get_running_loop().create_future()
+        self._dispatch(job)
+        return job.future
+
+    def _dispatch(self, job: MediaJob):
+        """Передача задачи воркерам или откладывание до освобождения слота чата"""
+        if self._active_per_chat.get(job.chat_id, 0) >= self.per_chat:
+            self._deferred.setdefault(job.chat_id, deque()).append(job)
+            return
+
+        self._active_per_chat[job.chat_id] = self._active_per_chat.get(job.chat_id, 0) + 1
+        priority = job.enqueued_at + job.size / MEDIA_QUEUE_SIZE_PENALTY
+        self._queue.put_nowait((priority, next(self._seq), job))
+
+    def _release(self, chat_id: int):
+        """Освобождение слота чата и запуск следующей отложенной задачи"""
+        active = self._active_per_chat.get(chat_id, 1) - 1
+        if active > 0:
+            self._active_per_chat[chat_id] = active
+        else:
+            self._active_per_chat.pop(chat_id, None)
+
+        deferred = self._deferred.get(chat_id)
+        if deferred:
+            self._dispatch(deferred.popleft())
+            if not deferred:
+                del self._deferred[chat_id]
+
+    async def _worker(self, index: int):
+        """Цикл воркера: берёт задачи с наименьшим приоритетом"""
+        while True:
+            _, _, job = await self._queue.get()
+            async with self._space:
+                self._space.notify()
+            try:
+                await self._run(job)
+            finally:
+                self._release(job.chat_id)
+                self._queue.task_done()
+
+    async def _run(self, job: MediaJob):
+        """Выполнение задачи с повторами при ошибке"""
+        self.in_flight += 1
+        started = time.monotonic()
+        try:
+            while True:
+                job.attempts += 1
+                try:
+                    await job.factory()
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if job.attempts > self.retries:
+                        self.failed += 1
+                        logger.error(
+                            f"[MEDIA_QUEUE] Giving up {job.description} in chat_id={job.chat_id} "
+                            f"after {job.attempts} attempts: {e}"
+                        )
+                        if not job.future.done():
+                            job.future.set_result(False)
+                        return
+
+                    self.retried += 1
+                    delay = MEDIA_QUEUE_RETRY_DELAY * 2 ** (job.attempts - 1)
+                    logger.warning(
+                        f"[MEDIA_QUEUE] Retry {job.attempts}/{self.retries} for {job.description} "
+                        f"in chat_id={job.chat_id} in {delay:.1f}s: {e}"
+                    )
+                    await asyncio.sleep(delay)
+
+            finished = time.monotonic()
+            self.completed += 1
+            self._durations.append(finished - started)
+            self._finished.append((finished, job.size))
+            if not job.future.done():
+                job.future.set_result(True)
+            logger.debug(
+                f"[MEDIA_QUEUE] Done {job.description} in chat_id={job.chat_id}: "
+                f"waited {started - job.enqueued_at:.2f}s, took {finished - started:.2f}s"
+            )
+        finally:
+            self.in_flight -= 1
+
+    def get_stats(self) -> dict:
+        """
+        Метрики очереди
+
+        Returns:
+            Словарь: depth, in_flight, completed, failed, retried, throttled (ждали места в очереди),
+            files_per_min и mb_per_sec за последнюю минуту, avg_download_s
+        """
+        now = time.monotonic()
+        while self._finished and now - self._finished[0][0] > THROUGHPUT_WINDOW:
+            self._finished.popleft()
+
+        recent_bytes = sum(size for _, size in self._finished)
+        durations = list(self._durations)
+        return {
+            'depth': self.depth(),
+            'in_flight': self.in_flight,
+            'completed': self.completed,
+            'failed': self.failed,
+            'retried': self.retried,
+            'throttled': self.throttled,
+            'files_per_min': len(self._finished),
+            'mb_per_sec': round(recent_bytes / THROUGHPUT_WINDOW / (1024 * 1024), 3),
+            'avg_download_s': round(sum(durations) / len(durations), 2) if durations else 0.0,
+        }
+
+    async def drain(self, timeout: float = 30.0):
+        """
+        Ожидание завершения поставленных скачиваний и остановка воркеров
+
+        Args:
+            timeout: Максимальное время ожидания в секундах
+        """
+        if not self._tasks:
+            return
+
+        try:
+            await asyncio.wait_for(self._wait_idle(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"[MEDIA_QUEUE] Drain timeout, {self.depth()} downloads dropped")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _wait_idle(self):
+        """Ожидание пустой очереди и отсутствия активных скачиваний"""
+        while self.depth() or self.in_flight:
+            await asyncio.sleep(0.1)
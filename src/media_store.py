@@ -0,0 +1,357 @@
+"""
+Модуль общего хранилища медиафайлов с дедупликацией
+Файл хранится один раз в chat_archive/blobs/ под своим SHA-256,
+а в media/ чатов лежат жёсткие ссылки на него
+
+Дедупликация в два шага:
+1. по file_unique_id Telegram - повторный файл не скачивается вообще
+2. по хэшу содержимого - одинаковые файлы с разными file_unique_id
+"""
+
+import os
+import errno
+import shutil
+import hashlib
+import sqlite3
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+BLOBS_DIR_NAME = "blobs"
+INDEX_NAME = "index.sqlite"
+
+HASH_CHUNK = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    refs INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS unique_ids (
+    file_unique_id TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+def file_sha256(path: Path) -> str:
+    """Потоковый SHA-256 файла"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaStore:
+    """Контентно-адресуемое хранилище медиафайлов всех чатов"""
+
+    def __init__(self, blobs_dir: Path):
+        """
+        Инициализация (база открывается при первом обращении в потоке записи)
+
+        Args:
+            blobs_dir: Директория хранилища (chat_archive/blobs/)
+        """
+        self.blobs_dir = Path(blobs_dir)
+        self.tmp_dir = self.blobs_dir / "tmp"
+        self.index_file = self.blobs_dir / INDEX_NAME
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def _db(self) -> sqlite3.Connection:
+        """Соединение с индексом хранилища (создаётся при первом обращении)"""
+        if self._conn is None:
+            self.tmp_dir.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.index_file), check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+        return self._conn
+
+    def blob_path(self, sha256: str) -> Path:
+        """Путь к файлу в хранилище: blobs/ab/cd/<sha256>"""
+        return self.blobs_dir / sha256[:2] / sha256[2:4] / sha256
+
+    def temp_path(self, name: str) -> Path:
+        """
+        Новый пустой временный файл для скачивания (уникальный, даже при одинаковых именах в разных чатах)
+
+        Args:
+            name: Имя файла назначения (для узнаваемого имени временного файла)
+
+        Returns:
+            Путь к созданному временному файлу
+        """
+        self.tmp_dir.mkdir(parents=True, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=f"{os.getpid()}_", suffix=f"_{name}", dir=self.tmp_dir)
+        os.close(fd)
+        return Path(path)
+
+    def _bump(self, conn: sqlite3.Connection, name: str, value: int = 1):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, value),
+        )
+
+    def _link(self, blob: Path, destination: Path):
+        """Жёсткая ссылка на файл хранилища (символическая, если жёсткая невозможна)"""
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        if destination.exists() or destination.is_symlink():
+            destination.unlink()
+        try:
+            os.link(blob, destination)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+            os.symlink(blob, destination)
+
+    def link_known(self, file_unique_id: Optional[str], destination: Path) -> bool:
+        """
+        Размещение уже известного файла без скачивания
+
+        Args:
+            file_unique_id: file_unique_id из Telegram
+            destination: Путь в media/ чата
+
+        Returns:
+            True, если файл найден в хранилище и ссылка создана
+        """
+        if not file_unique_id:
+            return False
+
+        with self._lock:
+            conn = self._db()
+            row = conn.execute(
+                "SELECT b.sha256, b.size FROM unique_ids u JOIN blobs b ON b.sha256 = u.sha256 "
+                "WHERE u.file_unique_id = ?",
+                (file_unique_id,),
+            ).fetchone()
+            if row is None:
+                return False
+
+            sha256, size = row
+            blob = self.blob_path(sha256)
+            if not blob.exists():
+                # Файл хранилища потерян - забываем запись и скачиваем заново
+                conn.execute("DELETE FROM unique_ids WHERE sha256 = ?", (sha256,))
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+                conn.commit()
+                return False
+
+            self._link(blob, destination)
+            with conn:
+                conn.execute("UPDATE blobs SET refs = refs + 1 WHERE sha256 = ?", (sha256,))
+                self._bump(conn, 'downloads_skipped')
+                self._bump(conn, 'bytes_not_downloaded', size)
+
+        logger.info(f"[MEDIA_STORE] Reused {sha256[:12]} by file_unique_id for {destination.name}")
+        return True
+
+    def ingest(self, temp_file: Path, destination: Path, file_unique_id: Optional[str] = None) -> str:
+        """
+        Перенос скачанного файла в хранилище и создание ссылки в media/
+
+        Args:
+            temp_file: Скачанный временный файл
+            destination: Путь в media/ чата
+            file_unique_id: file_unique_id из Telegram (для повторных файлов)
+
+        Returns:
+            SHA-256 содержимого
+        """
+        sha256 = file_sha256(temp_file)
+        size = temp_file.stat().st_size
+        blob = self.blob_path(sha256)
+
+        with self._lock:
+            conn = self._db()
+            if blob.exists():
+                temp_file.unlink()
+                duplicate = True
+            else:
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                os.replace(temp_file, blob)
+                duplicate = False
+
+            self._link(blob, destination)
+            with conn:
+                conn.execute(
+                    "INSERT INTO blobs (sha256, size, refs) VALUES (?, ?, 1) "
+                    "ON CONFLICT(sha256) DO UPDATE SET refs = refs + 1",
+                    (sha256, size),
+                )
+                if file_unique_id:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO unique_ids (file_unique_id, sha256) VALUES (?, ?)",
+                        (file_unique_id, sha256),
+                    )
+                if duplicate:
+                    self._bump(conn, 'content_duplicates')
+
+        if duplicate:
+            logger.info(f"[MEDIA_STORE] Content duplicate {sha256[:12]} for {destination.name}")
+        return sha256
+
+    def import_file(self, source: Path, destination: Path) -> str:
+        """
+        Размещение локального файла (из выгрузки чата) в хранилище и media/
+
+        Файл копируется в хранилище один раз, даже если он встречается в
+        нескольких чатах; исходный файл не изменяется.
+
+        Args:
+            source: Исходный файл
+            destination: Путь в media/ чата
+
+        Returns:
+            SHA-256 содержимого
+        """
+        sha256 = file_sha256(source)
+        blob = self.blob_path(sha256)
+
+        if not blob.exists():
+            temp_file = self.temp_path(f"{sha256}.import")
+            shutil.copyfile(source, temp_file)
+            return self.ingest(temp_file, destination)
+
+        with self._lock:
+            conn = self._db()
+            self._link(blob, destination)
+            with conn:
+                conn.execute(
+                    "INSERT INTO blobs (sha256, size, refs) VALUES (?, ?, 1) "
+                    "ON CONFLICT(sha256) DO UPDATE SET refs = refs + 1",
+                    (sha256, blob.stat().st_size),
+                )
+                self._bump(conn, 'content_duplicates')
+        return sha256
+
+    def unlink(self, path: Path) -> int:
+        """
+        Удаление файла из media/ чата с учётом ссылок хранилища
+
+        Файл хранилища удаляется вместе с последней ссылкой на него.
+
+        Args:
+            path: Путь в media/ чата
+
+        Returns:
+            Освобождённое место в байтах (0, если файл ещё используется другими чатами)
+        """
+        path = Path(path)
+        if path.is_symlink():
+            sha256 = Path(os.readlink(path)).name
+        else:
+            sha256 = file_sha256(path)
+        size = path.lstat().st_size
+
+        with self._lock:
+            conn = self._db()
+            row = conn.execute("SELECT refs, size FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            path.unlink()
+            if row is None:
+                # Файл не из хранилища (архив старше дедупликации)
+                return size
+
+            refs, blob_size = row
+            with conn:
+                if refs > 1:
+                    conn.execute("UPDATE blobs SET refs = refs - 1 WHERE sha256 = ?", (sha256,))
+                    return 0
+                conn.execute("DELETE FROM unique_ids WHERE sha256 = ?", (sha256,))
+                conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            self.blob_path(sha256).unlink(missing_ok=True)
+
+        logger.info(f"[MEDIA_STORE] Released {sha256[:12]} ({blob_size} bytes)")
+        return blob_size
+
+    def get_stats(self) -> Dict[str, float]:
+        """
+        Статистика дедупликации
+
+        Returns:
+            Словарь: files (ссылок), blobs (уникальных файлов), logical_bytes,
+            stored_bytes, bytes_saved, dedup_ratio, downloads_skipped,
+            bytes_not_downloaded, content_duplicates
+        """
+        with self._lock:
+            conn = self._db()
+            files, blobs, logical, stored = conn.execute(
+                "SELECT COALESCE(SUM(refs), 0), COUNT(*), "
+                "COALESCE(SUM(size * refs), 0), COALESCE(SUM(size), 0) FROM blobs"
+            ).fetchone()
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+
+        return {
+            'files': files,
+            'blobs': blobs,
+            'logical_bytes': logical,
+            'stored_bytes': stored,
+            'bytes_saved': logical - stored,
+            'dedup_ratio': round(logical / stored, 3) if stored else 1.0,
+            'downloads_skipped': counters.get('downloads_skipped', 0),
+            'bytes_not_downloaded': counters.get('bytes_not_downloaded', 0),
+            'content_duplicates': counters.get('content_duplicates', 0),
+        }
+
+    async def save(self, bot, file, destination: Path, writer, chat_id: int) -> bool:
+        """
+        Сохранение файла Telegram в media/ чата через хранилище
+
+        Файловые операции выполняются в потоке записи чата.
+
+        Args:
+            bot: Объект бота для скачивания
+            file: Объект файла Telegram (PhotoSize, Document, Voice, VideoNote)
+            destination: Путь в media/ чата
+            writer: Пул записи (ArchiveWriter)
+            chat_id: ID чата
+
+        Returns:
+            True, если файл скачивался, False - если взят из хранилища
+        """
+        file_unique_id = getattr(file, 'file_unique_id', None)
+        if await writer.run(chat_id, self.link_known, file_unique_id, destination):
+            return False
+
+        temp_file = await writer.run(chat_id, self.temp_path, destination.name)
+        try:
+            await bot.download(file, destination=temp_file)
+            await writer.run(chat_id, self.ingest, temp_file, destination, file_unique_id)
+        except BaseException:
+            await writer.run(chat_id, temp_file.unlink, missing_ok=True)
+            raise
+        return True
+
+    def close(self):
+        """Закрытие индекса хранилища"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+_stores: Dict[str, MediaStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_media_store(archive_base: str) -> MediaStore:
+    """Общее хранилище медиа для базовой директории архива"""
+    with _stores_lock:
+        store = _stores.get(archive_base)
+        if store is None:
+            store = _stores[archive_base] = MediaStore(Path(archive_base) / BLOBS_DIR_NAME)
+        return store
@@ -0,0 +1,249 @@
+"""
+Модуль полнотекстового индекса архива (SQLite FTS5)
+Индекс пополняется теми же пачками, что пишутся в history.txt,
+и используется инструментом агента search_history
+
+Пересборка индекса по существующему history.txt:
+    python src/search_index.py rebuild <chat_id> [<chat_id> ...]
+    python src/search_index.py rebuild --all
+"""
+
+import sys
+import time
+import sqlite3
+import logging
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+INDEX_NAME = "search.sqlite"
+
+# Размер страницы результатов поиска
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+
+# Размер пачки вставки при пересборке
+REBUILD_BATCH = 10000
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS messages USING fts5(
+    sender,
+    text,
+    kind UNINDEXED,
+    ts UNINDEXED,
+    media_path UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+)
+"""
+
+INSERT_SQL = "INSERT INTO messages (sender, text, kind, ts, media_path) VALUES (?, ?, ?, ?, ?)"
+
+
+def _connect(db_path: Path) -> sqlite3.Connection:
+    """Открытие индекса на запись (WAL, чтобы поиск не ждал записи)"""
+    conn = sqlite3.connect(str(db_path), check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(SCHEMA)
+    return conn
+
+
+class SearchIndex:
+    """Инкрементальный FTS5-индекс чата (получает пачки из HistoryJournal)"""
+
+    def __init__(self, db_path: Path):
+        """
+        Инициализация индекса (соединение открывается в потоке записи)
+
+        Args:
+            db_path: Путь к файлу индекса (chat_{id}/search.sqlite)
+        """
+        self.db_path = Path(db_path)
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def write_batch(self, records: List):
+        """
+        Добавление пачки событий в индекс одной транзакцией
+
+        Args:
+            records: Записи журнала (HistoryRecord)
+        """
+        if self._conn is None:
+            self._conn = _connect(self.db_path)
+
+        rows = [
+            (
+                record.event.get('sender'),
+                record.event.get('text', record.line.rstrip('\n')),
+                record.event.get('kind', 'text'),
+                record.timestamp.isoformat(timespec='seconds'),
+                record.event.get('media_path'),
+            )
+            for record in records
+        ]
+
+        with self._conn:
+            self._conn.executemany(INSERT_SQL, rows)
+
+    def close(self):
+        """Закрытие соединения"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def to_fts_query(query: str) -> str:
+    """
+    Преобразование пользовательского запроса в безопасный запрос FTS5
+
+    Каждое слово берётся в кавычки и ищется по префиксу ("прайс" найдёт
+    "прайса", "прайсом"), слова объединяются через AND.
+
+    Args:
+        query: Запрос в свободной форме
+
+    Returns:
+        Строка запроса для MATCH
+    """
+    terms = []
+    for word in query.split():
+        word = word.replace('"', '""')
+        terms.append(f'"{word}"*')
+    return ' '.join(terms)
+
+
+def search(db_path: Path, query: str, page: int = 1, page_size: int = SEARCH_PAGE_SIZE) -> dict:
+    """
+    Поиск по индексу с ранжированием bm25 и постраничной выдачей
+
+    Args:
+        db_path: Путь к файлу индекса
+        query: Запрос в свободной форме
+        page: Номер страницы (с 1)
+        page_size: Размер страницы
+
+    Returns:
+        Словарь: total, page, pages, hits (ts, sender, kind, text, media_path)
+    """
+    page = max(1, page)
+    page_size = max(1, min(page_size, SEARCH_MAX_PAGE_SIZE))
+    fts_query = to_fts_query(query)
+
+    result = {'total': 0, 'page': page, 'pages': 0, 'hits': []}
+    if not fts_query or not Path(db_path).exists():
+        return result
+
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, timeout=30)
+    try:
+        total = conn.execute(
+            "SELECT count(*) FROM messages WHERE messages MATCH ?", (fts_query,)
+        ).fetchone()[0]
+
+        rows = conn.execute(
+            """
+            SELECT ts, sender, kind, snippet(messages, 1, '«', '»', '…', 24), media_path
+            FROM messages
+            WHERE messages MATCH ?
+            ORDER BY bm25(messages, 1.0, 5.0)
+            LIMIT ? OFFSET ?
+            """,
+            (fts_query, page_size, (page - 1) * page_size),
+        ).fetchall()
+    finally:
+        conn.close()
+
+    result['total'] = total
+    result['pages'] = (total + page_size - 1) // page_size
+    result['hits'] = [
+        {'ts': ts, 'sender': sender, 'kind': kind, 'text': text, 'media_path': media_path}
+        for ts, sender, kind, text, media_path in rows
+    ]
+    return result
+
+
+def rebuild(history_file: Path, db_path: Path) -> int:
+    """
+    Пересборка индекса по существующему history.txt
+
+    Индекс заполняется заново одной транзакцией пачками по REBUILD_BATCH строк
+    с отключённым fsync, после чего сегменты FTS5 объединяются (optimize).
+    Запускать при остановленном боте, иначе новые сообщения могут задвоиться.
+
+    Args:
+        history_file: Путь к history.txt
+        db_path: Путь к файлу индекса
+
+    Returns:
+        Количество проиндексированных строк
+    """
+    from history_parser import iter_history
+
+    conn = _connect(db_path)
+    conn.execute("PRAGMA synchronous=OFF")
+    count = 0
+
+    try:
+        with conn:
+            conn.execute("DELETE FROM messages")
+            batch = []
+            for timestamp, event, _, _ in iter_history(history_file):
+                batch.append((
+                    event['sender'],
+                    event['text'],
+                    event['kind'],
+                    timestamp.isoformat(timespec='seconds'),
+                    event['media_path'],
+                ))
+                if len(batch) >= REBUILD_BATCH:
+                    conn.executemany(INSERT_SQL, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                conn.executemany(INSERT_SQL, batch)
+                count += len(batch)
+
+        conn.execute("INSERT INTO messages (messages) VALUES ('optimize')")
+        conn.commit()
+    finally:
+        conn.close()
+
+    return count
+
+
+def main(argv: List[str]) -> int:
+    """Точка входа командной строки: rebuild <chat_id>... | rebuild --all"""
+    import argparse
+    from archiver import ARCHIVE_BASE
+
+    parser = argparse.ArgumentParser(description="FTS5-индекс архива чатов")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = subparsers.add_parser('rebuild', help="пересобрать индекс по history.txt")
+    rebuild_parser.add_argument('chat_ids', nargs='*', type=int)
+    rebuild_parser.add_argument('--all', action='store_true', help="все чаты архива")
+    args = parser.parse_args(argv)
+
+    base = Path(ARCHIVE_BASE)
+    if args.all:
+        chat_dirs = sorted(p for p in base.glob('chat_*') if p.is_dir())
+    else:
+        chat_dirs = [base / f"chat_{chat_id}" for chat_id in args.chat_ids]
+
+    for chat_dir in chat_dirs:
+        history_file = chat_dir / "history.txt"
+        if not history_file.exists():
+            print(f"{chat_dir.name}: history.txt не найден, пропускаю")
+            continue
+
+        started = time.monotonic()
+        count = rebuild(history_file, chat_dir / INDEX_NAME)
+        elapsed = time.monotonic() - started
+        rate = count / elapsed if elapsed > 0 else count
+        print(f"{chat_dir.name}: {count} строк за {elapsed:.2f} с ({rate:.0f} строк/с)")
+
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,245 @@
+"""
+Модуль помесячного оглавления истории
+Ведёт history/manifest.json: для каждого месяца - период, число строк, размер
+и диапазоны байтов history.txt, в которых лежат его строки. Сам текст хранится
+только в history.txt (копий по месяцам нет); смещения считаются в полной
+истории, включая сжатое начало history.txt.cold.gz
+
+Формат manifest.json:
+    {"covered": <байт history.txt учтено>,
+     "segments": [{"month": "YYYY-MM", "start": ts, "end": ts, "lines": n,
+                   "bytes": n, "ranges": [[начало, конец], ...]}, ...]}
+
+Манифест переписывается, когда у месяца появляется новый диапазон, и при
+сбросе журнала; отставший манифест досчитывается по history.txt при
+следующей загрузке.
+"""
+
+import os
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional
+from cold_storage import archive_size, open_archive_file
+from history_parser import LINE_PATTERN, iter_history
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+
+def segment_key(timestamp) -> str:
+    """Ключ сегмента (месяц) для времени события: YYYY-MM"""
+    return timestamp.strftime("%Y-%m")
+
+
+class SegmentStore:
+    """Оглавление истории по месяцам (получает пачки из HistoryJournal)"""
+
+    def __init__(self, segments_dir: Path, history_file: Path):
+        """
+        Инициализация оглавления (без обращения к диску)
+
+        Args:
+            segments_dir: Директория оглавления (chat_{id}/history/)
+            history_file: Путь к history.txt (для досчёта отставшего манифеста)
+        """
+        self.segments_dir = Path(segments_dir)
+        self.history_file = Path(history_file)
+        self.manifest_file = self.segments_dir / MANIFEST_NAME
+        self._segments = None
+        self._covered = 0
+        self._dirty = False
+
+    @property
+    def segments(self) -> List[dict]:
+        """Месяцы оглавления по порядку (после первой пачки или load())"""
+        return [self._segments[key] for key in sorted(self._segments or {})]
+
+    @property
+    def loaded(self) -> bool:
+        """Прочитан ли манифест (load() или первая пачка)"""
+        return self._segments is not None
+
+    @property
+    def covered(self) -> int:
+        """Сколько байт history.txt учтено в оглавлении"""
+        return self._covered
+
+    def _read_manifest(self) -> Optional[dict]:
+        """Манифест с диска или None (нет, повреждён или старого формата с копиями сегментов)"""
+        if not self.manifest_file.exists():
+            return None
+        try:
+            with open(self.manifest_file, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"[SEGMENTS] Corrupted manifest {self.manifest_file}, rebuilding: {e}")
+            return None
+        if 'covered' not in manifest:
+            return None
+        return manifest
+
+    def _remove_legacy_copies(self):
+        """Удаление помесячных копий истории старого формата (YYYY-MM.txt, .gz, .idx)"""
+        removed = 0
+        for path in self.segments_dir.iterdir():
+            if path.is_file() and path.name != MANIFEST_NAME and path.name[:7].replace('-', '').isdigit():
+                path.unlink()
+                removed += 1
+        if removed:
+            logger.info(f"[SEGMENTS] Removed {removed} legacy segment copies from {self.segments_dir}")
+
+    def load(self, first_offset: Optional[int] = None):
+        """
+        Чтение манифеста и досчёт строк history.txt, которых в нём ещё нет
+        (выполняется в потоке записи при первой пачке)
+
+        Args:
+            first_offset: Смещение первой строки пачки (строки с него учтёт сама пачка);
+                по умолчанию досчитывается весь history.txt
+        """
+        self.segments_dir.mkdir(parents=True, exist_ok=True)
+        manifest = self._read_manifest()
+        if manifest is None:
+            self._remove_legacy_copies()
+            self._segments = {}
+            self._covered = 0
+        else:
+            self._segments = {segment['month']: segment for segment in manifest.get('segments', [])}
+            self._covered = manifest['covered']
+
+        if first_offset is None:
+            first_offset = archive_size(self.history_file)
+        end = first_offset
+        if self._covered > end:
+            # history.txt заменён (импорт, восстановление) - оглавление строится заново
+            self._segments = {}
+            self._covered = 0
+        if self._covered < end:
+            started = self._covered
+            self._catch_up(end)
+            logger.info(f"[SEGMENTS] Indexed {end - started} bytes of {self.history_file} into {self.manifest_file}")
+            self._save_manifest()
+
+    def _catch_up(self, end: int):
+        """Учёт строк history.txt в диапазоне [covered, end)"""
+        if self._covered == 0:
+            # Полный проход: год строк восстанавливается по всему файлу
+            for timestamp, _, offset, line in iter_history(self.history_file):
+                if offset >= end:
+                    break
+                self._add(timestamp, offset, offset + len(line.encode('utf-8')))
+            self._covered = end
+            return
+
+        # Хвост после сохранённого манифеста: год - от последнего учтённого месяца
+        last = max((segment['end'] for segment in self._segments.values()), default=None)
+        last = datetime.fromisoformat(last) if last else datetime.now()
+        year, last_month = last.year, last.month
+        offset = self._covered
+        with open_archive_file(self.history_file) as f:
+            f.seek(offset)
+            for raw in f:
+                if offset >= end:
+                    break
+                line_offset = offset
+                offset += len(raw)
+                match = LINE_PATTERN.match(raw.decode('utf-8', errors='replace'))
+                if not match:
+                    continue
+                day, month, hour, minute = (int(value) for value in match.groups()[:4])
+                if month < last_month:
+                    year += 1
+                last_month = month
+                try:
+                    timestamp = datetime(year, month, day, hour, minute)
+                except ValueError:
+                    timestamp = last
+                self._add(timestamp, line_offset, offset)
+                last = timestamp
+        self._covered = end
+
+    def _add(self, timestamp: datetime, offset: int, end: int) -> bool:
+        """
+        Учёт строки в оглавлении
+
+        Returns:
+            True, если у месяца появился новый диапазон (манифест стоит сохранить сразу)
+        """
+        key = segment_key(timestamp)
+        ts = timestamp.isoformat(timespec='seconds')
+        segment = self._segments.get(key)
+        if segment is None:
+            self._segments[key] = {
+                'month': key, 'start': ts, 'end': ts, 'lines': 1,
+                'bytes': end - offset, 'ranges': [[offset, end]],
+            }
+            return True
+
+        segment['start'] = min(segment['start'], ts)
+        segment['end'] = max(segment['end'], ts)
+        segment['lines'] += 1
+        segment['bytes'] += end - offset
+        if segment['ranges'][-1][1] == offset:
+            segment['ranges'][-1][1] = end
+            return False
+        # Поздняя строка месяца после строк следующего
+        segment['ranges'].append([offset, end])
+        return True
+
+    def _save_manifest(self):
+        """Атомарная перезапись манифеста (через временный файл)"""
+        manifest = {'covered': self._covered, 'segments': self.segments}
+        tmp_file = self.manifest_file.with_suffix('.json.tmp')
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_file, self.manifest_file)
+        self._dirty = False
+
+    def write_batch(self, records: List):
+        """
+        Учёт пачки записей в оглавлении
+
+        Args:
+            records: Записи журнала (HistoryRecord) с заполненным offset
+        """
+        if self._segments is None:
+            self.load(records[0].offset)
+
+        new_range = False
+        for record in records:
+            end = record.offset + len(record.line.encode('utf-8'))
+            if record.offset < self._covered:
+                continue
+            new_range |= self._add(record.timestamp, record.offset, end)
+            self._covered = end
+        self._dirty = True
+
+        if new_range:
+            self._save_manifest()
+
+    def flush(self):
+        """Сохранение манифеста (перед запросом агента)"""
+        if self._dirty:
+            self._save_manifest()
+
+    def close(self):
+        """Сохранение манифеста перед остановкой"""
+        self.flush()
+
+
+def rebuild_manifest(history_file: Path, segments_dir: Path) -> int:
+    """
+    Пересборка оглавления по history.txt (после импорта или восстановления)
+
+    Returns:
+        Количество месяцев
+    """
+    manifest_file = Path(segments_dir) / MANIFEST_NAME
+    manifest_file.unlink(missing_ok=True)
+    store = SegmentStore(segments_dir, history_file)
+    store.load()
+    store.flush()
+    return len(store.segments)
@@ -0,0 +1,235 @@
+"""
+Модуль управления сессиями агента
+Живые ClaudeSDKClient (каждый со своим подпроцессом CLI) ограничены по
+количеству: при превышении закрывается давно неактивная сессия (LRU),
+а фоновая задача закрывает сессии, простаивающие дольше SESSION_TIMEOUT
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Максимум одновременно живых сессий (клиентов с подпроцессом CLI)
+MAX_LIVE_SESSIONS = int(os.getenv('MAX_LIVE_SESSIONS', 20))
+
+# Как часто проверять простаивающие сессии (секунды)
+SESSION_REAPER_INTERVAL = float(os.getenv('SESSION_REAPER_INTERVAL', 60))
+
+# Сколько ждать закрытия одной сессии (секунды)
+SESSION_CLOSE_TIMEOUT = float(os.getenv('SESSION_CLOSE_TIMEOUT', 10))
+
+
+class Session:
+    """Живая сессия чата"""
+
+    __slots__ = ('chat_id', 'client', 'created_at', 'last_activity', 'in_use')
+
+    def __init__(self, chat_id: int, client):
+        self.chat_id = chat_id
+        self.client = client
+        self.created_at = time.time()
+        self.last_activity = self.created_at
+        self.in_use = 0
+
+
+class SessionManager:
+    """Сессии агента по чатам: лимит, вытеснение LRU и фоновое закрытие простаивающих"""
+
+    def __init__(
+        self,
+        timeout: float,
+        max_sessions: int = MAX_LIVE_SESSIONS,
+        reaper_interval: float = SESSION_REAPER_INTERVAL,
+        close_timeout: float = SESSION_CLOSE_TIMEOUT,
+    ):
+        """
+        Args:
+            timeout: Простой, после которого сессия закрывается (секунды)
+            max_sessions: Максимум живых сессий
+            reaper_interval: Как часто проверять простаивающие сессии
+            close_timeout: Сколько ждать закрытия одной сессии
+        """
+        self.timeout = timeout
+        self.max_sessions = max(1, max_sessions)
+        self.reaper_interval = reaper_interval
+        self.close_timeout = close_timeout
+
+        self._sessions: "OrderedDict[int, Session]" = OrderedDict()
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._reaper: Optional[asyncio.Task] = None
+
+        # Метрики
+        self.created = 0
+        self.reused = 0
+        self.expired = 0
+        self.evicted = 0
+        self.reaped = 0
+        self.close_errors = 0
+
+    def start(self):
+        """Запуск фонового закрытия простаивающих сессий (из работающего event loop)"""
+        if self._reaper is None and self.reaper_interval > 0:
+            self._reaper = asyncio.create_task(self._reap_loop())
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._sessions
+
+    def _is_idle(self, session: Session, now: float) -> bool:
+        return not session.in_use and now - session.last_activity > self.timeout
+
+    async def _close(self, session: Session, reason: str):
+        """Закрытие клиента сессии с ограничением по времени"""
+        try:
+            await asyncio.wait_for(session.client.__aexit__(None, None, None), self.close_timeout)
+            logger.info(f"[SESSION] Closed session for chat_id={session.chat_id} ({reason})")
+        except Exception as e:
+            self.close_errors += 1
+            logger.error(f"[SESSION] Error closing session for chat_id={session.chat_id}: {e}")
+
+    async def acquire(self, chat_id: int, factory: Callable[[], Awaitable]):
+        """
+        Клиент сессии чата (создаётся, если сессии нет или она устарела)
+
+        Сессия помечается занятой до release(): занятые сессии не вытесняются
+        и не закрываются по простою.
+
+        Args:
+            chat_id: ID чата
+            factory: Создание и запуск нового клиента
+
+        Returns:
+            Клиент Claude SDK
+        """
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            now = time.time()
+            session = self._sessions.get(chat_id)
+
+            if session is not None and self._is_idle(session, now):
+                # Сессия устарела - закрываем
+                del self._sessions[chat_id]
+                self.expired += 1
+                logger.info(f"[SESSION] Session expired for chat_id={chat_id}, creating new")
+                await self._close(session, "expired")
+                session = None
+
+            if session is None:
+                await self._make_room()
+                logger.info(f"[SESSION] New session for chat_id={chat_id}")
+                session = Session(chat_id, await factory())
+                self._sessions[chat_id] = session
+                self.created += 1
+            else:
+                logger.info(f"[SESSION] Continue session for chat_id={chat_id}")
+                self.reused += 1
+
+            self._sessions.move_to_end(chat_id)
+            session.in_use += 1
+            session.last_activity = now
+            return session.client
+
+    def release(self, chat_id: int):
+        """Сессия чата свободна (запрос обработан)"""
+        session = self._sessions.get(chat_id)
+        if session is not None:
+            session.in_use = max(session.in_use - 1, 0)
+            session.last_activity = time.time()
+
+    async def _make_room(self):
+        """Вытеснение давно неактивных свободных сессий до лимита"""
+        victims: List[Session] = []
+        for chat_id, session in list(self._sessions.items()):
+            if len(self._sessions) < self.max_sessions:
+                break
+            if session.in_use:
+                continue
+            del self._sessions[chat_id]
+            victims.append(session)
+
+        if victims:
+            self.evicted += len(victims)
+            await asyncio.gather(*(self._close(session, "evicted") for session in victims))
+        if len(self._sessions) >= self.max_sessions:
+            logger.warning(f"[SESSION] All {len(self._sessions)} sessions are busy, exceeding the limit")
+
+    async def reap(self) -> int:
+        """
+        Закрытие сессий, простаивающих дольше таймаута
+
+        Returns:
+            Количество закрытых сессий
+        """
+        now = time.time()
+        idle = [session for session in self._sessions.values() if self._is_idle(session, now)]
+        for session in idle:
+            del self._sessions[session.chat_id]
+            lock = self._locks.get(session.chat_id)
+            if lock is not None and not lock.locked():
+                del self._locks[session.chat_id]
+
+        if idle:
+            self.reaped += len(idle)
+            await asyncio.gather(*(self._close(session, "idle") for session in idle))
+            logger.info(f"[SESSION] Reaped {len(idle)} idle sessions, {len(self._sessions)} live")
+        return len(idle)
+
+    async def _reap_loop(self):
+        while True:
+            await asyncio.sleep(self.reaper_interval)
+            try:
+                await self.reap()
+            except Exception as e:
+                logger.error(f"[SESSION] Reaper failed: {e}", exc_info=True)
+
+    def get_stats(self) -> dict:
+        """
+        Метрики сессий
+
+        Returns:
+            Словарь: live, busy, max_sessions, created, reused, expired, evicted, reaped, close_errors
+        """
+        return {
+            'live': len(self._sessions),
+            'busy': sum(1 for session in self._sessions.values() if session.in_use),
+            'max_sessions': self.max_sessions,
+            'created': self.created,
+            'reused': self.reused,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'reaped': self.reaped,
+            'close_errors': self.close_errors,
+        }
+
+    async def close_all(self, deadline: float = 30.0):
+        """
+        Параллельное закрытие всех сессий (при остановке)
+
+        Args:
+            deadline: Общее время на закрытие в секундах
+        """
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        self._locks.clear()
+        if not sessions:
+            return
+
+        logger.info(f"[SESSION] Closing {len(sessions)} active sessions")
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(self._close(session, "shutdown") for session in sessions)),
+                deadline,
+            )
+        except asyncio.TimeoutError:
+            logger.warning(f"[SESSION] Shutdown deadline {deadline}s exceeded, some sessions not closed")
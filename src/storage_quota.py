@@ -0,0 +1,412 @@
+"""
+Модуль квот хранилища чатов
+Учитывает размер файлов media/ и agent_files/ каждого чата в журнале
+(chat_archive/usage.sqlite), обновляемом при появлении и удалении файлов,
+поэтому проверка квоты не требует обхода диска.
+
+При превышении квоты (чата или общей) удаляются давно не использованные
+файлы: сначала файлы агента (их можно построить заново), медиа пользователей -
+в последнюю очередь.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+logger = logging.getLogger(__name__)
+
+USAGE_DB_NAME = "usage.sqlite"
+
+# Квота одного чата и общая квота архива в байтах (0 - без ограничения)
+CHAT_QUOTA_BYTES = int(os.getenv('CHAT_QUOTA_BYTES', 0))
+GLOBAL_QUOTA_BYTES = int(os.getenv('GLOBAL_QUOTA_BYTES', 0))
+
+# После превышения квоты файлы удаляются до этой доли квоты (чтобы не удалять по одному)
+QUOTA_LOW_WATERMARK = float(os.getenv('QUOTA_LOW_WATERMARK', 0.9))
+
+# Категории файлов в порядке удаления
+AGENT_FILES = 'agent_files'
+MEDIA = 'media'
+EVICTION_ORDER = (AGENT_FILES, MEDIA)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_lru ON files (chat_id, category, last_used);
+CREATE TABLE IF NOT EXISTS scanned_chats (
+    chat_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+
+class EvictionCandidate(NamedTuple):
+    """Файл, выбранный для удаления по квоте"""
+
+    chat_id: int
+    path: str
+    category: str
+    size: int
+
+
+class StorageQuota:
+    """Журнал занятого места по чатам с выбором файлов для удаления по LRU"""
+
+    def __init__(
+        self,
+        db_path: Path,
+        chat_quota: int = CHAT_QUOTA_BYTES,
+        global_quota: int = GLOBAL_QUOTA_BYTES,
+    ):
+        """
+        Инициализация (журнал открывается при первом обращении)
+
+        Args:
+            db_path: Путь к журналу (chat_archive/usage.sqlite)
+            chat_quota: Квота одного чата в байтах (0 - без ограничения)
+            global_quota: Общая квота в байтах (0 - без ограничения)
+        """
+        self.db_path = Path(db_path)
+        self.chat_quota = chat_quota
+        self.global_quota = global_quota
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+        # Занятое место по чатам и всего (загружается из журнала один раз)
+        self._usage: Dict[int, int] = {}
+        self._total = 0
+        self._scanned = set()
+
+    def _db(self) -> sqlite3.Connection:
+        """Соединение с журналом (при первом обращении загружаются итоги по чатам)"""
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            for chat_id, size in self._conn.execute("SELECT chat_id, SUM(size) FROM files GROUP BY chat_id"):
+                self._usage[chat_id] = size
+            self._total = sum(self._usage.values())
+            self._scanned = {row[0] for row in self._conn.execute("SELECT chat_id FROM scanned_chats")}
+        return self._conn
+
+    def _add(self, chat_id: int, delta: int):
+        self._usage[chat_id] = self._usage.get(chat_id, 0) + delta
+        self._total += delta
+
+    def _scan_chat(self, conn: sqlite3.Connection, chat_id: int, chat_dir: Path):
+        """
+        Однократный учёт файлов, появившихся до ведения журнала
+
+        Выполняется при первом обращении к чату; дальше журнал обновляется
+        только по событиям.
+        """
+        self._scanned.add(chat_id)
+        rows = []
+        for category in EVICTION_ORDER:
+            directory = chat_dir / category
+            if not directory.exists():
+                continue
+            for path in directory.rglob('*'):
+                if path.is_file():
+                    stat = path.stat()
+                    rows.append((str(path), chat_id, category, stat.st_size, stat.st_mtime))
+
+        with conn:
+            for row in rows:
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO files (path, chat_id, category, size, last_used) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    row,
+                )
+                if cursor.rowcount:
+                    self._add(chat_id, row[3])
+            conn.execute("INSERT OR IGNORE INTO scanned_chats (chat_id) VALUES (?)", (chat_id,))
+
+        if rows:
+            logger.info(f"[QUOTA] Accounted {len(rows)} existing files of chat_id={chat_id}")
+
+    def record(self, chat_id: int, category: str, path: Path):
+        """
+        Учёт нового или изменённого файла чата
+
+        Args:
+            chat_id: ID чата
+            category: AGENT_FILES или MEDIA
+            path: Путь к файлу (в директории chat_{id}/<category>/)
+        """
+        path = Path(path)
+        size = path.stat().st_size
+        with self._lock:
+            conn = self._db()
+            if chat_id not in self._scanned:
+                self._scan_chat(conn, chat_id, _chat_dir_of(path, category))
+
+            row = conn.execute("SELECT size FROM files WHERE path = ?", (str(path),)).fetchone()
+            with conn:
+                conn.execute(
+                    "INSERT INTO files (path, chat_id, category, size, last_used) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(path) DO UPDATE SET size = excluded.size, last_used = excluded.last_used",
+                    (str(path), chat_id, category, size, time.time()),
+                )
+            self._add(chat_id, size - (row[0] if row else 0))
+
+    def sync_dir(self, chat_id: int, category: str, directory: Path) -> int:
+        """
+        Учёт новых, изменённых и удалённых файлов директории чата (после запроса агента)
+
+        Читается только одна директория чата, а не весь архив.
+
+        Returns:
+            Количество новых или изменённых файлов
+        """
+        directory = Path(directory)
+        present = {}
+        if directory.exists():
+            for path in directory.rglob('*'):
+                if path.is_file():
+                    present[str(path)] = path.stat().st_size
+
+        with self._lock:
+            conn = self._db()
+            if chat_id not in self._scanned:
+                self._scan_chat(conn, chat_id, directory.parent)
+
+            known = dict(conn.execute(
+                "SELECT path, size FROM files WHERE chat_id = ? AND category = ?", (chat_id, category),
+            ).fetchall())
+
+            now = time.time()
+            changed = 0
+            with conn:
+                for name, size in present.items():
+                    if known.get(name) == size:
+                        continue
+                    conn.execute(
+                        "INSERT INTO files (path, chat_id, category, size, last_used) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT(path) DO UPDATE SET size = excluded.size, last_used = excluded.last_used",
+                        (name, chat_id, category, size, now),
+                    )
+                    self._add(chat_id, size - known.get(name, 0))
+                    changed += 1
+                for name, size in known.items():
+                    if name not in present:
+                        conn.execute("DELETE FROM files WHERE path = ?", (name,))
+                        self._add(chat_id, -size)
+        return changed
+
+    def touch(self, path: Path):
+        """Отметка использования файла (отправлен, прочитан агентом)"""
+        with self._lock:
+            conn = self._db()
+            with conn:
+                conn.execute("UPDATE files SET last_used = ? WHERE path = ?", (time.time(), str(path)))
+
+    def rename(self, old_path: Path, new_path: Path):
+        """Замена учтённого файла другим (например, сжатой копией) с новым размером"""
+        size = Path(new_path).stat().st_size
+        with self._lock:
+            conn = self._db()
+            row = conn.execute("SELECT chat_id, size FROM files WHERE path = ?", (str(old_path),)).fetchone()
+            if row is None:
+                return
+            chat_id, old_size = row
+            with conn:
+                conn.execute(
+                    "UPDATE files SET path = ?, size = ? WHERE path = ?",
+                    (str(new_path), size, str(old_path)),
+                )
+            self._add(chat_id, size - old_size)
+
+    def forget(self, path: Path) -> int:
+        """
+        Удаление файла из учёта (файл удалён)
+
+        Returns:
+            Учтённый размер файла
+        """
+        with self._lock:
+            conn = self._db()
+            row = conn.execute("SELECT chat_id, size FROM files WHERE path = ?", (str(path),)).fetchone()
+            if row is None:
+                return 0
+            chat_id, size = row
+            with conn:
+                conn.execute("DELETE FROM files WHERE path = ?", (str(path),))
+            self._add(chat_id, -size)
+            return size
+
+    def usage(self, chat_id: Optional[int] = None) -> int:
+        """Занятое место чата (или всего архива) в байтах"""
+        with self._lock:
+            self._db()
+            return self._total if chat_id is None else self._usage.get(chat_id, 0)
+
+    def is_over_quota(self, chat_id: int) -> bool:
+        """Превышена ли квота чата или общая квота (без обращения к диску)"""
+        with self._lock:
+            self._db()
+            return bool(
+                (self.chat_quota and self._usage.get(chat_id, 0) > self.chat_quota)
+                or (self.global_quota and self._total > self.global_quota)
+            )
+
+    def _iter_lru(self, conn: sqlite3.Connection, chat_id: Optional[int]):
+        """Файлы чата (или всех чатов) в порядке удаления: категория, затем давность использования"""
+        for category in EVICTION_ORDER:
+            if chat_id is None:
+                rows = conn.execute(
+                    "SELECT chat_id, path, category, size FROM files WHERE category = ? ORDER BY last_used",
+                    (category,),
+                ).fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT chat_id, path, category, size FROM files "
+                    "WHERE chat_id = ? AND category = ? ORDER BY last_used",
+                    (chat_id, category),
+                ).fetchall()
+            for row in rows:
+                yield EvictionCandidate(*row)
+
+    def plan_eviction(self, chat_id: int) -> List[EvictionCandidate]:
+        """
+        Выбор файлов для удаления, если квота чата или общая квота превышена
+
+        Удаление идёт до QUOTA_LOW_WATERMARK от квоты: сначала по квоте чата
+        (его файлы), затем по общей (файлы всех чатов).
+
+        Args:
+            chat_id: ID чата, в котором появился файл
+
+        Returns:
+            Файлы для удаления в порядке удаления
+        """
+        with self._lock:
+            conn = self._db()
+            plan = []
+            planned = set()
+
+            if self.chat_quota and self._usage.get(chat_id, 0) > self.chat_quota:
+                need = self._usage[chat_id] - int(self.chat_quota * QUOTA_LOW_WATERMARK)
+                for candidate in self._iter_lru(conn, chat_id):
+                    if need <= 0:
+                        break
+                    plan.append(candidate)
+                    planned.add(candidate.path)
+                    need -= candidate.size
+
+            if self.global_quota and self._total > self.global_quota:
+                need = self._total - int(self.global_quota * QUOTA_LOW_WATERMARK)
+                need -= sum(candidate.size for candidate in plan)
+                for candidate in self._iter_lru(conn, None):
+                    if need <= 0:
+                        break
+                    if candidate.path not in planned:
+                        plan.append(candidate)
+                        need -= candidate.size
+
+            return plan
+
+    def evict(self, candidate: EvictionCandidate, media_store=None) -> int:
+        """
+        Удаление файла по квоте (выполняется в потоке записи чата файла)
+
+        Медиа удаляются через общее хранилище: место на диске освобождается,
+        когда на файл не остаётся ссылок из других чатов.
+
+        Returns:
+            Освобождённый в учёте чата размер в байтах
+        """
+        path = Path(candidate.path)
+        try:
+            if candidate.category == MEDIA and media_store is not None:
+                media_store.unlink(path)
+            else:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+
+        size = self.forget(path)
+        with self._lock:
+            conn = self._db()
+            with conn:
+                for name, value in (('evicted_files', 1), ('evicted_bytes', size)):
+                    conn.execute(
+                        "INSERT INTO counters (name, value) VALUES (?, ?) "
+                        "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                        (name, value),
+                    )
+        return size
+
+    def get_stats(self, top: int = 10) -> dict:
+        """
+        Сводка по занятому месту
+
+        Returns:
+            Словарь: total, chat_quota, global_quota, by_category, top_chats
+            (список (chat_id, байты)), evicted_files, evicted_bytes
+        """
+        with self._lock:
+            conn = self._db()
+            by_category = dict(conn.execute("SELECT category, SUM(size) FROM files GROUP BY category").fetchall())
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            top_chats = sorted(self._usage.items(), key=lambda item: item[1], reverse=True)[:top]
+            return {
+                'total': self._total,
+                'chat_quota': self.chat_quota,
+                'global_quota': self.global_quota,
+                'by_category': by_category,
+                'top_chats': top_chats,
+                'evicted_files': counters.get('evicted_files', 0),
+                'evicted_bytes': counters.get('evicted_bytes', 0),
+            }
+
+    def chat_stats(self, chat_id: int) -> dict:
+        """Занятое место чата по категориям: agent_files, media, total"""
+        with self._lock:
+            conn = self._db()
+            stats = dict(conn.execute(
+                "SELECT category, SUM(size) FROM files WHERE chat_id = ? GROUP BY category", (chat_id,),
+            ).fetchall())
+            stats['total'] = self._usage.get(chat_id, 0)
+            return stats
+
+    def close(self):
+        """Закрытие журнала"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+def _chat_dir_of(path: Path, category: str) -> Path:
+    """Директория чата для файла из chat_{id}/<category>/..."""
+    for parent in path.parents:
+        if parent.name == category:
+            return parent.parent
+    return path.parent.parent
+
+
+_quotas: Dict[str, StorageQuota] = {}
+_quotas_lock = threading.Lock()
+
+
+def get_storage_quota(archive_base: str) -> StorageQuota:
+    """Общий журнал квот для базовой директории архива"""
+    with _quotas_lock:
+        quota = _quotas.get(archive_base)
+        if quota is None:
+            quota = _quotas[archive_base] = StorageQuota(Path(archive_base) / USAGE_DB_NAME)
+        return quota
@@ -6,6 +6,9 @@
 
 import sys
 import os
+import shutil
+import tempfile
+from contextlib import contextmanager
 from pathlib import Path
 from datetime import datetime
 
@@ -30,8 +33,9 @@ class MockChat:
 
 class MockMessage:
     """Mock объект сообщения"""
-    def __init__(self, chat_id, user, text=None):
+    def __init__(self, chat_id, user, text=None, message_id=None):
         self.chat = MockChat(chat_id)
+        self.message_id = message_id
         self.from_user = user
         self.text = text
         self.new_chat_members = None
@@ -40,6 +44,20 @@ class MockMessage:
         self.new_chat_photo = None
 
 
+@contextmanager
+def temp_archive():
+    """Временный корень архива на время теста: повторный запуск не видит файлов прошлого"""
+    import archiver as archiver_module
+
+    previous = archiver_module.ARCHIVE_BASE
+    archiver_module.ARCHIVE_BASE = tempfile.mkdtemp()
+    try:
+        yield Path(archiver_module.ARCHIVE_BASE)
+    finally:
+        shutil.rmtree(archiver_module.ARCHIVE_BASE, ignore_errors=True)
+        archiver_module.ARCHIVE_BASE = previous
+
+
 def test_directory_creation():
     """Тест 1.1: Создание структуры директорий"""
     print("\n[TEST 1.1] Создание структуры директорий")
@@ -144,6 +162,41 @@ def test_system_events(archiver):
         print(f"      {line.strip()}")
 
 
+def test_event_log():
+    """events.jsonl: событие на каждую строку истории, без потерь полей, чтение с места и без оборванной строки"""
+    print("\n[TEST EVENTS] Структурированный журнал events.jsonl")
+
+    from event_log import iter_events
+
+    with temp_archive():
+        archiver = ChatArchiver(999977)
+        user = MockUser(id=12345, first_name="Алия")
+        question = MockMessage(999977, user, text="когда встреча?", message_id=300)
+        answer = MockMessage(999977, user, text="в 10: зал «Север», без изменений", message_id=301)
+        answer.reply_to_message = question
+        archiver.archive_text_message(question)
+        archiver.archive_text_message(answer)
+        archiver.archive_system_event('title_changed', "Название изменено: Команда")
+        archiver.journal.flush().result()
+
+        events = list(iter_events(archiver.events_file))
+        lines = archiver.history_file.read_text(encoding='utf-8').splitlines()
+        assert len(events) == len(lines) == 3, "❌ Не на каждую строку истории есть событие"
+        assert [event.kind for event in events] == ['text', 'text', 'system'], "❌ Неверные типы событий"
+        reply = events[1]
+        assert (reply.message_id, reply.reply_to, reply.sender_id) == (301, 300, 12345), f"❌ Потеряны ID: {reply}"
+        assert reply.text == "в 10: зал «Север», без изменений" and reply.sender == "Алия", "❌ Потерян текст"
+        assert events[2].event_type == 'title_changed', "❌ Потерян тип системного события"
+
+        # Чтение с сохранённого места и без недописанной строки в конце
+        assert [event.message_id for event in iter_events(archiver.events_file, events[1].offset)] == [301, None]
+        with open(archiver.events_file, 'a', encoding='utf-8') as f:
+            f.write('{"ts":"2025-03-12T10:00:00","chat_id":999977,"kind":"te')
+        assert len(list(iter_events(archiver.events_file))) == 3, "❌ Прочитана оборванная строка"
+
+        print(f"✅ Событий {len(events)}, ответ на {reply.reply_to} сохранён")
+
+
 def test_archive_paths():
     """Дополнительный тест: Получение путей архива"""
     print("\n[TEST EXTRA] Получение путей архива для AI-агента")
@@ -161,6 +214,1079 @@ def test_archive_paths():
         print(f"   {key}: {value}")
 
 
+def test_archive_writer():
+    """Потоки записи: операции идут вне event loop, порядок внутри чата сохраняется, ошибки доходят до вызова"""
+    print("\n[TEST WRITER] Запись архива вне event loop")
+
+    import time
+    import asyncio
+    import threading
+    from archive_io import ArchiveWriter
+
+    writer = ArchiveWriter(workers=2)
+    order = {1: [], 2: []}
+    threads = set()
+
+    def write(chat_id: int, i: int):
+        threads.add(threading.get_ident())
+        time.sleep(0.001 * (i % 3))
+        order[chat_id].append(i)
+        return i
+
+    def fail():
+        raise OSError("диск недоступен")
+
+    async def scenario():
+        loop_thread = threading.get_ident()
+        futures = [writer.submit(chat_id, write, chat_id, i) for i in range(20) for chat_id in (1, 2)]
+        assert await writer.run(1, write, 1, 20) == 20, "❌ Результат операции не возвращён"
+        try:
+            await writer.run(2, fail)
+            raise AssertionError("❌ Ошибка записи потеряна")
+        except OSError:
+            pass
+        await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+        return loop_thread
+
+    loop_thread = asyncio.run(scenario())
+    writer.shutdown()
+    assert loop_thread not in threads, "❌ Запись выполнялась в потоке event loop"
+    assert order[1] == list(range(21)) and order[2] == list(range(20)), f"❌ Нарушен порядок записей чата: {order}"
+    stats = writer.get_stats()
+    assert stats['completed'] == 42 and stats['failed'] == 1, f"❌ Неверные счётчики: {stats}"
+
+    print(f"✅ Операций {stats['completed']}, ошибок {stats['failed']}, потоков {len(threads)}")
+
+
+def test_journal_batching():
+    """Буферизованная запись: строки копятся в памяти и пишутся пачкой по порядку"""
+    print("\n[TEST JOURNAL] Групповая запись history.txt")
+
+    import asyncio
+
+    archiver = ChatArchiver(999998)
+    user = MockUser(id=12345, first_name="Алия")
+
+    with open(archiver.history_file, 'r', encoding='utf-8') as f:
+        lines_before = len(f.readlines())
+
+    async def write_burst():
+        for i in range(5):
+            archiver.archive_text_message(MockMessage(chat_id=999998, user=user, text=f"пачка {i}"))
+
+        # Внутри event loop строки ещё в буфере
+        assert archiver.journal.pending == 5, "❌ Строки не буферизуются"
+        await archiver.flush()
+        assert archiver.journal.pending == 0, "❌ Буфер не сброшен"
+
+    asyncio.run(write_burst())
+
+    with open(archiver.history_file, 'r', encoding='utf-8') as f:
+        lines = f.readlines()[lines_before:]
+
+    assert len(lines) == 5, f"❌ Ожидалось 5 строк, записано {len(lines)}"
+    for i, line in enumerate(lines):
+        assert f"пачка {i}" in line, "❌ Нарушен порядок строк"
+
+    print("✅ Пачка из 5 строк записана одним сбросом, порядок сохранён")
+
+
+def test_journal_retry():
+    """Пачка, запись которой не удалась, откатывается и дописывается один раз"""
+    print("\n[TEST JOURNAL RETRY] Повтор пачки после ошибки записи")
+
+    with temp_archive():
+        archiver = ChatArchiver(999989)
+        user = MockUser(id=12345, first_name="Алия")
+        archiver.journal.flush().result()
+        size_before = archiver.history_file.stat().st_size
+
+        # Строки дошли до файла, но fsync упал - пачка должна быть откачена
+        real_fsync = os.fsync
+        def failing_fsync(fd):
+            raise OSError(28, "No space left on device")
+
+        archiver.journal.fsync = True
+        os.fsync = failing_fsync
+        try:
+            archiver.archive_text_message(MockMessage(chat_id=999989, user=user, text="не с первого раза"))
+            raise AssertionError("❌ Ошибка записи не передана")
+        except OSError:
+            pass
+        finally:
+            os.fsync = real_fsync
+        assert archiver.history_file.stat().st_size == size_before, "❌ Частичная запись не откачена"
+
+        archiver.archive_text_message(MockMessage(chat_id=999989, user=user, text="следующее"))
+        text = archiver.history_file.read_text(encoding='utf-8')
+        assert text.count("не с первого раза") == 1, "❌ Строка задвоена при повторе"
+        assert text.index("не с первого раза") < text.index("следующее"), "❌ Нарушен порядок строк"
+
+        print("✅ Неудачная пачка откачена и записана один раз")
+
+
+def test_history_segments():
+    """Помесячное оглавление: диапазоны байтов history.txt без копий текста"""
+    print("\n[TEST SEGMENTS] Оглавление истории manifest.json")
+
+    import json
+    from segments import SegmentStore
+
+    archiver = ChatArchiver(999997)
+    user = MockUser(id=12345, first_name="Алия")
+    archiver.archive_text_message(MockMessage(chat_id=999997, user=user, text="в оглавление"))
+    archiver.journal.flush(flush_sinks=True).result()
+
+    month = datetime.now().strftime('%Y-%m')
+    copies = [path.name for path in archiver.segments_dir.iterdir() if path.name != "manifest.json"]
+    assert not copies, f"❌ В history/ лежат копии истории: {copies}"
+
+    with open(archiver.manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    segment = next(s for s in manifest['segments'] if s['month'] == month)
+    history = archiver.history_file.read_bytes()
+    assert manifest['covered'] == len(history), "❌ Манифест учёл не весь history.txt"
+    text = b''.join(history[start:end] for start, end in segment['ranges']).decode('utf-8')
+    assert "в оглавление" in text, "❌ Диапазон месяца не указывает на строку"
+    assert segment['bytes'] == sum(end - start for start, end in segment['ranges']), "❌ Неверный размер"
+
+    # Отставший манифест (строки после последнего сохранения) досчитывается при загрузке
+    with open(archiver.history_file, 'ab') as f:
+        f.write(f"{datetime.now():[%d.%m %H:%M]} Алия: дописано без манифеста\n".encode('utf-8'))
+    store = SegmentStore(archiver.segments_dir, archiver.history_file)
+    store.load()
+    caught_up = next(s for s in store.segments if s['month'] == month)
+    assert caught_up['lines'] == segment['lines'] + 1, "❌ Хвост history.txt не досчитан"
+
+    print(f"✅ Месяц {month}: {segment['lines']} строк, диапазоны {segment['ranges']}")
+
+
+def test_cold_history():
+    """Сжатие холодного начала history.txt и events.jsonl с чтением по полным смещениям"""
+    print("\n[TEST COLD] Сжатие старых месяцев истории")
+
+    import gzip
+    from cold_storage import archive_size, cold_prefix_path, compact_chat
+    from event_log import iter_events
+    from history_reader import HistoryLines, read_window
+
+    with temp_archive():
+        archiver = ChatArchiver(999988)
+        old = datetime(2024, 1, 15, 10, 0)
+        for i in range(300):
+            line = f"{old:[%d.%m %H:%M]} Алия: старое сообщение номер {i}\n"
+            archiver.journal.append(line, old, {'kind': 'text', 'sender': 'Алия', 'text': f"старое {i}"})
+        now = datetime.now()
+        archiver.journal.append(f"{now:[%d.%m %H:%M]} Алия: свежее\n", now, {'kind': 'text', 'sender': 'Алия', 'text': "свежее"})
+        archiver.journal.flush(flush_sinks=True).result()
+        expected = archiver.history_file.read_bytes()
+        events_before = len(list(iter_events(archiver.events_file)))
+
+        summary = compact_chat(archiver.chat_dir, archiver.segments, now=now)
+        cold_file = cold_prefix_path(archiver.history_file)
+        assert cold_file.exists(), "❌ Начало history.txt не сжато"
+        restored = gzip.decompress(cold_file.read_bytes()) + archiver.history_file.read_bytes()
+        assert restored == expected, "❌ Сжатое начало + history.txt не совпадают с исходной историей"
+        assert archiver.history_file.read_text(encoding='utf-8').strip().endswith("свежее"), "❌ Тёплый месяц сжат"
+        assert summary['bytes_after'] < summary['bytes_before'], "❌ Файлы чата не уменьшились"
+        assert len(list(iter_events(archiver.events_file))) == events_before, "❌ События потерялись"
+
+        # Новые строки получают смещения в полной истории
+        archiver.journal.append(f"{now:[%d.%m %H:%M]} Алия: после сжатия\n", now, {'kind': 'text', 'sender': 'Алия'})
+        archiver.journal.flush(flush_sinks=True).result()
+        lines = (expected.decode('utf-8') + f"{now:[%d.%m %H:%M]} Алия: после сжатия\n").splitlines()
+        reader = HistoryLines(archiver.history_file, archiver.line_index_file)
+        assert reader.count() == len(lines), "❌ Неверное количество строк"
+        assert reader.tail(2) == lines[-2:], "❌ Неверные последние строки"
+        assert reader.lines(1, 2) == lines[:2], "❌ Строки из сжатого начала не читаются"
+        window = read_window(
+            archiver.history_file, archiver.time_index_file, datetime(2024, 1, 15), datetime(2024, 1, 15, 23, 59),
+        )
+        assert window['total'] == 300, f"❌ Окно старого месяца: {window['total']} строк"
+        assert archiver.segments.covered == archive_size(archiver.history_file), "❌ Оглавление отстало"
+
+        # Повторное сжатие без новых холодных строк ничего не переносит
+        assert compact_chat(archiver.chat_dir, archiver.segments, now=now)['files'] == 0
+
+        print(f"✅ Файлы чата: {summary['bytes_before']} -> {summary['bytes_after']} байт")
+
+
+def test_search_index():
+    """Полнотекстовый поиск: словоформы по префиксу, ранжирование, страницы, пересборка по history.txt"""
+    print("\n[TEST SEARCH] Полнотекстовый индекс истории")
+
+    from search_index import search, rebuild
+
+    with temp_archive():
+        archiver = ChatArchiver(999981)
+        user = MockUser(id=12345, first_name="Алия")
+        other = MockUser(id=54321, first_name="Тимур")
+        archiver.archive_text_message(MockMessage(999981, user, text="пришлите прайс на доставку"))
+        archiver.archive_text_message(MockMessage(999981, other, text="прайса пока нет, будет завтра"))
+        archiver.archive_text_message(MockMessage(999981, other, text="доставка в пятницу"))
+        for i in range(5):
+            archiver.archive_text_message(MockMessage(999981, user, text=f"обычное сообщение {i}"))
+        archiver.journal.flush(flush_sinks=True).result()
+
+        result = search(archiver.index_file, "прайс")
+        assert result['total'] == 2, f"❌ Не найдены словоформы: {result}"
+        assert {hit['sender'] for hit in result['hits']} == {"Алия", "Тимур"}, "❌ Неверные авторы"
+        assert all('«прайс' in hit['text'] for hit in result['hits']), "❌ Совпадение не выделено"
+        assert search(archiver.index_file, "прайс доставку")['total'] == 1, "❌ Слова запроса не объединены через AND"
+        assert search(archiver.index_file, 'прайс" OR "')['total'] == 0, "❌ Запрос не экранирован"
+
+        pages = search(archiver.index_file, "обычное", page=2, page_size=2)
+        assert pages['total'] == 5 and pages['pages'] == 3 and len(pages['hits']) == 2, f"❌ Неверные страницы: {pages}"
+
+        # Индекс, собранный заново по history.txt, находит то же
+        assert rebuild(archiver.history_file, archiver.index_file) == 8, "❌ Пересборка потеряла строки"
+        assert search(archiver.index_file, "прайс")['total'] == 2, "❌ Пересобранный индекс отличается"
+
+        print(f"✅ «прайс»: {result['total']} сообщения, «обычное»: {pages['pages']} страницы")
+
+
+def test_time_window():
+    """Чтение истории за период по разреженному индексу времени, в том числе через Новый год"""
+    print("\n[TEST WINDOW] Чтение истории за период")
+
+    from datetime import timedelta
+    from history_reader import HISTORY_INDEX_EVERY, read_window
+
+    archiver = ChatArchiver(999980)
+    first = datetime(2024, 11, 20, 0, 0)
+    hours = 4 * HISTORY_INDEX_EVERY
+    for i in range(hours):
+        when = first + timedelta(hours=i)
+        archiver.journal.append(f"{when:[%d.%m %H:%M]} Алия: час {i}\n", when, {'kind': 'text', 'sender': 'Алия'})
+    archiver.journal.flush(flush_sinks=True).result()
+    size = archiver.history_file.stat().st_size
+
+    def expected(start: datetime, end: datetime) -> list:
+        return [
+            f"{first + timedelta(hours=i):[%d.%m %H:%M]} Алия: час {i}"
+            for i in range(hours) if start <= first + timedelta(hours=i) <= end
+        ]
+
+    # Окно через Новый год: год строк восстанавливается по индексу
+    start, end = datetime(2024, 12, 31, 20, 0), datetime(2025, 1, 1, 3, 59)
+    window = read_window(archiver.history_file, archiver.time_index_file, start, end)
+    assert window['lines'] == expected(start, end), f"❌ Неверные строки окна: {window['lines']}"
+    assert window['bytes_read'] < size / 2, f"❌ Прочитано {window['bytes_read']} из {size} байт"
+
+    day = read_window(
+        archiver.history_file, archiver.time_index_file, datetime(2025, 1, 5), datetime(2025, 1, 5, 23, 59), 10,
+    )
+    assert day['total'] == 24 and len(day['lines']) == 10 and day['truncated'], f"❌ Неверное ограничение: {day}"
+    empty = read_window(archiver.history_file, archiver.time_index_file, datetime(2023, 1, 1), datetime(2023, 1, 2))
+    assert empty['total'] == 0, "❌ Найдены строки вне истории"
+
+    print(f"✅ {len(window['lines'])} строк через Новый год, прочитано {window['bytes_read']} из {size} байт")
+
+
+def test_parquet_export():
+    """Выгрузка в Parquet: новые события - новым файлом месяца, повторная выгрузка ничего не дублирует"""
+    print("\n[TEST PARQUET] Инкрементальная выгрузка events.jsonl")
+
+    import tempfile
+    from columnar_export import ParquetExporter, parquet_available
+
+    with temp_archive():
+        if not parquet_available():
+            print("⚠️ pyarrow не установлен - проверка пропущена")
+            return
+
+        import pyarrow.parquet as pq
+
+        archiver = ChatArchiver(999979)
+        export_dir = Path(tempfile.mkdtemp()) / "exports"
+        exporter = ParquetExporter(archiver.events_file, export_dir, min_events=10 ** 6)
+
+        def append(when: datetime, message_id: int):
+            archiver.journal.append(
+                f"{when:[%d.%m %H:%M]} Алия: сообщение {message_id}\n", when,
+                {'kind': 'text', 'sender': 'Алия', 'text': f"сообщение {message_id}", 'message_id': message_id},
+            )
+
+        for message_id, when in enumerate((datetime(2025, 2, 27, 12), datetime(2025, 2, 28, 12), datetime(2025, 3, 1, 12)), 1):
+            append(when, message_id)
+        archiver.journal.flush(flush_sinks=True).result()
+        assert exporter.export() == 3, "❌ Первая выгрузка неполная"
+        assert sorted(path.name for path in export_dir.iterdir() if path.is_dir()) == ["month=2025-02", "month=2025-03"]
+
+        append(datetime(2025, 3, 2, 9, 0), 4)
+        archiver.journal.flush(flush_sinks=True).result()
+        assert exporter.export() == 1, "❌ Выгружены не только новые события"
+        assert exporter.export() == 0, "❌ Повторная выгрузка без новых событий"
+        parts = sorted(path.name for path in (export_dir / "month=2025-03").glob("part-*.parquet"))
+        assert len(parts) == 2, f"❌ Новые события не отдельным файлом: {parts}"
+
+        table = pq.read_table(export_dir)
+        message_ids = sorted(table.column('message_id').to_pylist())
+        assert message_ids == [1, 2, 3, 4], f"❌ Неверные строки выгрузки: {message_ids}"
+
+        print(f"✅ Событий в Parquet: {len(message_ids)}, файлов за 2025-03: {len(parts)}")
+
+
+def test_history_lines():
+    """Количество, последние строки и диапазон строк по индексу строк"""
+    print("\n[TEST LINES] Индекс строк history.lidx")
+
+    from history_reader import HistoryLines, rebuild_line_index
+
+    archiver = ChatArchiver(999996)
+    user = MockUser(id=12345, first_name="Алия")
+    for i in range(5):
+        archiver.archive_text_message(MockMessage(chat_id=999996, user=user, text=f"строка {i}"))
+
+    expected = archiver.history_file.read_text(encoding='utf-8').splitlines()
+    reader = HistoryLines(archiver.history_file, archiver.line_index_file)
+    assert reader.count() == len(expected), "❌ Неверное количество строк"
+    assert reader.tail(2) == expected[-2:], "❌ Неверные последние строки"
+    assert reader.lines(2, 3) == expected[1:3], "❌ Неверный диапазон строк"
+
+    # Пересборка даёт тот же индекс
+    indexed = archiver.line_index_file.read_bytes()
+    assert rebuild_line_index(archiver.history_file, archiver.line_index_file) == len(expected)
+    assert archiver.line_index_file.read_bytes() == indexed, "❌ Пересобранный индекс отличается"
+
+    print(f"✅ Индекс строк: {reader.count()} строк")
+
+
+def test_index_recovery():
+    """Индексы строк и времени догоняют history.txt после пачки, которую не записали"""
+    print("\n[TEST INDEX RECOVERY] Досчёт пропущенной пачки индексов")
+
+    from history_reader import ENTRY_SIZE, LINE_ENTRY, HistoryLines, LineIndex, SparseTimeIndex
+
+    with temp_archive():
+        archiver = ChatArchiver(999987)
+        line_index = next(sink for sink in archiver.journal.sinks if isinstance(sink, LineIndex))
+        time_index = next(sink for sink in archiver.journal.sinks if isinstance(sink, SparseTimeIndex))
+
+        def append(hour: int):
+            timestamp = datetime(2025, 3, 1, hour, 0)
+            archiver.journal.append(f"{timestamp:[%d.%m %H:%M]} Алия: в {hour} часов\n", timestamp, {'kind': 'text'})
+
+        append(1)
+
+        def fail(records):
+            raise OSError(28, "No space left on device")
+
+        line_index.write_batch = fail
+        time_index.write_batch = fail
+        append(2)
+        del line_index.write_batch, time_index.write_batch
+
+        # Пока индекс отстал, строки читаются по history.txt
+        expected = archiver.history_file.read_text(encoding='utf-8').splitlines()
+        reader = HistoryLines(archiver.history_file, archiver.line_index_file)
+        assert reader.tail(1) == expected[-1:], "❌ Отставший индекс вернул чужую строку"
+
+        append(3)
+        expected = archiver.history_file.read_text(encoding='utf-8').splitlines()
+        lines = archiver.line_index_file.stat().st_size // LINE_ENTRY.size
+        assert lines == len(expected) == 3, f"❌ Индекс строк: {lines} из {len(expected)}"
+        assert reader.lines(2, 2) == expected[1:2], "❌ Пропущенная строка не попала в индекс"
+        entries = archiver.time_index_file.stat().st_size // ENTRY_SIZE
+        assert entries == 3, f"❌ Индекс времени: {entries} записей из 3"
+
+        # После перезапуска недописанная запись индекса отрезается
+        with open(archiver.line_index_file, 'ab') as f:
+            f.write(b'\x01\x02\x03')
+        archiver.close()
+        archiver = ChatArchiver(999987)
+        append(4)
+        assert HistoryLines(archiver.history_file, archiver.line_index_file).count() == 4, "❌ Индекс не сверен при загрузке"
+        assert archiver.line_index_file.stat().st_size == 4 * LINE_ENTRY.size, "❌ Обрывок записи остался в индексе"
+
+        print("✅ Пропущенная пачка досчитана в индексах строк и времени")
+
+
+def test_archiver_registry():
+    """Закреплённый архиватор (идёт скачивание или запрос) не вытесняется из реестра"""
+    print("\n[TEST REGISTRY] Вытеснение архиваторов с закреплением")
+
+    from archiver import ArchiverRegistry
+
+    registry = ArchiverRegistry(max_size=1)
+    with registry.pinned(999986) as pinned:
+        registry.get(999985)
+        assert registry.peek(999986) is pinned, "❌ Закреплённый архиватор вытеснен"
+        assert len(registry) == 2
+
+    # После открепления реестр возвращается к max_size, вытесняя давно неактивный
+    assert registry.peek(999986) is None and registry.peek(999985) is not None, "❌ Неверный порядок вытеснения"
+    assert registry.get_stats()['evictions'] == 1
+    registry.close_all()
+
+    print("✅ Закреплённый архиватор вытесняется только после открепления")
+
+
+def test_chat_stats():
+    """Сводки активности обновляются при записи и досчитываются после сбоя"""
+    print("\n[TEST STATS] Сводки активности stats.json")
+
+    from chat_stats import load_stats, rebuild_stats
+
+    with temp_archive():
+        archiver = ChatArchiver(999995)
+        user = MockUser(id=12345, first_name="Алия")
+        for i in range(3):
+            archiver.archive_text_message(MockMessage(chat_id=999995, user=user, text=f"сообщение {i}"))
+        archiver.journal.flush(flush_sinks=True).result()
+
+        stats = load_stats(archiver.stats_file)
+        assert stats['users']['Алия']['messages'] == 3, "❌ Неверное число сообщений участника"
+        assert sum(stats['hours']) == 3 and sum(stats['days'].values()) == 3, "❌ Неверные гистограммы"
+        assert stats['offset'] == archiver.events_file.stat().st_size, "❌ Неверное смещение сводок"
+
+        # Сводки, пересчитанные по events.jsonl, совпадают с инкрементальными
+        rebuilt = rebuild_stats(archiver.events_file, archiver.stats_file)
+        assert rebuilt == stats, "❌ Пересчёт не совпадает с инкрементальными сводками"
+
+        print(f"✅ Сводки: {stats['users']['Алия']['messages']} сообщений у Алия")
+
+
+def test_recent_window():
+    """history_recent.txt содержит последние строки истории, пересборка - по числу строк и давности"""
+    print("\n[TEST RECENT] Последние строки history_recent.txt")
+
+    from history_reader import rebuild_recent
+
+    archiver = ChatArchiver(999994)
+    user = MockUser(id=12345, first_name="Алия")
+    old = datetime(2024, 1, 15, 10, 0)
+    archiver.journal.append(f"{old:[%d.%m %H:%M]} Алия: старое\n", old, {'kind': 'text', 'sender': 'Алия'})
+    for i in range(5):
+        archiver.archive_text_message(MockMessage(chat_id=999994, user=user, text=f"недавнее {i}"))
+    archiver.journal.flush(flush_sinks=True).result()
+
+    history = archiver.history_file.read_text(encoding='utf-8').splitlines()
+    recent = archiver.recent_file.read_text(encoding='utf-8').splitlines()
+    assert recent == history, "❌ history_recent.txt не совпадает с концом истории"
+
+    # Окно меньше истории - только последние строки
+    assert rebuild_recent(archiver.history_file, archiver.line_index_file, archiver.recent_file, max_lines=3) == 3
+    recent = archiver.recent_file.read_text(encoding='utf-8').splitlines()
+    assert recent == history[-3:], "❌ В окне не последние строки"
+
+    # Ограничение по давности отбрасывает старые строки
+    assert rebuild_recent(
+        archiver.history_file, archiver.line_index_file, archiver.recent_file, max_days=1,
+    ) == 5, "❌ Неверное число строк окна"
+    assert "старое" not in archiver.recent_file.read_text(encoding='utf-8'), "❌ Старая строка осталась в окне"
+
+    print(f"✅ history_recent.txt: {len(recent)} последних строк")
+
+
+def test_dedup():
+    """Повторно доставленное сообщение распознаётся и после перезапуска"""
+    print("\n[TEST DEDUP] Отсев повторов по message_id")
+
+    import asyncio
+    from dedup import SeenMessages
+
+    with temp_archive():
+        archiver = ChatArchiver(999993)
+        user = MockUser(id=12345, first_name="Алия")
+        message = MockMessage(chat_id=999993, user=user, text="один раз", message_id=101)
+
+        assert not asyncio.run(archiver.is_duplicate(message)), "❌ Новое сообщение принято за повтор"
+        # Пока сообщение не записано (например, не скачался файл), повтор обрабатывается заново
+        assert not asyncio.run(archiver.is_duplicate(message)), "❌ Незаписанное сообщение отсеяно как повтор"
+        archiver.archive_text_message(message)
+        assert asyncio.run(archiver.is_duplicate(message)), "❌ Повтор не распознан"
+        archiver.journal.flush().result()
+
+        # После перезапуска окно восстанавливается из seen_ids.bin
+        seen = SeenMessages(archiver.seen_file)
+        seen.load()
+        assert seen.check(101), "❌ Повтор не распознан после перезапуска"
+        assert not seen.check(102), "❌ Новое сообщение принято за повтор после перезапуска"
+
+        print("✅ Повторы отсеиваются в памяти и после перезапуска")
+
+
+def test_media_queue():
+    """Заполненная очередь скачивания притормаживает постановку, не превышая лимитов параллельности"""
+    print("\n[TEST MEDIA QUEUE] Лимиты параллельности при переполнении")
+
+    import asyncio
+    from media_queue import MediaDownloadQueue
+
+    active = {'total': 0, 'max_total': 0}
+    per_chat = {}
+    max_per_chat = {}
+
+    def download(chat_id: int):
+        async def run():
+            active['total'] += 1
+            per_chat[chat_id] = per_chat.get(chat_id, 0) + 1
+            active['max_total'] = max(active['max_total'], active['total'])
+            max_per_chat[chat_id] = max(max_per_chat.get(chat_id, 0), per_chat[chat_id])
+            await asyncio.sleep(0.01)
+            active['total'] -= 1
+            per_chat[chat_id] -= 1
+        return run
+
+    async def scenario():
+        queue = MediaDownloadQueue(workers=3, per_chat=2, max_size=4)
+        # Воркеры запускаются при первой постановке
+        futures = [await queue.submit(i % 2, 100, download(i % 2), f"file {i}") for i in range(20)]
+        results = await asyncio.gather(*futures)
+        await queue.drain()
+        return queue, results
+
+    queue, results = asyncio.run(scenario())
+    assert all(results), "❌ Не все файлы скачаны"
+    assert active['max_total'] <= 3, f"❌ Одновременных скачиваний: {active['max_total']}"
+    assert max(max_per_chat.values()) <= 2, f"❌ Одновременных скачиваний в чате: {max_per_chat}"
+    assert queue.get_stats()['throttled'] > 0, "❌ Очередь не переполнялась"
+
+    print(f"✅ Скачиваний: {queue.completed}, одновременно до {active['max_total']}, в чате до {max(max_per_chat.values())}")
+
+
+def test_media_store():
+    """Общее хранилище медиа: один файл на содержимое, ссылки по file_unique_id, удаление с последней ссылкой"""
+    print("\n[TEST MEDIA STORE] Дедупликация медиафайлов")
+
+    import tempfile
+    from media_store import MediaStore
+
+    base = Path(tempfile.mkdtemp())
+    store = MediaStore(base / "blobs")
+    first, second, third = (base / f"chat_{i}" / "media" / "photo.jpg" for i in (1, 2, 3))
+
+    temp = store.temp_path("a.jpg")
+    temp.parent.mkdir(parents=True, exist_ok=True)
+    temp.write_bytes(b"jpeg" * 100)
+    sha256 = store.ingest(temp, first, file_unique_id="uniq-1")
+
+    # Тот же файл с другим file_unique_id - совпадение по содержимому
+    temp = store.temp_path("b.jpg")
+    temp.write_bytes(b"jpeg" * 100)
+    assert store.ingest(temp, second, file_unique_id="uniq-2") == sha256, "❌ Хэш содержимого отличается"
+    # Известный file_unique_id - без скачивания
+    assert store.link_known("uniq-1", third), "❌ Файл не найден по file_unique_id"
+    assert not store.link_known("uniq-unknown", base / "missing.jpg"), "❌ Найден неизвестный file_unique_id"
+
+    assert first.read_bytes() == second.read_bytes() == third.read_bytes() == b"jpeg" * 100
+    stats = store.get_stats()
+    assert stats['blobs'] == 1 and stats['files'] == 3, f"❌ Файл хранится не один раз: {stats}"
+    assert stats['downloads_skipped'] == 1 and stats['content_duplicates'] == 1, f"❌ Неверные счётчики: {stats}"
+    assert stats['bytes_saved'] == 800, f"❌ Неверная экономия: {stats}"
+
+    # Файл хранилища удаляется только вместе с последней ссылкой
+    assert store.unlink(first) == 0 and store.unlink(second) == 0, "❌ Место освобождено при живых ссылках"
+    assert store.blob_path(sha256).exists(), "❌ Файл хранилища удалён раньше времени"
+    assert store.unlink(third) == 400, "❌ Последняя ссылка не освободила место"
+    assert not store.blob_path(sha256).exists(), "❌ Файл хранилища остался без ссылок"
+    assert not store.link_known("uniq-1", first), "❌ Удалённый файл найден по file_unique_id"
+    store.close()
+
+    print(f"✅ 3 ссылки на 1 файл, сэкономлено {stats['bytes_saved']} байт")
+
+
+def test_media_store_concurrent_save():
+    """Одновременные скачивания с одинаковым именем файла в разных чатах не делят временный файл"""
+    print("\n[TEST MEDIA STORE] Параллельные скачивания с одним именем")
+
+    import asyncio
+    import tempfile
+    from types import SimpleNamespace
+    from archive_io import ArchiveWriter
+    from media_store import MediaStore
+
+    base = Path(tempfile.mkdtemp())
+    store = MediaStore(base / "blobs")
+    writer = ArchiveWriter(workers=2)
+
+    class SlowBot:
+        async def download(self, file, destination):
+            # Запись в два приёма: второй вызов успевает начать свою до окончания первой
+            with open(destination, 'wb') as f:
+                f.write(file.content[:2])
+                await asyncio.sleep(0.05)
+                f.write(file.content[2:])
+
+    files = {
+        chat_id: SimpleNamespace(file_unique_id=f"uniq-{chat_id}", content=f"чат {chat_id}".encode() * 50)
+        for chat_id in (1, 2)
+    }
+    destinations = {chat_id: base / f"chat_{chat_id}" / "media" / "photo.jpg" for chat_id in files}
+
+    async def scenario():
+        return await asyncio.gather(*(
+            store.save(SlowBot(), files[chat_id], destinations[chat_id], writer, chat_id) for chat_id in files
+        ))
+
+    downloaded = asyncio.run(scenario())
+    writer.shutdown()
+    assert downloaded == [True, True], f"❌ Файлы не скачивались: {downloaded}"
+    for chat_id, file in files.items():
+        assert destinations[chat_id].read_bytes() == file.content, f"❌ В чате {chat_id} чужое содержимое"
+    assert store.get_stats()['blobs'] == 2, f"❌ Содержимое чатов смешалось: {store.get_stats()}"
+    assert not any(store.tmp_dir.iterdir()), "❌ Остались временные файлы"
+    store.close()
+
+    print("✅ Каждый чат получил своё содержимое")
+
+
+def test_storage_quota():
+    """Квота чата: сначала файлы агента, затем давно не использованные медиа; удаление отмечается в истории"""
+    print("\n[TEST QUOTA] Удаление файлов по квоте хранилища")
+
+    import time
+    import asyncio
+    import tempfile
+    from storage_quota import StorageQuota, AGENT_FILES, MEDIA
+
+    archiver = ChatArchiver(999982)
+    archiver.journal.flush().result()
+    quota = StorageQuota(Path(tempfile.mkdtemp()) / "usage.sqlite", chat_quota=500)
+
+    paths = {}
+    for category, name in ((MEDIA, "old.jpg"), (MEDIA, "new.jpg"), (AGENT_FILES, "chart.png")):
+        directory = archiver.media_dir if category == MEDIA else archiver.agent_files_dir
+        paths[name] = directory / name
+        paths[name].write_bytes(b"x" * 400)
+        quota.record(999982, category, paths[name])
+        time.sleep(0.01)
+    # old.jpg отправили пользователю - теперь он использован позже new.jpg
+    quota.touch(paths["old.jpg"])
+
+    assert quota.usage(999982) == 1200 and quota.is_over_quota(999982), "❌ Превышение квоты не замечено"
+    # Удаление до 90% квоты: 1200 - 450 байт - файл агента и один файл медиа
+    plan = quota.plan_eviction(999982)
+    assert [Path(candidate.path).name for candidate in plan] == ["chart.png", "new.jpg"], \
+        f"❌ Неверный порядок удаления: {[candidate.path for candidate in plan]}"
+
+    assert quota.evict(plan[0]) == 400 and not paths["chart.png"].exists(), "❌ Файл агента не удалён"
+    asyncio.run(archiver.evict_file(plan[1]))
+    archiver.journal.flush().result()
+    assert not paths["new.jpg"].exists() and paths["old.jpg"].exists(), "❌ Удалён не тот файл медиа"
+    last_line = archiver.history_file.read_text(encoding='utf-8').splitlines()[-1]
+    assert "🗑️" in last_line and "media/new.jpg" in last_line, f"❌ Удаление не отмечено в истории: {last_line}"
+    quota.close()
+
+    print(f"✅ Удалены по очереди: {', '.join(Path(candidate.path).name for candidate in plan)}")
+
+
+def test_media_groups():
+    """Альбомы: части собираются по (чат, media_group_id) и передаются одним вызовом по порядку"""
+    print("\n[TEST ALBUMS] Сборка альбомов")
+
+    import asyncio
+    from media_groups import MediaGroupCollector, MEDIA_GROUP_MAX_PARTS
+
+    user = MockUser(id=12345, first_name="Алия")
+
+    def part(chat_id: int, group: str, message_id: int) -> MockMessage:
+        message = MockMessage(chat_id, user, message_id=message_id)
+        message.media_group_id = group
+        return message
+
+    async def scenario():
+        albums = []
+
+        async def handler(parts):
+            albums.append([(message.chat.id, message.media_group_id, message.message_id) for message in parts])
+
+        collector = MediaGroupCollector(handler, window=0.05)
+        for message in (part(1, "a", 3), part(1, "a", 1), part(1, "b", 5), part(2, "a", 7), part(1, "a", 2)):
+            collector.add(message)
+        assert collector.pending() == 3 and not albums, "❌ Альбом обработан до конца окна"
+        await asyncio.sleep(0.2)
+
+        # Полный альбом обрабатывается сразу, без ожидания окна
+        for message_id in range(MEDIA_GROUP_MAX_PARTS):
+            collector.add(part(1, "full", message_id))
+        await asyncio.sleep(0)
+        full = [album for album in albums if album[0][1] == "full"]
+        assert len(full) == 1 and len(full[0]) == MEDIA_GROUP_MAX_PARTS, "❌ Полный альбом ждёт окна"
+
+        # Недособранный альбом обрабатывается при остановке
+        collector.add(part(3, "late", 9))
+        await collector.drain(timeout=5)
+        return albums, collector.get_stats()
+
+    albums, stats = asyncio.run(scenario())
+    assert [(1, "a", 1), (1, "a", 2), (1, "a", 3)] in albums, f"❌ Части альбома не собраны по порядку: {albums}"
+    assert [(1, "b", 5)] in albums and [(2, "a", 7)] in albums, "❌ Альбомы разных групп или чатов смешаны"
+    assert [(3, "late", 9)] in albums, "❌ Недособранный альбом потерян при остановке"
+    assert stats['albums'] == 5 and stats['pending'] == 0, f"❌ Неверные метрики: {stats}"
+
+    print(f"✅ Альбомов {stats['albums']}, частей {stats['parts']}")
+
+
+def test_media_layout():
+    """Перенос плоской media/ по месяцам и старые пути через таблицу переноса"""
+    print("\n[TEST MEDIA LAYOUT] Раскладка media/YYYY/MM/")
+
+    from media_layout import migrate_chat, resolve_media_path
+
+    with temp_archive():
+        archiver = ChatArchiver(999992)
+        archiver.journal.flush().result()
+        old_file = archiver.media_dir / "photo_20250312_101500.jpg"
+        old_file.write_bytes(b"jpeg")
+
+        assert migrate_chat(archiver.chat_dir) == 1, "❌ Файл не перенесён"
+        moved = archiver.media_dir / "2025" / "03" / old_file.name
+        assert moved.exists() and not old_file.exists(), "❌ Файл не в папке месяца"
+        assert resolve_media_path(str(old_file)) == str(moved), "❌ Старый путь не находит файл"
+        assert migrate_chat(archiver.chat_dir) == 0, "❌ Повторный перенос не должен ничего делать"
+
+        print(f"✅ {old_file.name} → media/2025/03/")
+
+
+def test_media_naming():
+    """Имена файлов без проверок на диске: одна секунда и одно имя документа не дают совпадений"""
+    print("\n[TEST MEDIA NAMES] Имена файлов media/")
+
+    import asyncio
+
+    with temp_archive():
+        class MockFile:
+            def __init__(self, file_unique_id, file_name=None):
+                self.file_unique_id = file_unique_id
+                self.file_name = file_name
+
+        class MockBot:
+            async def download(self, file, destination):
+                Path(destination).write_bytes(file.file_unique_id.encode())
+
+        archiver = ChatArchiver(999978)
+        user = MockUser(id=12345, first_name="Алия")
+
+        def media_message(message_id, photo=None, document=None):
+            message = MockMessage(999978, user, message_id=message_id)
+            message.photo = [photo] if photo else None
+            message.document = document
+            return message
+
+        async def scenario():
+            bot = MockBot()
+            # Два фото в одну секунду и два документа с одинаковым именем
+            await archiver.archive_photo(media_message(201, photo=MockFile("p1")), bot)
+            await archiver.archive_photo(media_message(202, photo=MockFile("p2")), bot)
+            await archiver.archive_document(media_message(203, document=MockFile("d1", "report.xlsx")), bot)
+            await archiver.archive_document(media_message(204, document=MockFile("d2", "report.xlsx")), bot)
+            # Без message_id имя различает file_unique_id
+            await archiver.archive_photo(media_message(None, photo=MockFile("p3")), bot)
+            await archiver.flush()
+
+        asyncio.run(scenario())
+        names = sorted(path.name for path in archiver.media_dir.rglob('*') if path.is_file())
+        assert len(names) == 5, f"❌ Файлы перезаписали друг друга: {names}"
+        assert "report_203.xlsx" in names and "report_204.xlsx" in names, f"❌ Документы без ID сообщения: {names}"
+        assert any(name.endswith("_201.jpg") for name in names) and any(name.endswith("_p3.jpg") for name in names)
+        history = archiver.history_file.read_text(encoding='utf-8')
+        assert all(name in history for name in names), "❌ Не все файлы упомянуты в истории"
+
+        print(f"✅ Файлы: {', '.join(names)}")
+
+
+def test_sessions():
+    """Лимит живых сессий агента, вытеснение LRU и закрытие простаивающих"""
+    print("\n[TEST SESSIONS] Сессии агента")
+
+    import asyncio
+    from sessions import SessionManager
+
+    class FakeClient:
+        def __init__(self):
+            self.closed = False
+
+        async def __aexit__(self, *args):
+            self.closed = True
+
+    async def scenario():
+        sessions = SessionManager(timeout=60, max_sessions=2, reaper_interval=0)
+        clients = {}
+
+        async def create(chat_id):
+            clients[chat_id] = FakeClient()
+            return clients[chat_id]
+
+        for chat_id in (1, 2):
+            await sessions.acquire(chat_id, lambda: create(chat_id))
+            sessions.release(chat_id)
+
+        # Чат 1 активнее - вытесняется давно неактивный чат 2
+        await sessions.acquire(1, lambda: create(1))
+        sessions.release(1)
+        await sessions.acquire(3, lambda: create(3))
+        assert clients[2].closed and 2 not in sessions, "❌ Не вытеснена давно неактивная сессия"
+        assert len(sessions) == 2, "❌ Превышен лимит сессий"
+
+        # Простаивающая сессия закрывается, занятая (чат 3) - нет
+        sessions.timeout = 0
+        await asyncio.sleep(0.01)
+        assert await sessions.reap() == 1, "❌ Простаивающая сессия не закрыта"
+        assert clients[1].closed and not clients[3].closed, "❌ Закрыта занятая сессия"
+
+        sessions.release(3)
+        await sessions.close_all(deadline=5)
+        assert clients[3].closed and len(sessions) == 0, "❌ Сессии не закрыты при остановке"
+        return sessions.get_stats()
+
+    stats = asyncio.run(scenario())
+    assert stats['evicted'] == 1 and stats['reaped'] == 1, f"❌ Неверные счётчики: {stats}"
+    print(f"✅ Вытеснено {stats['evicted']}, закрыто по простою {stats['reaped']}")
+
+
+
+def test_client_pool():
+    """Пул заранее запущенных клиентов: выдача из пула, пополнение и размер по частоте сессий"""
+    print("\n[TEST CLIENT POOL] Пул клиентов агента")
+
+    import asyncio
+    from client_pool import ClientPool
+    from agent_tools import ArchiveBinding
+
+    async def scenario():
+        started, stopped = [], []
+
+        async def start():
+            await asyncio.sleep(0.01)
+            started.append(len(started) + 1)
+            return started[-1]
+
+        async def stop(item):
+            stopped.append(item)
+
+        pool = ClientPool(start, stop, min_size=1, max_size=3, rate_window=60, check_interval=0.05)
+        pool.start()
+        await asyncio.sleep(0.1)
+        assert pool.get_stats()['ready'] == 1, "❌ Пул не прогрет"
+
+        assert pool.take() == 1, "❌ Клиент не выдан из пула"
+        assert pool.take() is None, "❌ Пустой пул выдал клиента"
+        await asyncio.sleep(0.1)
+        assert pool.get_stats()['ready'] >= 1, "❌ Пул не пополнен"
+
+        # Редкие сессии - пул не растёт; частые (3 за секунду при запуске ~5 с) - до max_size
+        assert pool.target_size() == 1, f"❌ Пул вырос без нагрузки: {pool.target_size()}"
+        busy = ClientPool(start, stop, min_size=1, max_size=3, rate_window=1)
+        for _ in range(3):
+            assert busy.take() is None
+        assert busy.target_size() == 3, f"❌ Размер пула не вырос: {busy.target_size()}"
+
+        await pool.close(deadline=5)
+        stats = pool.get_stats()
+        assert stats['ready'] == 0 and stopped, "❌ Клиенты не остановлены"
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats['hits'] == 1 and stats['misses'] == 1, f"❌ Неверные счётчики: {stats}"
+
+    # Клиент из пула получает файлы только своего чата - после привязки и в её пределах
+    binding = ArchiveBinding()
+    assert binding.check_tool_call("Read", {'file_path': "/tmp/x"}, "/") is not None, "❌ Непривязанный клиент читает файлы"
+    archiver = ChatArchiver(999983)
+    binding.bind(999983, archiver.get_archive_paths())
+    chat_dir = str(archiver.chat_dir)
+    allowed = [
+        ("Read", {'file_path': str(archiver.history_file)}, "/"),
+        ("Glob", {'pattern': "*.xlsx", 'path': str(archiver.media_dir)}, "/"),
+        ("Bash", {'command': f"cd {chat_dir} && python3 -c 'print(4 / 2)'"}, "/"),
+    ]
+    denied = [
+        ("Read", {'file_path': "/etc/passwd"}, chat_dir),
+        ("Grep", {'pattern': "x"}, "/"),
+        ("Bash", {'command': "cat .env"}, "/"),
+        ("Bash", {'command': "cat ../chat_999999/history.txt"}, chat_dir),
+        ("Bash", {'command': "python3 -c \"open('/etc/passwd')\""}, chat_dir),
+    ]
+    for call in allowed:
+        assert binding.check_tool_call(*call) is None, f"❌ Отклонён вызов в папке чата: {call}"
+    for call in denied:
+        assert binding.check_tool_call(*call) is not None, f"❌ Разрешён вызов вне папки чата: {call}"
+    archiver.close()
+    print(f"✅ Из пула {stats['hits']}, холодных {stats['misses']}, запущено в фоне {stats['started']}")
+
+
+def test_agent_scheduler():
+    """Очередь запросов к агенту: по одному на чат, чаты по кругу, отказ при переполнении"""
+    print("\n[TEST SCHEDULER] Очередь запросов к агенту")
+
+    import asyncio
+    from agent_scheduler import AgentScheduler, AgentQueueFull
+
+    async def scenario():
+        scheduler = AgentScheduler(max_concurrent=1, chat_queue_limit=2, queue_limit=10)
+        order, positions = [], {}
+        gate = asyncio.Event()
+
+        async def job(name):
+            order.append(name)
+            await gate.wait()
+            return name
+
+        def submit(chat_id, name):
+            async def on_position(position):
+                positions.setdefault(name, []).append(position)
+            return asyncio.create_task(scheduler.run(chat_id, lambda: job(name), on_position))
+
+        tasks = [submit(1, "a1"), submit(1, "a2"), submit(1, "a3"), submit(2, "b1")]
+        await asyncio.sleep(0.01)
+
+        # Очередь чата 1 заполнена (a2, a3) - четвёртый запрос отклоняется
+        try:
+            await scheduler.run(1, lambda: job("a4"))
+            raise AssertionError("❌ Переполненная очередь чата приняла запрос")
+        except AgentQueueFull:
+            pass
+
+        gate.set()
+        results = await asyncio.gather(*tasks)
+        return scheduler.get_stats(), order, positions, results
+
+    stats, order, positions, results = asyncio.run(scenario())
+    # Чат 2 получает место раньше второго запроса чата 1
+    assert order == ["a1", "b1", "a2", "a3"], f"❌ Чаты не чередуются: {order}"
+    assert positions["b1"][0] == 1 and positions["a2"][0] == 2, f"❌ Неверные места: {positions}"
+    assert positions["a2"][-1] == 0, "❌ Не сообщено о начале выполнения"
+    assert stats['rejected'] == 1 and stats['completed'] == 4, f"❌ Неверные счётчики: {stats}"
+    print(f"✅ Порядок {' → '.join(order)}, отклонено {stats['rejected']}")
+
+
+def test_list_media():
+    """Список файлов чата для агента: месяцы и плоская раскладка, фильтры, сжатые копии"""
+    print("\n[TEST LIST MEDIA] Файлы чата для агента")
+
+    from media_catalog import list_media, resolve_chat_file
+
+    archiver = ChatArchiver(999991)
+    archiver.journal.flush().result()
+    month_dir = archiver.media_dir / "2025" / "03"
+    month_dir.mkdir(parents=True, exist_ok=True)
+    (month_dir / "photo_20250312_101500_5.jpg").write_bytes(b"jpeg")
+    (month_dir / "report_6.csv.gz").write_bytes(b"gz")
+    (month_dir / "report_6.csv.gz.idx").write_bytes(b"idx")
+    (archiver.media_dir / "old_1.xlsx").write_bytes(b"xlsx")
+
+    result = list_media(archiver.media_dir)
+    assert result['total'] == 3, f"❌ Неверное число файлов: {result['total']}"
+    documents = list_media(archiver.media_dir, kind='document', month='2025-03')
+    assert [item['name'] for item in documents['files']] == ["report_6.csv"], "❌ Не работают фильтры"
+    assert documents['files'][0]['compressed'], "❌ Сжатый документ не отмечен"
+
+    try:
+        resolve_chat_file(archiver.chat_dir, "/etc/passwd")
+        raise AssertionError("❌ Путь вне папки чата принят")
+    except ValueError:
+        pass
+
+    print(f"✅ Файлов: {result['total']}, документов за 2025-03: {documents['total']}")
+
+
+def test_answer_cache():
+    """Кэш ответов: вопросы боту не меняют версию архива, новые сообщения - меняют"""
+    print("\n[TEST ANSWER CACHE] Кэш ответов агента")
+
+    from datetime import date, timedelta
+    from answer_cache import AnswerCache, normalize_question, is_follow_up
+
+    archiver = ChatArchiver(999990)
+    user = MockUser(id=12345, first_name="Алия")
+    cache = AnswerCache(max_size=2, ttl=60)
+
+    question = normalize_question("@bot Сколько сообщений?!")
+    assert question == normalize_question("сколько  СООБЩЕНИЙ"), "❌ Вопросы не нормализуются"
+    assert is_follow_up(normalize_question("а за прошлую неделю?")), "❌ Уточнение не распознано"
+    assert not is_follow_up(question), "❌ Самостоятельный вопрос принят за уточнение"
+
+    version = archiver.version
+    archiver.archive_text_message(MockMessage(999990, user, text="@bot сколько сообщений?"), is_query=True)
+    archiver.archive_bot_response("42")
+    assert archiver.version == version, "❌ Вопрос или ответ бота изменил версию архива"
+
+    cache.put(999990, question, version, "42", 0.05)
+    assert cache.get(999990, question, archiver.version) == "42", "❌ Ответ не найден в кэше"
+
+    # На следующий день тот же вопрос ("что было вчера?") считается заново
+    tomorrow = date.today() + timedelta(days=1)
+    assert cache.get(999990, question, archiver.version, tomorrow) is None, "❌ Вчерашний ответ выдан сегодня"
+
+    archiver.archive_text_message(MockMessage(999990, user, text="новое сообщение"))
+    assert archiver.version != version, "❌ Новое сообщение не изменило версию архива"
+    assert cache.get(999990, question, archiver.version) is None, "❌ Устаревший ответ выдан из кэша"
+    archiver.journal.flush().result()
+
+    stats = cache.get_stats()
+    assert stats['hits'] == 1 and stats['saved_cost_usd'] == 0.05, f"❌ Неверные счётчики: {stats}"
+    print(f"✅ Попаданий {stats['hits']} из {stats['hits'] + stats['misses']}, сэкономлено ${stats['saved_cost_usd']}")
+
+
+def test_import():
+    """Импорт выгрузки result.json: порядок по точному времени, файлы, продолжение после сбоя"""
+    print("\n[TEST IMPORT] Импорт выгрузки Telegram Desktop")
+
+    import json
+    import tempfile
+    from event_log import iter_events
+    from importer import ExportImporter, IMPORT_DIR_NAME
+
+    with temp_archive():
+        archiver = ChatArchiver(999984)
+        user = MockUser(id=12345, first_name="Алия")
+        archiver.archive_text_message(MockMessage(999984, user, text="бот уже в чате", message_id=1000))
+        archiver.close()
+
+        export_dir = Path(tempfile.mkdtemp())
+        (export_dir / "photos").mkdir()
+        (export_dir / "photos" / "p.jpg").write_bytes(b"jpeg")
+        (export_dir / "round_video_messages").mkdir()
+        (export_dir / "round_video_messages" / "v.mp4").write_bytes(b"mp4")
+        messages = [
+            {'id': 1, 'type': 'message', 'date': '2020-02-29T10:00:00', 'from': 'Алия', 'text': 'високосный день'},
+            {'id': 2, 'type': 'message', 'date': '2021-01-05T09:30:00', 'from': 'Алия', 'text': '',
+             'photo': 'photos/p.jpg'},
+            {'id': 3, 'type': 'message', 'date': '2021-06-01T12:00:00', 'from': 'Алия', 'text': '',
+             'file': 'round_video_messages/v.mp4', 'media_type': 'video_message'},
+            {'id': 4, 'type': 'service', 'date': '2022-03-01T08:00:00', 'actor': 'Тимур',
+             'action': 'invite_members', 'members': ['Тимур']},
+            {'id': 5, 'type': 'message', 'date': '2022-03-02T18:45:00', 'from': 'Тимур', 'text': 'привет'},
+            {'id': 1000, 'type': 'message', 'date': datetime.now().isoformat(), 'from': 'Алия', 'text': 'бот уже в чате'},
+        ]
+        with open(export_dir / "result.json", 'w', encoding='utf-8') as f:
+            json.dump({'name': 'Тест', 'messages': messages}, f, ensure_ascii=False)
+
+        class CrashAfterHistory(ExportImporter):
+            """Сбой после замены history.txt, до слияния событий"""
+            def _merge_events(self):
+                raise RuntimeError("сбой импорта")
+
+        archive_base = str(archiver.chat_dir.parent)
+        try:
+            CrashAfterHistory(999984, export_dir, archive_base).run()
+            raise AssertionError("❌ Сбой не сымитирован")
+        except RuntimeError:
+            pass
+        checkpoint = json.loads((archiver.chat_dir / IMPORT_DIR_NAME / "checkpoint.json").read_text())
+        assert checkpoint['phase'] == 'history_merged', f"❌ Этап не записан: {checkpoint['phase']}"
+
+        result = ExportImporter(999984, export_dir, archive_base).run()
+        assert result['messages'] == 5 and result['skipped'] == 1, f"❌ Неверные итоги: {result}"
+
+        lines = archiver.history_file.read_text(encoding='utf-8').splitlines()
+        assert len(lines) == 6, f"❌ Строки потеряны или повторены: {lines}"
+        assert lines[0].startswith("[29.02 10:00]") and "високосный" in lines[0], "❌ Строка 29.02 потеряна"
+        assert "photo_20210105_093000_2.jpg" in lines[1], "❌ Неверный порядок строк"
+        assert "Тимур присоединился" in lines[3] and lines[4].endswith("привет"), "❌ Неверный порядок строк"
+        assert lines[5].endswith("бот уже в чате"), "❌ Строка архива не в конце"
+
+        events = list(iter_events(archiver.events_file))
+        assert len(events) == 6, f"❌ Неверное число событий: {len(events)}"
+        assert [event.ts for event in events] == sorted(event.ts for event in events), "❌ События не по времени"
+        assert (archiver.media_dir / "2021" / "06" / "videonote_20210601_120000_3.mp4").exists(), \
+            "❌ Видеосообщение не скопировано под общим префиксом"
+        assert not (archiver.chat_dir / IMPORT_DIR_NAME).exists(), "❌ Промежуточные файлы не удалены"
+
+        print(f"✅ Импортировано {result['messages']} сообщений, строк истории {len(lines)}, событий {len(events)}")
+
 if __name__ == '__main__':
     print("="*70)
     print("  ТЕСТИРОВАНИЕ МОДУЛЯ АРХИВАЦИИ (Задачи 1.1-1.3)")
@@ -171,7 +1297,35 @@ if __name__ == '__main__':
         archiver = test_directory_creation()
         test_text_message_archiving(archiver)
         test_system_events(archiver)
+        test_event_log()
         test_archive_paths()
+        test_archive_writer()
+        test_journal_batching()
+        test_journal_retry()
+        test_history_segments()
+        test_cold_history()
+        test_search_index()
+        test_time_window()
+        test_parquet_export()
+        test_history_lines()
+        test_index_recovery()
+        test_archiver_registry()
+        test_chat_stats()
+        test_recent_window()
+        test_dedup()
+        test_media_queue()
+        test_media_store()
+        test_media_store_concurrent_save()
+        test_storage_quota()
+        test_media_groups()
+        test_media_layout()
+        test_media_naming()
+        test_sessions()
+        test_client_pool()
+        test_agent_scheduler()
+        test_list_media()
+        test_answer_cache()
+        test_import()
 
         print("\n" + "="*70)
         print("  ✅ ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")